@@ -1,10 +1,201 @@
-from django.contrib import admin
-from .models import Branch, Department, Voter, Candidate, Poll, Choice, Vote
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from . import bulk
+from .models import Branch, Department, Voter, Candidate, Poll, Choice, Vote, Job
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts exactly up to EXACT_LIMIT rows; past that an unfiltered
+    changelist shows the table's estimated size instead of running
+    COUNT(*) over millions of ballots. Filtered lists are counted exactly,
+    through the filter's index. Pages are fetched by id first.
+    """
+    EXACT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        capped = queryset.order_by()[:self.EXACT_LIMIT + 1].count()
+        if capped <= self.EXACT_LIMIT:
+            return capped
+        if queryset.query.where:
+            return queryset.count()
+        return max(estimated_rows(queryset.model, queryset.db) or queryset.count(), capped)
+
+    def page(self, number):
+        # Find the page's ids first and join the related rows for just those:
+        # sorting a filter's matches with every select_related join attached
+        # costs seconds on a large vote table
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        ids = list(self.object_list.values_list('pk', flat=True)[bottom:bottom + self.per_page])
+        return self._get_page(self.object_list.filter(pk__in=ids), number, self)
+
+
+def estimated_rows(model, using):
+    """The planner's row estimate on PostgreSQL, the highest id on SQLite"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table has been analyzed
+        return row[0] if row and row[0] > 0 else None
+    # Ids are handed out in order, so the largest one is an upper bound
+    # read straight off the primary key
+    return model.objects.using(using).aggregate(largest=Max('pk'))['largest']
+
+
+class FastChangeListAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 admin.site.register(Branch)
 admin.site.register(Department)
-admin.site.register(Voter)
-admin.site.register(Candidate)
-admin.site.register(Poll)
-admin.site.register(Choice)
-admin.site.register(Vote)
+
+
+@admin.register(Voter)
+class VoterAdmin(FastChangeListAdmin):
+    list_display = ('id', 'name', 'srn', 'branch', 'is_voter')
+    list_filter = ('branch', 'is_voter')
+    list_select_related = ('branch',)
+    search_fields = ('name', 'srn')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Candidate)
+class CandidateAdmin(FastChangeListAdmin):
+    list_display = ('id', 'name', 'position', 'department', 'branch', 'is_candidate')
+    list_filter = ('department', 'branch')
+    list_select_related = ('department', 'branch')
+    search_fields = ('name',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(Poll)
+class PollAdmin(FastChangeListAdmin):
+    list_display = ('id', 'title', 'department', 'branch', 'pub_date', 'is_active', 'voting_method', 'results_frozen_at')
+    list_filter = ('department', 'branch', 'is_active', 'voting_method')
+    list_select_related = ('branch',)
+    ordering = ('-pub_date',)
+    readonly_fields = ('results_frozen_at',)
+    exclude = ('deleted_at',)
+    actions = ['close_polls', 'recount_polls', 'freeze_polls', 'archive_polls', 'delete_polls']
+
+    def get_actions(self, request):
+        # Replaced by delete_polls, which doesn't cascade inside the request
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def run_bulk(self, request, queryset, action):
+        result = bulk.run(action, queryset.values_list('id', flat=True), user=request.user)
+        if result.get('job'):
+            url = reverse('admin:polls_job_change', args=[result['job']])
+            self.message_user(request, format_html('Queued as <a href="{}">job #{}</a>.', url, result['job']))
+        return result
+
+    @admin.action(description='Close voting in selected elections')
+    def close_polls(self, request, queryset):
+        result = self.run_bulk(request, queryset, 'close')
+        self.message_user(request, f"Closed {result['closed']} election(s).")
+
+    @admin.action(description='Recount votes of selected elections')
+    def recount_polls(self, request, queryset):
+        result = self.run_bulk(request, queryset, 'recount')
+        self.message_user(request, f"Recounted {result['scanned']} votes, repaired {len(result['repaired'])} counter(s).")
+
+    @admin.action(description='Freeze results of selected elections')
+    def freeze_polls(self, request, queryset):
+        result = self.run_bulk(request, queryset, 'freeze')
+        self.message_user(request, f"Froze {result['frozen']} election(s), repaired {len(result['repaired'])} counter(s).")
+
+    @admin.action(description='Archive ballots of selected closed elections')
+    def archive_polls(self, request, queryset):
+        result = self.run_bulk(request, queryset, 'archive')
+        if result['skipped']:
+            titles = ', '.join(poll.title() for poll in Poll.objects.filter(pk__in=result['skipped']).order_by('pub_date'))
+            self.message_user(
+                request, f'Not archived (not held yet or already archived): {titles}.', messages.WARNING
+            )
+
+    @admin.action(description='Delete selected elections', permissions=['delete'])
+    def delete_polls(self, request, queryset):
+        result = self.run_bulk(request, queryset, 'delete')
+        self.message_user(request, f"Deleted {result['deleted']} election(s).")
+
+    def get_deleted_objects(self, objs, request):
+        # Listing every ballot that would cascade is what makes deleting
+        # a large election slow; its ballots are purged by a job instead
+        objs = list(objs)
+        return [str(obj) for obj in objs], {Poll._meta.verbose_name_plural: len(objs)}, set(), []
+
+    def delete_model(self, request, obj):
+        bulk.run('delete', [obj.id], user=request.user)
+
+
+@admin.register(Choice)
+class ChoiceAdmin(FastChangeListAdmin):
+    list_display = ('id', 'candidate', 'poll', 'votes')
+    list_filter = ('poll__department',)
+    # __str__ shows the candidate and the poll
+    list_select_related = ('candidate', 'poll')
+    raw_id_fields = ('poll', 'candidate')
+
+
+@admin.register(Vote)
+class VoteAdmin(FastChangeListAdmin):
+    list_display = ('id', 'voter', 'poll', 'choice', 'voted_at')
+    list_filter = ('poll', 'poll__department', 'voter__branch')
+    list_select_related = ('voter', 'poll', 'choice__candidate', 'choice__poll')
+    raw_id_fields = ('voter', 'poll', 'choice')
+    # Newest first through the primary key; other sorts would scan the table
+    ordering = ('-id',)
+    sortable_by = ('id',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'message', 'attempts', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    list_select_related = ('created_by',)
+    ordering = ('-created_at',)
+    readonly_fields = [field.name for field in Job._meta.fields] + ['output']
+    actions = ['retry', 'cancel']
+
+    @admin.display(description='Progress')
+    def progress(self, job):
+        if not job.progress_total:
+            return '-'
+        return f'{job.progress_done}/{job.progress_total} ({job.percent()}%)'
+
+    @admin.display(description='Output')
+    def output(self, job):
+        if job.status != Job.SUCCEEDED or not (job.result or {}).get('path'):
+            return '-'
+        return format_html('<a href="{}">Download</a>', reverse('polls:job_output', args=[job.id]))
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Retry selected failed or cancelled jobs')
+    def retry(self, request, queryset):
+        count = queryset.filter(status__in=[Job.FAILED, Job.CANCELLED]).update(
+            status=Job.QUEUED, attempts=0, run_after=timezone.now(), finished_at=None, message='Retry requested',
+        )
+        self.message_user(request, f'{count} job(s) queued again.')
+
+    @admin.action(description='Cancel selected queued jobs')
+    def cancel(self, request, queryset):
+        count = queryset.filter(status=Job.QUEUED).update(
+            status=Job.CANCELLED, finished_at=timezone.now(), message='Cancelled',
+        )
+        self.message_user(request, f'{count} job(s) cancelled.')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        # Connects the boot, shard connection, eligibility, metadata and voter context signal handlers
+        from . import boot, eligibility, metadata, sharding, voter_context  # noqa: F401
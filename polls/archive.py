@@ -0,0 +1,198 @@
+import hashlib
+import heapq
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import sharding
+from .models import BallotArchive, Choice, ChoiceTally, Poll, TurnoutCell, Vote, Voter
+
+FORMAT_VERSION = 1
+
+# One ballot: voter_id, choice_id, voted_at (microseconds since the epoch)
+RECORD = struct.Struct('<qqq')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _to_micros(ts):
+    delta = ts - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _from_micros(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def pack_ballots(rows):
+    """Pack (voter_id, choice_id, voted_at) rows into the archive record format"""
+    raw = bytearray()
+    for voter_id, choice_id, voted_at in rows:
+        raw += RECORD.pack(voter_id, choice_id, _to_micros(voted_at))
+    return bytes(raw)
+
+
+def pack_rankings(rows, width):
+    """
+    Pack (ranking, choice_id) rows into fixed-width uint32 records.
+
+    Rankings are truncated or zero padded to ``width`` ids; ballots without
+    a ranking keep just their first preference.
+    """
+    row_bytes = width * 4
+    raw = bytearray()
+    for ranking, choice_id in rows:
+        packed = bytes(ranking) if ranking else struct.pack('<I', choice_id)
+        raw += packed[:row_bytes].ljust(row_bytes, b'\0')
+    return bytes(raw)
+
+
+def unpack_archive(archive):
+    """Decompress and verify an archive, returning the raw record bytes"""
+    raw = zlib.decompress(bytes(archive.payload))
+    if hashlib.sha256(raw).hexdigest() != archive.checksum:
+        raise ValueError(f'Checksum mismatch in ballot archive for poll {archive.poll_id}')
+    if len(raw) != archive.ballot_count * RECORD.size:
+        raise ValueError(f'Ballot archive for poll {archive.poll_id} is truncated')
+    return raw
+
+
+def iter_archive(archive):
+    """Yield (voter_id, choice_id, voted_at) for every archived ballot"""
+    for voter_id, choice_id, micros in RECORD.iter_unpack(unpack_archive(archive)):
+        yield voter_id, choice_id, _from_micros(micros)
+
+
+def archivable_polls():
+    """Polls whose election date has passed and whose ballots are still in the Vote table"""
+    today = timezone.now().date()
+    return Poll.objects.filter(pub_date__date__lt=today, ballot_archive__isnull=True)
+
+
+def archive_poll(poll):
+    """
+    Move a closed poll's ballots from Vote into a BallotArchive.
+
+    Choice.votes is left as it is, so results pages keep showing the frozen
+    tally; a sharded poll's counters and turnout cells are copied into the
+    default database first, so they outlive its shard. Returns the new
+    archive.
+    """
+    if not poll.is_past_election():
+        raise ValueError(f'{poll} has not closed yet')
+
+    # The archive commits before any ballot is deleted, so a failure in
+    # between never loses ballots; every reader prefers the archive, and
+    # finish_interrupted() deletes whatever a stopped run left behind
+    ballot_db = sharding.db_for_poll(poll.id)
+    with transaction.atomic(using=ballot_db), transaction.atomic():
+        votes = Vote.objects.using(ballot_db).filter(poll=poll)
+        rows = votes.order_by('id').values_list('voter_id', 'choice_id', 'voted_at').iterator(chunk_size=5000)
+        raw = pack_ballots(rows)
+
+        rankings, ranking_width = None, 0
+        if poll.is_ranked():
+            ranking_width = poll.choices.count()
+            packed = pack_rankings(votes.order_by('id').values_list('ranking', 'choice_id').iterator(chunk_size=5000),
+                                   ranking_width)
+            rankings = zlib.compress(packed, 6)
+
+        archive = BallotArchive.objects.create(
+            poll=poll,
+            format_version=FORMAT_VERSION,
+            ballot_count=len(raw) // RECORD.size,
+            payload=zlib.compress(raw, 6),
+            checksum=hashlib.sha256(raw).hexdigest(),
+            rankings=rankings,
+            ranking_width=ranking_width,
+        )
+        if ballot_db != 'default':
+            _copy_shard_counters(poll.id, ballot_db)
+
+    delete_archived_ballots(poll.id)
+    return archive
+
+
+def _copy_shard_counters(poll_id, ballot_db):
+    counts = dict(ChoiceTally.objects.using(ballot_db).filter(poll_id=poll_id).values_list('choice_id', 'votes'))
+    choices = list(Choice.objects.filter(poll_id=poll_id).only('id', 'votes'))
+    for choice in choices:
+        choice.votes = counts.get(choice.id, 0)
+    Choice.objects.bulk_update(choices, ['votes'], batch_size=500)
+
+    cells = TurnoutCell.objects.using(ballot_db).filter(poll_id=poll_id)
+    TurnoutCell.objects.using('default').filter(poll_id=poll_id).delete()
+    TurnoutCell.objects.using('default').bulk_create([
+        TurnoutCell(poll_id=poll_id, branch_id=cell.branch_id, sex=cell.sex, age_band=cell.age_band,
+                    votes=cell.votes, eligible=cell.eligible)
+        for cell in cells
+    ], batch_size=500)
+
+
+def delete_archived_ballots(poll_id):
+    """
+    Delete an archived poll's ballots from Vote.
+
+    In short id-ordered transactions (see polls/deletion.py), so a large
+    poll doesn't hold the write lock, and with it every ballot being cast
+    in other polls, for the whole delete.
+    """
+    from . import deletion
+
+    votes = Vote.objects.using(sharding.db_for_poll(poll_id)).filter(poll_id=poll_id)
+    deleted, _ = deletion.delete_in_chunks(votes)
+    return deleted
+
+
+def finish_interrupted():
+    """Delete the ballots an archive run stopped before deleting; returns the poll ids"""
+    leftover = set(
+        Vote.objects.filter(poll__ballot_archive__isnull=False).order_by()
+        .values_list('poll_id', flat=True).distinct()
+    )
+    if sharding.is_enabled():
+        for poll_id in BallotArchive.objects.values_list('poll_id', flat=True):
+            db = sharding.db_for_poll(poll_id)
+            if db != 'default' and Vote.objects.using(db).filter(poll_id=poll_id).exists():
+                leftover.add(poll_id)
+    for poll_id in leftover:
+        delete_archived_ballots(poll_id)
+    return sorted(leftover)
+
+
+def iter_ballots(poll_id):
+    """Yield (voter_id, choice_id, voted_at) for a poll, from the archive if it has one"""
+    archive = BallotArchive.objects.filter(poll_id=poll_id).first()
+    if archive is not None:
+        yield from iter_archive(archive)
+        return
+
+    yield from (
+        Vote.objects.using(sharding.db_for_poll(poll_id))
+        .filter(poll_id=poll_id)
+        .order_by('id')
+        .values_list('voter_id', 'choice_id', 'voted_at')
+        .iterator(chunk_size=5000)
+    )
+
+
+def recent_archived_ballots(archive, limit):
+    """
+    Return the latest archived ballots as vote-like objects for templates.
+
+    Only the requested slice is hydrated, with one query for voters and one
+    for choices.
+    """
+    # Keeps just the latest `limit` records while walking the archive
+    records = heapq.nlargest(limit, RECORD.iter_unpack(unpack_archive(archive)), key=lambda record: record[2])
+
+    voters = Voter.objects.in_bulk({record[0] for record in records})
+    choices = Choice.objects.select_related('candidate').in_bulk({record[1] for record in records})
+    return [
+        SimpleNamespace(voter=voters.get(voter_id), choice=choices.get(choice_id), voted_at=_from_micros(micros))
+        for voter_id, choice_id, micros in records
+    ]
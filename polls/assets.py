@@ -0,0 +1,71 @@
+"""
+Third-party CSS, JS and fonts served from our own static files.
+
+Each asset is pinned to a version and downloaded into the polls app's
+static directory by `manage.py vendor_assets` (the Docker build runs it),
+so collectstatic fingerprints and compresses it along with our own files.
+Templates go through the {% vendor_url %} tag, which falls back to the
+pinned CDN URL when an asset hasn't been downloaded, e.g. in a fresh
+checkout; outside DEBUG that fallback is logged as a warning, once per
+asset and process, since it means the deploy skipped vendoring.
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+
+logger = logging.getLogger('polls.assets')
+
+# Where vendored files live, relative to polls/static/
+VENDOR_DIR = 'polls/vendor'
+
+VENDOR_ASSETS = {
+    'bootstrap_css': {
+        'path': f'{VENDOR_DIR}/bootstrap/5.3.0/css/bootstrap.min.css',
+        'url': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    },
+    'bootstrap_js': {
+        'path': f'{VENDOR_DIR}/bootstrap/5.3.0/js/bootstrap.bundle.min.js',
+        'url': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    },
+    'fontawesome_css': {
+        # Its ../webfonts/ files are fetched alongside
+        'path': f'{VENDOR_DIR}/fontawesome/6.4.0/css/all.min.css',
+        'url': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+    },
+    'chartjs': {
+        'path': f'{VENDOR_DIR}/chartjs/4.4.0/chart.umd.js',
+        'url': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js',
+    },
+    'open_sans_css': {
+        # Font files are saved next to it and the CSS rewritten to point at them
+        'path': f'{VENDOR_DIR}/open-sans/open-sans.css',
+        'url': 'https://fonts.googleapis.com/css2?family=Open+Sans:wght@300;400;500;600;700;800&display=swap',
+    },
+}
+
+_vendored = {}
+
+
+def source_path(key):
+    """Absolute path an asset is downloaded to"""
+    return os.path.join(os.path.dirname(__file__), 'static', VENDOR_ASSETS[key]['path'])
+
+
+def is_vendored(key):
+    if key not in _vendored:
+        _vendored[key] = finders.find(VENDOR_ASSETS[key]['path']) is not None
+        if not _vendored[key] and not settings.DEBUG:
+            logger.warning('%s is not vendored, serving it from %s; run `manage.py vendor_assets`',
+                           VENDOR_ASSETS[key]['path'], VENDOR_ASSETS[key]['url'])
+    return _vendored[key]
+
+
+def vendor_url(key):
+    """URL to load an asset from: our static copy if there is one, else the CDN"""
+    asset = VENDOR_ASSETS[key]
+    if is_vendored(key):
+        return static(asset['path'])
+    return asset['url']
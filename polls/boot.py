@@ -0,0 +1,193 @@
+"""
+Container startup.
+
+start.sh used to migrate, replay the seed scripts through the ORM and
+collect static files on every boot. `manage.py boot` runs the same steps
+but fingerprints what each one depends on and skips the ones already
+done for that fingerprint:
+
+- schema: the set of migrations on disk, recorded in BootStep once
+  migrate has run
+- seed: the source of initial_data.py and populate_dummy_data.py, also
+  recorded in BootStep
+- static: the collected files' sources, recorded in STATIC_ROOT (it
+  lives and dies with the collected files rather than the database)
+
+A fresh SQLite database is restored from a prebuilt snapshot (made at
+image build time with `manage.py boot --build-snapshot`), which already
+carries its schema and seed steps, instead of being migrated and seeded
+from scratch.
+
+The snapshot's seed polls are shifted to today so the demo elections
+stay open.
+
+The first request each process serves is logged with the time since
+start.sh began (BOOT_STARTED_AT), so cold start can be measured.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger('polls.boot')
+
+SEED_SCRIPTS = ('initial_data.py', 'populate_dummy_data.py')
+
+STATIC_FINGERPRINT_FILE = '.boot-fingerprint'
+
+
+def _digest(parts):
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else str(part).encode())
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def schema_fingerprint():
+    """Fingerprint of every migration on disk"""
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    return _digest(sorted(f'{app}.{name}' for app, name in loader.disk_migrations))
+
+
+def seed_fingerprint():
+    parts = []
+    for script in SEED_SCRIPTS:
+        with open(os.path.join(settings.BASE_DIR, script), 'rb') as f:
+            parts += [script, f.read()]
+    return _digest(parts)
+
+
+def static_fingerprint():
+    """Fingerprint of the files collectstatic would collect, and how it stores them"""
+    from django.contrib.staticfiles.finders import get_finders
+
+    parts = [settings.STORAGES['staticfiles']['BACKEND']]
+    for finder in get_finders():
+        for path, storage in finder.list(['CVS', '.*', '*~']):
+            with storage.open(path) as f:
+                parts += [path, hashlib.sha256(f.read()).hexdigest()]
+    return _digest(sorted(parts))
+
+
+def completed_steps(using='default'):
+    """{step name: fingerprint} of what this database has been through"""
+    from .models import BootStep
+    try:
+        return dict(BootStep.objects.using(using).values_list('name', 'fingerprint'))
+    except DatabaseError:
+        # Not migrated yet
+        return {}
+
+
+def record_step(name, fingerprint, using='default'):
+    from .models import BootStep
+    BootStep.objects.using(using).update_or_create(
+        name=name, defaults={'fingerprint': fingerprint, 'completed_at': timezone.now()}
+    )
+
+
+def static_collected(fingerprint):
+    path = os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE)
+    try:
+        with open(path) as f:
+            return f.read().strip() == fingerprint
+    except OSError:
+        return False
+
+
+def record_static(fingerprint):
+    with open(os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT_FILE), 'w') as f:
+        f.write(fingerprint)
+
+
+def sqlite_path(alias='default'):
+    database = settings.DATABASES[alias]
+    if database['ENGINE'] != 'django.db.backends.sqlite3':
+        return None
+    return str(database['NAME'])
+
+
+def database_is_empty(alias='default'):
+    path = sqlite_path(alias)
+    return path is not None and (not os.path.exists(path) or os.path.getsize(path) == 0)
+
+
+def copy_sqlite(source, target):
+    """Copy a SQLite database with the backup API, so a file being written is never half copied"""
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        with dst:
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def restore_snapshot(snapshot, alias='default'):
+    """Copy the seed snapshot into place and move its seed polls to today"""
+    from . import eligibility, metadata
+    from .models import BootStep, Poll
+
+    connections[alias].close()
+    copy_sqlite(snapshot, sqlite_path(alias))
+
+    built = BootStep.objects.using(alias).filter(name='snapshot').values_list('completed_at', flat=True).first()
+    if built is None:
+        return
+    shift = timezone.now().date() - timezone.localtime(built).date()
+    if shift:
+        polls = Poll.objects.using(alias)
+        poll_ids = list(polls.values_list('id', flat=True))
+        polls.update(pub_date=F('pub_date') + timedelta(days=shift.days))
+        for poll_id in poll_ids:
+            metadata.invalidate(poll_id)
+        eligibility.invalidate()
+
+
+def warm_up():
+    """
+    Import and compile what the first request would otherwise pay for.
+
+    Called from the WSGI/ASGI module, so with gunicorn --preload it runs
+    once in the master and every worker forks with it done. It doesn't
+    touch the database: forked workers must not share a connection.
+    """
+    from django.template import TemplateDoesNotExist
+    from django.template.loader import get_template
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+    for name in ('polls/index.html', 'polls/detail.html', 'polls/_ballot_body.html',
+                 'polls/results.html', 'polls/ballot.html', 'polls/stats.html', 'polls/login.html'):
+        try:
+            get_template(name)
+        except TemplateDoesNotExist:
+            continue
+    connections.close_all()
+
+
+def _first_request(sender, **kwargs):
+    request_started.disconnect(_first_request)
+    started = os.environ.get('BOOT_STARTED_AT')
+    if not started:
+        return
+    try:
+        seconds = time.time() - float(started)
+    except ValueError:
+        return
+    logger.info('pid %s served its first request %.2fs after start', os.getpid(), seconds)
+
+
+request_started.connect(_first_request)
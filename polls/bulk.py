@@ -0,0 +1,117 @@
+"""
+Operations on a set of polls at once.
+
+Used by the Poll admin actions and the staff API (POST /api/polls/bulk/).
+Each operation is one set-based pass over the selected polls: a single
+UPDATE, a single reconcile over their choices, or one queued job, rather
+than a request per poll. update() sends no signals, so every operation
+drops the cached metadata of the polls it touched.
+
+Archiving and deleting move or remove ballots, so they run as background
+jobs (see polls/jobs.py) and return the job; archiving also returns the
+polls it left out.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import deletion, eligibility, jobs, metadata, sharding
+from .models import Poll, TurnoutBucket
+
+
+def _invalidate(poll_ids):
+    for poll_id in poll_ids:
+        metadata.invalidate(poll_id)
+    eligibility.invalidate()
+
+
+def close(poll_ids):
+    """Stop voting in the polls; returns how many were still open"""
+    closed = Poll.objects.filter(pk__in=poll_ids, is_active=True).update(is_active=False)
+    _invalidate(poll_ids)
+    return {'closed': closed}
+
+
+def recount(poll_ids):
+    """Recompute the polls' vote counters from their ballots in one pass"""
+    from .tallies import reconcile
+
+    drifts, scanned = reconcile(repair=True, poll_ids=list(poll_ids))
+    _invalidate(poll_ids)
+    return {'scanned': scanned, 'repaired': [str(drift) for drift in drifts]}
+
+
+def _wait_for_ballots(poll_ids):
+    """
+    Let ballots already being cast into the polls' shards commit.
+
+    A ballot rechecks that its polls are open once it holds its database's
+    write lock (see casting.cast_votes). Closing a poll writes the default
+    database, which already waits for its ballots; a shard is a separate
+    file, so take its lock once with an UPDATE that matches nothing.
+    """
+    for poll_id in poll_ids:
+        db = sharding.db_for_poll(poll_id)
+        if db != 'default':
+            with transaction.atomic(using=db):
+                TurnoutBucket.objects.using(db).filter(poll_id=poll_id, votes__lt=0).update(votes=0)
+
+
+def freeze(poll_ids):
+    """Close the polls and make their recounted tallies final"""
+    poll_ids = list(Poll.objects.filter(pk__in=poll_ids, results_frozen_at__isnull=True).values_list('id', flat=True))
+    if not poll_ids:
+        return {'frozen': 0, 'repaired': []}
+    # Closed and committed first, and every ballot that saw the polls open
+    # committed after that, so no ballot lands between the recount and the
+    # freeze
+    close(poll_ids)
+    _wait_for_ballots(poll_ids)
+    with transaction.atomic():
+        result = recount(poll_ids)
+        frozen = Poll.objects.filter(pk__in=poll_ids).update(results_frozen_at=timezone.now())
+    _invalidate(poll_ids)
+    return {'frozen': frozen, 'repaired': result['repaired']}
+
+
+def archive(poll_ids, user=None):
+    """
+    Queue moving the ballots of the closed polls among these into archives.
+
+    Polls that can't be archived (still to be held or already archived)
+    are returned as skipped; no job is queued if that's all of them.
+    """
+    from .archive import archivable_polls
+
+    archivable = sorted(archivable_polls().filter(pk__in=poll_ids).values_list('id', flat=True))
+    skipped = sorted(set(poll_ids) - set(archivable))
+    if not archivable:
+        return {'job': None, 'skipped': skipped}
+    job = jobs.enqueue('archive_elections', {'poll_ids': archivable}, user=user, unique=True)
+    return {'job': job.id, 'skipped': skipped}
+
+
+def delete(poll_ids, user=None):
+    """Hide the polls now and queue purging them"""
+    deleted = deletion.mark_deleted(list(poll_ids))
+    job = jobs.enqueue('delete_polls', {'poll_ids': sorted(poll_ids)}, user=user, unique=True)
+    return {'deleted': deleted, 'job': job.id}
+
+
+ACTIONS = {
+    'close': close,
+    'recount': recount,
+    'freeze': freeze,
+    'archive': archive,
+    'delete': delete,
+}
+
+# Actions that queue a job on behalf of the user
+_QUEUED = {'archive', 'delete'}
+
+
+def run(action, poll_ids, user=None):
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown action: {action}')
+    if action in _QUEUED:
+        return ACTIONS[action](set(poll_ids), user=user)
+    return ACTIONS[action](set(poll_ids))
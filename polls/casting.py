@@ -0,0 +1,285 @@
+"""
+Casting several ballots at once.
+
+The combined ballot page lets a voter vote in every election open today
+with one POST. Eligibility and duplicate checks run once for the whole
+submission, and all Vote rows, rollups, counters and turnout cells are
+written in one transaction per ballot database. On PostgreSQL that transaction is a
+single statement.
+"""
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from . import demographics, eligibility, ranked, rollups, sharding, tallies
+from .models import Choice, Poll, TurnoutBucket, TurnoutCell, Vote
+
+
+class BallotError(Exception):
+    """A submission that can't be recorded; the message is shown to the voter"""
+
+
+class AlreadyVoted(BallotError):
+    def __init__(self, polls):
+        self.polls = polls
+        names = ', '.join(poll.title() for poll in polls)
+        super().__init__(f'You have already voted in: {names}.')
+
+
+def active_polls(branch_id):
+    """Polls a voter from branch_id can vote in today, with their choices and candidates loaded"""
+    today = timezone.now().date()
+    choices = Choice.objects.select_related('candidate').order_by('id')
+    return (
+        Poll.objects.filter(eligibility.open_to(branch_id), is_active=True, pub_date__date=today)
+        .order_by('pub_date')
+        .prefetch_related(Prefetch('choices', queryset=choices))
+    )
+
+
+def _group_by_database(poll_ids):
+    groups = defaultdict(list)
+    for poll_id in poll_ids:
+        groups[sharding.db_for_poll(poll_id)].append(poll_id)
+    return groups
+
+
+def voted_poll_ids(voter, poll_ids):
+    """Ids of the given polls the voter has a ballot in, with one query per ballot database"""
+    voted = set()
+    for db, ids in _group_by_database(poll_ids).items():
+        voted.update(
+            Vote.objects.using(db).filter(voter=voter, poll_id__in=ids).values_list('poll_id', flat=True)
+        )
+    return voted
+
+
+def parse_ranking(data, choices, prefix='rank_'):
+    """Return the choices in the voter's preference order from <prefix><choice id> fields"""
+    ranks = {}
+    for choice in choices:
+        value = data.get(f'{prefix}{choice.id}', '').strip()
+        if not value:
+            continue
+        try:
+            rank = int(value)
+        except ValueError:
+            raise BallotError('Rankings must be whole numbers.')
+        if rank < 1:
+            raise BallotError('Rankings start at 1.')
+        if rank in ranks:
+            raise BallotError('Each rank can only be given to one candidate.')
+        ranks[rank] = choice
+
+    if not ranks:
+        raise BallotError("You didn't rank any candidates.")
+    return [ranks[rank] for rank in sorted(ranks)]
+
+
+def parse_selections(data, polls):
+    """
+    Read the combined ballot form.
+
+    Plurality polls submit ``choice_<poll id>``, ranked polls
+    ``rank_<poll id>_<choice id>``; polls with nothing filled in are
+    skipped. Returns a list of (poll, choice, ranking) tuples.
+    """
+    selections = []
+    for poll in polls:
+        choices = list(poll.choices.all())
+        if poll.is_ranked():
+            prefix = f'rank_{poll.id}_'
+            if not any(data.get(f'{prefix}{choice.id}', '').strip() for choice in choices):
+                continue
+            try:
+                ranked_choices = parse_ranking(data, choices, prefix)
+            except BallotError as e:
+                raise BallotError(f'{poll.title()}: {e}')
+            ranking = ranked.encode_ranking([choice.id for choice in ranked_choices])
+            selections.append((poll, ranked_choices[0], ranking))
+            continue
+
+        value = data.get(f'choice_{poll.id}')
+        if not value:
+            continue
+        selected = next((choice for choice in choices if str(choice.id) == value), None)
+        if selected is None:
+            raise BallotError(f'{poll.title()}: the selected choice does not exist.')
+        selections.append((poll, selected, None))
+
+    if not selections:
+        raise BallotError("You didn't select a choice in any election.")
+    return selections
+
+
+def cast_votes(voter, selections):
+    """
+    Record a voter's ballots for several polls in one go.
+
+    ``selections`` is a list of (poll, choice, ranking) tuples as returned
+    by parse_selections. Every poll must be open today and to the voter's
+    branch; if the voter has already voted in any of them nothing is
+    written and AlreadyVoted is raised. Returns the created votes.
+
+    The transactions write before they read, leaving duplicate detection
+    to the unique (voter, poll) constraint and rechecking that the polls
+    are still open only once the writes hold the lock, so under SQLite
+    they wait for the write lock rather than failing on a read-to-write
+    lock upgrade.
+    """
+    polls = {poll.id: poll for poll, _, _ in selections}
+    closed = [poll for poll in polls.values() if not poll.is_currently_active()]
+    if closed:
+        raise BallotError(f'Voting is closed for: {", ".join(poll.title() for poll in closed)}.')
+    ineligible = [poll for poll in polls.values() if not eligibility.is_eligible(poll.id, voter.branch_id)]
+    if ineligible:
+        raise BallotError(f'You are not eligible to vote in: {", ".join(poll.title() for poll in ineligible)}.')
+
+    by_db = defaultdict(list)
+    for poll, choice, ranking in selections:
+        by_db[sharding.db_for_poll(poll.id)].append(Vote(voter=voter, poll=poll, choice=choice, ranking=ranking))
+
+    if list(by_db) == ['default'] and connections['default'].vendor == 'postgresql':
+        return _cast_in_one_statement(voter, polls, by_db['default'])
+
+    created = []
+    try:
+        # One transaction per ballot database, holding its ballots and the
+        # counters, rollups and turnout cells kept next to them, so a
+        # sharded ballot never waits on the default database's write lock
+        with ExitStack() as stack:
+            for db in by_db:
+                stack.enter_context(transaction.atomic(using=db))
+
+            for db, votes in by_db.items():
+                created += Vote.objects.using(db).bulk_create(votes)
+                poll_ids = [vote.poll_id for vote in votes]
+                tallies.record_votes(votes, using=db)
+                rollups.record_poll_votes(poll_ids, votes[0].voted_at, using=db)
+                demographics.record_votes(voter, poll_ids, using=db)
+
+            # The polls were checked against cached metadata; check again now
+            # that the ballot databases' write locks are held, so nothing lands
+            # in a poll closed or frozen meanwhile (see bulk.freeze)
+            _check_still_open(polls, _open_poll_ids(polls))
+    except IntegrityError:
+        # The voter already has a ballot in at least one of the polls
+        voted = voted_poll_ids(voter, polls)
+        if not voted:
+            raise
+        raise AlreadyVoted([polls[poll_id] for poll_id in sorted(voted)])
+
+    return created
+
+
+def _open_poll_ids(poll_ids):
+    return set(
+        Poll.objects.using('default')
+        .filter(pk__in=poll_ids, is_active=True, results_frozen_at__isnull=True)
+        .values_list('id', flat=True)
+    )
+
+
+def _check_still_open(polls, open_ids):
+    closed = [poll for poll_id, poll in polls.items() if poll_id not in open_ids]
+    if closed:
+        raise BallotError(f'Voting is closed for: {", ".join(poll.title() for poll in closed)}.')
+
+
+class _Conflict(Exception):
+    pass
+
+
+def _cast_in_one_statement(voter, polls, votes):
+    """
+    PostgreSQL: write the ballots, counters, turnout buckets and turnout
+    cells with one statement.
+
+    The ballot insert is ON CONFLICT DO NOTHING, so a voter who already
+    voted doesn't abort the transaction with an IntegrityError; a poll
+    coming back without a ballot rolls the whole submission back instead.
+    Polls without a cell for the voter's group yet are seeded afterwards,
+    in the same transaction.
+
+    Ballots only go into polls that are still open and not frozen, and
+    those rows are locked FOR SHARE until the transaction ends: concurrent
+    ballots don't wait on each other, but closing or freezing a poll waits
+    for them, and a ballot that waited on a close sees the poll closed.
+    """
+    connection = connections['default']
+    qn = connection.ops.quote_name
+    vote_table = qn(Vote._meta.db_table)
+    choice_table = qn(Choice._meta.db_table)
+    bucket_table = qn(TurnoutBucket._meta.db_table)
+    cell_table = qn(TurnoutCell._meta.db_table)
+    voted_at = timezone.now()
+    group = demographics.group_of(voter)
+
+    poll_table = qn(Poll._meta.db_table)
+    values = ', '.join(['(%s::bigint, %s::bigint, %s::bigint, %s::bytea)'] * len(votes))
+    buckets = ', '.join(['(%s, %s::timestamptz)'] * len(rollups.RESOLUTIONS))
+    sql = f"""
+        WITH ballot (voter_id, poll_id, choice_id, ranking) AS (VALUES {values}),
+        open_poll AS (
+            SELECT id FROM {poll_table}
+            WHERE id IN (SELECT poll_id FROM ballot) AND is_active AND results_frozen_at IS NULL AND deleted_at IS NULL
+            FOR SHARE
+        ),
+        cast_ballot AS (
+            INSERT INTO {vote_table} (voter_id, poll_id, choice_id, ranking, voted_at)
+            SELECT voter_id, poll_id, choice_id, ranking, %s FROM ballot
+            WHERE poll_id IN (SELECT id FROM open_poll)
+            ON CONFLICT (voter_id, poll_id) DO NOTHING
+            RETURNING id, poll_id, choice_id
+        ),
+        counted AS (
+            UPDATE {choice_table} SET votes = votes + 1
+            WHERE id IN (SELECT choice_id FROM cast_ballot)
+        ),
+        turnout AS (
+            INSERT INTO {bucket_table} (poll_id, resolution, bucket_start, votes)
+            SELECT cast_ballot.poll_id, bucket.resolution, bucket.bucket_start, 1
+            FROM cast_ballot CROSS JOIN (VALUES {buckets}) AS bucket (resolution, bucket_start)
+            ON CONFLICT (poll_id, resolution, bucket_start)
+            DO UPDATE SET votes = {bucket_table}.votes + EXCLUDED.votes
+        ),
+        grouped AS (
+            UPDATE {cell_table} SET votes = votes + 1
+            WHERE poll_id IN (SELECT poll_id FROM cast_ballot)
+            AND branch_id IS NOT DISTINCT FROM %s::bigint AND sex = %s AND age_band = %s
+            RETURNING poll_id
+        )
+        SELECT open_poll.id, cast_ballot.id, open_poll.id IN (SELECT poll_id FROM grouped)
+        FROM open_poll LEFT JOIN cast_ballot ON cast_ballot.poll_id = open_poll.id
+    """
+    params = [value for vote in votes for value in (voter.id, vote.poll_id, vote.choice_id, vote.ranking)]
+    params.append(voted_at)
+    for resolution, seconds in rollups.RESOLUTIONS.items():
+        params += [resolution, rollups.bucket_start(voted_at, seconds)]
+    params += list(group)
+
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            _check_still_open(polls, {poll_id for poll_id, _, _ in rows})
+            ids = {poll_id: vote_id for poll_id, vote_id, _ in rows}
+            if None in ids.values():
+                raise _Conflict
+            ungrouped = [poll_id for poll_id, _, counted in rows if not counted]
+            if ungrouped:
+                demographics.record_missing(voter, ungrouped, group)
+    except _Conflict:
+        voted = voted_poll_ids(voter, polls)
+        raise AlreadyVoted([polls[poll_id] for poll_id in sorted(voted)])
+
+    for vote in votes:
+        vote.pk = ids[vote.poll_id]
+        vote.voted_at = voted_at
+        vote._state.adding = False
+        vote._state.db = 'default'
+    return votes
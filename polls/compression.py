@@ -0,0 +1,118 @@
+"""
+Response compression for HTML and JSON.
+
+Pages such as the election statistics inline large JSON blobs, and none
+of it was compressed. CompressionMiddleware picks brotli or gzip from the
+request's Accept-Encoding (brotli only when the Brotli package is
+installed) and compresses text/html and application/json responses over
+MIN_SIZE bytes. Static files are left alone: WhiteNoise already serves
+their precompressed .br/.gz variants. Streaming responses are left alone
+too, so long-lived streams aren't buffered.
+"""
+import re
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_ACCEPT_ENCODING = re.compile(r'\s*([a-z*]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?', re.IGNORECASE)
+
+
+def get_config():
+    """Return the compression settings merged over the defaults"""
+    config = {
+        'ENABLED': True,
+        'MIN_SIZE': 1024,
+        'CONTENT_TYPES': ('text/html', 'application/json'),
+        'BROTLI_QUALITY': 5,
+    }
+    config.update(getattr(settings, 'RESPONSE_COMPRESSION', {}))
+    return config
+
+
+def accepted_encodings(header):
+    """The encodings a client accepts, as {name: q}"""
+    accepted = {}
+    for part in header.split(','):
+        match = _ACCEPT_ENCODING.fullmatch(part)
+        if match:
+            try:
+                accepted[match.group(1).lower()] = float(match.group(2) or 1)
+            except ValueError:
+                continue
+    return accepted
+
+
+def choose_encoding(header):
+    """Pick 'br' or 'gzip' for an Accept-Encoding header, or None"""
+    accepted = accepted_encodings(header)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = None
+    for encoding in candidates:
+        q = accepted.get(encoding, accepted.get('*', 0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def compress(content, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(content, quality=config['BROTLI_QUALITY'])
+    # Django's helper pads the gzip header with random bytes (BREACH mitigation)
+    return compress_string(content, max_random_bytes=100)
+
+
+class CompressionMiddleware:
+    """Compress HTML and JSON responses with brotli or gzip"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        config = get_config()
+        if not config['ENABLED'] or response.streaming or response.has_header('Content-Encoding'):
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in config['CONTENT_TYPES']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < config['MIN_SIZE']:
+            return response
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding, config)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The representation changed, so a strong ETag no longer matches it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,136 @@
+"""
+Deleting polls without stalling the vote path.
+
+poll.delete() cascades through every Vote and Choice in one transaction,
+and on SQLite that holds the database write lock (and so blocks every
+ballot being cast) for as long as the cascade takes. Instead:
+
+- mark_deleted() stamps Poll.deleted_at, which hides the poll from
+  Poll.objects and so from every view, straight away
+- purge() (run by the delete_polls job) then deletes the poll's ballots
+  in chunks, each in its own short transaction, with a pause in between
+  so queued votes get the lock, and finally deletes the poll itself
+
+The chunk size adapts: after every chunk it is scaled so the next one
+should take POLL_DELETION['MAX_LOCK_MS'], within MIN_CHUNK and MAX_CHUNK.
+A sharded poll's ballots are removed with its shard file instead.
+"""
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import eligibility, metadata, sharding
+
+
+def get_config():
+    """Return the deletion settings merged over the defaults"""
+    config = {
+        'MAX_LOCK_MS': 50,
+        'PAUSE_MS': 10,
+        'INITIAL_CHUNK': 500,
+        'MIN_CHUNK': 50,
+        'MAX_CHUNK': 20000,
+    }
+    config.update(getattr(settings, 'POLL_DELETION', {}))
+    return config
+
+
+def mark_deleted(poll_ids):
+    """Hide polls everywhere at once; their rows are purged later"""
+    from .models import Poll
+
+    marked = Poll.objects.filter(pk__in=poll_ids).update(deleted_at=timezone.now())
+    # update() sends no signals, so drop the cached metadata ourselves
+    for poll_id in poll_ids:
+        metadata.invalidate(poll_id)
+    eligibility.invalidate()
+    return marked
+
+
+def next_chunk(chunk, seconds, config):
+    """Scale the chunk size so the next transaction takes about MAX_LOCK_MS"""
+    target = config['MAX_LOCK_MS'] / 1000
+    if seconds > 0:
+        # Aim a little under the bound (chunk time isn't perfectly linear),
+        # and grow at most twofold so one fast chunk can't overshoot it
+        chunk = min(int(chunk * target * 0.8 / seconds), chunk * 2)
+    else:
+        chunk *= 2
+    return max(config['MIN_CHUNK'], min(chunk, config['MAX_CHUNK']))
+
+
+def delete_in_chunks(queryset, on_chunk=None, config=None):
+    """
+    Delete the rows of a queryset a chunk at a time.
+
+    Each chunk is one statement, DELETE ... WHERE id IN (SELECT id ...
+    LIMIT n), so the rows are picked under the lock that deletes them rather
+    than read first and then upgraded to a write. on_chunk(deleted,
+    lock_seconds) is called after each. Returns (rows deleted, longest
+    transaction in seconds).
+    """
+    config = config or get_config()
+    model = queryset.model
+    db = queryset.db
+    chunk = config['INITIAL_CHUNK']
+    deleted = 0
+    longest = 0.0
+    while True:
+        started = time.perf_counter()
+        # Nothing cascades from ballots or buckets, so Django deletes these
+        # with the single DELETE and no SELECT ahead of it
+        count, _ = model.objects.using(db).filter(pk__in=queryset.order_by('pk').values('pk')[:chunk]).delete()
+        seconds = time.perf_counter() - started
+        if not count:
+            break
+
+        deleted += count
+        longest = max(longest, seconds)
+        if on_chunk is not None:
+            on_chunk(deleted, seconds)
+        chunk = next_chunk(chunk, seconds, config)
+        # Let writers waiting on the lock in before the next chunk
+        time.sleep(config['PAUSE_MS'] / 1000)
+    return deleted, longest
+
+
+def purge(poll_ids, progress=None):
+    """
+    Delete polls and everything hanging off them in short transactions.
+
+    Live polls are marked deleted first. progress(done, total) is called as
+    ballots go. Returns a summary for the job result.
+    """
+    from .models import Poll, TurnoutBucket, Vote
+
+    config = get_config()
+    live = list(Poll.objects.filter(pk__in=poll_ids).values_list('id', flat=True))
+    if live:
+        mark_deleted(live)
+    poll_ids = list(Poll.all_objects.filter(pk__in=poll_ids).values_list('id', flat=True))
+    ballot_dbs = {poll_id: sharding.db_for_poll(poll_id) for poll_id in poll_ids}
+    in_default = [poll_id for poll_id, db in ballot_dbs.items() if db == 'default']
+    total = Vote.objects.filter(poll_id__in=in_default).count()
+    if progress is not None:
+        progress(0, total)
+
+    done = 0
+    longest = 0.0
+    for poll_id, db in ballot_dbs.items():
+        if db == 'default':
+            def on_chunk(deleted, seconds, before=done):
+                if progress is not None:
+                    progress(before + deleted, total)
+            deleted, seconds = delete_in_chunks(Vote.objects.filter(poll_id=poll_id), on_chunk, config)
+            done += deleted
+            longest = max(longest, seconds)
+            _, seconds = delete_in_chunks(TurnoutBucket.objects.filter(poll_id=poll_id), config=config)
+            longest = max(longest, seconds)
+
+        # What's left (choices, the archive, eligibility) is small
+        Poll.all_objects.filter(pk=poll_id).delete()
+        if db != 'default':
+            sharding.drop_shard(poll_id)
+
+    return {'polls': len(poll_ids), 'ballots': done, 'longest_lock_ms': round(longest * 1000, 1)}
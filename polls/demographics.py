@@ -0,0 +1,267 @@
+"""
+Turnout by voter group.
+
+TurnoutCell is a small cube keyed by (poll, branch, sex, age band) holding
+the ballots cast by that group and how many of its voters were eligible.
+Cells are kept next to their poll's ballots (in its shard when sharded,
+see polls/sharding.py), and every ballot bumps exactly one cell per poll
+inside the transaction that writes it, so in steady state a ballot costs
+one UPDATE for all its polls in a database.
+
+A poll's cells are seeded the first time one is missing: one grouped
+query over Voter gives the eligible count of every group the poll is open
+to. Eligible counts are therefore a snapshot of the electorate as of the
+poll's first ballot; `manage.py rebuild_demographics` recomputes the whole
+cube, ballots included, from Vote and Voter with one grouped query each.
+
+breakdown() slices the cube along any of its dimensions with a GROUP BY
+over the cells (one per database holding them), so its cost depends on
+the number of groups, never on the number of ballots.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+
+from . import sharding
+from .models import BallotArchive, Branch, Poll, TurnoutCell, Vote, Voter
+
+# (code, lowest age, highest age) in ascending order
+AGE_BANDS = [
+    ('0-17', None, 17),
+    ('18-20', 18, 20),
+    ('21-24', 21, 24),
+    ('25-29', 25, 29),
+    ('30-39', 30, 39),
+    ('40+', 40, None),
+]
+UNKNOWN_AGE = 'unknown'
+
+# Query parameter -> TurnoutCell field
+DIMENSIONS = {
+    'branch': 'branch_id',
+    'sex': 'sex',
+    'age': 'age_band',
+}
+
+
+def age_band(age):
+    if age is None:
+        return UNKNOWN_AGE
+    for code, _, highest in AGE_BANDS:
+        if highest is None or age <= highest:
+            return code
+
+
+def age_band_expression(field='age'):
+    """age_band() as SQL, for grouping voters in the database"""
+    whens = [When(**{f'{field}__isnull': True}, then=Value(UNKNOWN_AGE))]
+    whens += [When(**{f'{field}__lte': highest}, then=Value(code)) for code, _, highest in AGE_BANDS if highest is not None]
+    return Case(*whens, default=Value(AGE_BANDS[-1][0]))
+
+
+def group_of(voter):
+    """The (branch_id, sex, age_band) cell key of a voter"""
+    if not voter.sex:
+        # A stand-in from the session context that predates sex and age
+        voter = Voter.objects.only('branch_id', 'sex', 'age').get(pk=voter.pk)
+    return voter.branch_id, voter.sex, age_band(voter.age)
+
+
+def _cells(poll_ids, group, using):
+    branch_id, sex, band = group
+    return TurnoutCell.objects.using(using).filter(poll_id__in=poll_ids, branch_id=branch_id, sex=sex, age_band=band)
+
+
+def _by_database(poll_ids):
+    by_db = {}
+    for poll_id in poll_ids:
+        by_db.setdefault(sharding.db_for_poll(poll_id), []).append(poll_id)
+    return by_db
+
+
+def _electorate():
+    """{(branch_id, sex, age_band): registered voters} in one grouped query"""
+    rows = (
+        Voter.objects.filter(is_voter=True)
+        .annotate(band=age_band_expression())
+        .order_by()
+        .values_list('branch_id', 'sex', 'band')
+        .annotate(n=Count('id'))
+    )
+    return {(branch_id, sex, band): n for branch_id, sex, band, n in rows}
+
+
+def _open_to(poll_branch_id, electorate):
+    # Branch-scoped polls are only open to their branch (see polls/eligibility.py)
+    return {group: n for group, n in electorate.items() if poll_branch_id is None or group[0] == poll_branch_id}
+
+
+def seed(poll_ids, extra_group=None, using='default'):
+    """
+    Create the missing cells of polls whose cells live in `using` with
+    their eligible counts.
+
+    extra_group is also created (with nobody eligible) if the electorate
+    doesn't have it, e.g. for a ballot from a voter marked as not a voter.
+    """
+    electorate = _electorate()
+    branches = dict(Poll.all_objects.filter(pk__in=poll_ids).values_list('id', 'branch_id'))
+    cells = TurnoutCell.objects.using(using)
+    existing = set(
+        cells.filter(poll_id__in=poll_ids).values_list('poll_id', 'branch_id', 'sex', 'age_band')
+    )
+    new = []
+    for poll_id, poll_branch_id in branches.items():
+        groups = _open_to(poll_branch_id, electorate)
+        if extra_group is not None:
+            groups.setdefault(extra_group, 0)
+        new += [
+            TurnoutCell(poll_id=poll_id, branch_id=branch_id, sex=sex, age_band=band, eligible=n)
+            for (branch_id, sex, band), n in groups.items()
+            if (poll_id, branch_id, sex, band) not in existing
+        ]
+    # Another transaction may be seeding the same poll
+    cells.bulk_create(new, batch_size=500, ignore_conflicts=True)
+    return len(new)
+
+
+def record_votes(voter, poll_ids, using='default'):
+    """
+    Count one ballot by the voter in each of the polls, whose ballots are
+    in `using`.
+
+    Meant to run inside the transaction that records the ballots. One
+    UPDATE covers every poll whose cell for the voter's group exists; only
+    a group's first ballot in a poll gets any further.
+    """
+    poll_ids = list(poll_ids)
+    if not poll_ids:
+        return
+    group = group_of(voter)
+    if _cells(poll_ids, group, using).update(votes=F('votes') + 1) >= len(poll_ids):
+        return
+    have = set(_cells(poll_ids, group, using).values_list('poll_id', flat=True))
+    missing = [poll_id for poll_id in poll_ids if poll_id not in have]
+    record_missing(voter, missing, group, using)
+
+
+def record_missing(voter, poll_ids, group=None, using='default'):
+    """Seed the polls' cells and count the voter's ballot in them"""
+    group = group or group_of(voter)
+    seed(poll_ids, extra_group=group, using=using)
+    _cells(poll_ids, group, using).update(votes=F('votes') + 1)
+
+
+def rebuild(poll_ids=None):
+    """Recompute the cube from Vote and Voter; returns the number of cells"""
+    # Archived polls no longer have Vote rows, so keep the cells they closed with
+    archived = set(BallotArchive.objects.values_list('poll_id', flat=True))
+    polls = Poll.objects.exclude(pk__in=archived)
+    if poll_ids is not None:
+        polls = polls.filter(pk__in=poll_ids)
+    branches = dict(polls.values_list('id', 'branch_id'))
+
+    electorate = _electorate()
+    by_db = _by_database(branches)
+    voter_groups = _voter_groups() if set(by_db) - {'default'} else None
+    total = 0
+    for db, ids in by_db.items():
+        with transaction.atomic(using=db):
+            counts = {}
+            for poll_id in ids:
+                for group, n in _open_to(branches[poll_id], electorate).items():
+                    counts[(poll_id, *group)] = [0, n]
+
+            for (poll_id, *group), n in _ballots(ids, db, voter_groups):
+                counts.setdefault((poll_id, *group), [0, 0])[0] += n
+
+            cells = TurnoutCell.objects.using(db)
+            cells.filter(poll_id__in=ids).delete()
+            cells.bulk_create([
+                TurnoutCell(poll_id=poll_id, branch_id=branch_id, sex=sex, age_band=band, votes=votes, eligible=eligible)
+                for (poll_id, branch_id, sex, band), (votes, eligible) in counts.items()
+            ], batch_size=500)
+        total += len(counts)
+    return total
+
+
+def _voter_groups():
+    """{voter_id: (branch_id, sex, age_band)} of every voter"""
+    return {
+        voter_id: (branch_id, sex, age_band(age))
+        for voter_id, branch_id, sex, age in Voter.objects.values_list('id', 'branch_id', 'sex', 'age')
+    }
+
+
+def _ballots(poll_ids, using, voter_groups):
+    """((poll_id, branch_id, sex, age_band), ballots) for the polls' ballots in `using`"""
+    if using == 'default':
+        rows = (
+            Vote.objects.filter(poll_id__in=poll_ids)
+            .annotate(band=age_band_expression('voter__age'))
+            .order_by()
+            .values_list('poll_id', 'voter__branch_id', 'voter__sex', 'band')
+            .annotate(n=Count('id'))
+        )
+        for poll_id, branch_id, sex, band, n in rows:
+            yield (poll_id, branch_id, sex, band), n
+        return
+
+    # Shards have no voter table to join against, so their voters' groups
+    # come from voter_groups
+    rows = Vote.objects.using(using).filter(poll_id__in=poll_ids).values_list('poll_id', 'voter_id')
+    for poll_id, voter_id in rows.iterator():
+        yield (poll_id, *voter_groups.get(voter_id, (None, '', UNKNOWN_AGE))), 1
+
+
+def breakdown(poll_ids, by):
+    """
+    Turnout of the polls grouped by some of DIMENSIONS, with one query over
+    the cells of each database holding them.
+
+    Returns a list of {'group': {dimension: label}, 'votes', 'eligible',
+    'turnout'} ordered by group, with turnout in percent (None when nobody
+    in the group was eligible).
+    """
+    fields = [DIMENSIONS[dimension] for dimension in by]
+    totals = {'total_votes': Sum('votes'), 'total_eligible': Sum('eligible')}
+    grouped = {}
+    for db, ids in _by_database(poll_ids).items():
+        cells = TurnoutCell.objects.using(db).filter(poll_id__in=ids).order_by()
+        for row in cells.values(*fields).annotate(**totals) if fields else [cells.aggregate(**totals)]:
+            key = tuple(row[field] for field in fields)
+            total = grouped.setdefault(key, {**dict(zip(fields, key)), 'total_votes': 0, 'total_eligible': 0})
+            total['total_votes'] += row['total_votes'] or 0
+            total['total_eligible'] += row['total_eligible'] or 0
+    if not fields:
+        grouped.setdefault((), {'total_votes': 0, 'total_eligible': 0})
+    rows = grouped.values()
+    labels = _labels() if 'branch' in by else {}
+    sexes = dict(Voter.GENDER_CHOICES)
+    bands = [code for code, _, _ in AGE_BANDS] + [UNKNOWN_AGE]
+
+    result = []
+    for row in rows:
+        group = {}
+        for dimension, field in zip(by, fields):
+            value = row[field]
+            if dimension == 'branch':
+                group[dimension] = labels.get(value, 'No branch')
+            elif dimension == 'sex':
+                group[dimension] = sexes.get(value, 'Not given')
+            else:
+                group[dimension] = value
+        votes, eligible = row['total_votes'] or 0, row['total_eligible'] or 0
+        result.append({
+            'group': group,
+            'votes': votes,
+            'eligible': eligible,
+            'turnout': round(votes / eligible * 100, 1) if eligible else None,
+            'order': tuple(bands.index(row[field]) if field == 'age_band' else str(group[dimension])
+                           for dimension, field in zip(by, fields)),
+        })
+    result.sort(key=lambda item: item.pop('order'))
+    return result
+
+
+def _labels():
+    return {branch.id: branch.branch_name for branch in Branch.objects.only('branch_name')}
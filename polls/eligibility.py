@@ -0,0 +1,82 @@
+"""
+Branch-scoped eligibility.
+
+A poll with a branch is only open to voters of that branch; polls without
+one are open to everyone. The poll -> eligible branches map is built with
+a single query and kept in process memory, so checking eligibility on the
+vote path costs no queries. Lists of polls are filtered with open_to()
+instead, as part of their own (date-bounded) query.
+
+Saving or deleting a poll drops the local copy and bumps a version number
+in the cache, which other workers compare against on their next lookup.
+With a per-process cache backend they can't see that bump, so entries
+also expire after MAX_AGE seconds.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import replicas
+from .models import Poll
+
+VERSION_KEY = 'polls:eligibility:version'
+
+# Longest a worker keeps a map without noticing another worker's poll edits
+MAX_AGE = 60
+
+_lock = threading.Lock()
+_index = {'version': None, 'loaded_at': 0.0, 'branches': None}
+
+
+def _build():
+    """{poll id: frozenset of branch ids} for every branch-scoped poll"""
+    branches = {}
+    with replicas.use_primary():
+        for poll_id, branch_id in Poll.objects.filter(branch__isnull=False).values_list('id', 'branch_id'):
+            branches[poll_id] = frozenset([branch_id])
+    return branches
+
+
+def branch_map():
+    version = cache.get(VERSION_KEY, 0)
+    now = time.monotonic()
+    with _lock:
+        if (_index['branches'] is not None and _index['version'] == version
+                and now - _index['loaded_at'] < MAX_AGE):
+            return _index['branches']
+
+    branches = _build()
+    with _lock:
+        _index.update(version=version, loaded_at=now, branches=branches)
+    return branches
+
+
+def invalidate():
+    with _lock:
+        _index['branches'] = None
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def is_eligible(poll_id, branch_id):
+    branches = branch_map().get(poll_id)
+    return branches is None or branch_id in branches
+
+
+def open_to(branch_id):
+    """Q for the polls a voter from branch_id can vote in"""
+    if branch_id is None:
+        return Q(branch__isnull=True)
+    return Q(branch__isnull=True) | Q(branch_id=branch_id)
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+def _poll_changed(sender, **kwargs):
+    invalidate()
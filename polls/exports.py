@@ -0,0 +1,166 @@
+import csv
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+
+from . import archive, tallies
+from .models import Poll, Choice
+
+# Rows fetched per database round trip while streaming
+CHUNK_SIZE = 2000
+
+# Rows are buffered into chunks of roughly this many bytes before being sent
+BUFFER_BYTES = 64 * 1024
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+TALLY_HEADER = ['poll_id', 'poll', 'department', 'election_date', 'choice_id',
+                'candidate', 'position', 'votes', 'percentage']
+DEPARTMENT_HEADER = ['department', 'elections', 'candidates', 'votes']
+BALLOT_HEADER = ['poll_id', 'choice_id', 'candidate', 'voted_at', 'voter_token']
+
+
+def voter_token(voter_id):
+    """
+    Pseudonymous, stable token for a voter.
+
+    Lets auditors check one-ballot-per-voter in the exported ledger without
+    revealing who the voter is.
+    """
+    digest = hmac.new(settings.SECRET_KEY.encode(), str(voter_id).encode(), hashlib.sha256)
+    return digest.hexdigest()[:16]
+
+
+def tally_rows(poll_ids=None):
+    # Choices of deleted polls linger until the poll is purged
+    choices = Choice.objects.filter(poll__deleted_at__isnull=True)
+    if poll_ids is not None:
+        choices = choices.filter(poll_id__in=poll_ids)
+
+    totals = dict(
+        choices.order_by().values('poll_id').annotate(total=Sum('votes')).values_list('poll_id', 'total')
+    )
+    # Sharded polls keep their counters in their shards
+    sharded = tallies.sharded_votes(poll_ids)
+    totals.update({poll_id: sum(counts.values()) for poll_id, counts in sharded.items()})
+
+    rows = (
+        choices.select_related('poll', 'candidate')
+        .order_by('poll_id', 'id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for choice in rows:
+        poll = choice.poll
+        total = totals.get(poll.id) or 0
+        if poll.id in sharded:
+            choice.votes = sharded[poll.id].get(choice.id, 0)
+        yield [
+            poll.id,
+            poll.title(),
+            poll.department or '',
+            poll.pub_date.date().isoformat(),
+            choice.id,
+            choice.candidate.name if choice.candidate else 'Unknown',
+            choice.candidate.position if choice.candidate else '',
+            choice.votes,
+            round(choice.votes / total * 100, 1) if total else 0,
+        ]
+
+
+def department_rows(poll_ids=None):
+    polls = Poll.objects.all()
+    if poll_ids is not None:
+        polls = polls.filter(pk__in=poll_ids)
+
+    elections = dict(polls.order_by().values('department').annotate(n=Count('id')).values_list('department', 'n'))
+    # Sharded polls keep their counters in their shards
+    sharded = tallies.sharded_votes(poll_ids)
+    choice_stats = {
+        row['poll__department']: row
+        for row in Choice.objects.filter(poll__in=polls).order_by()
+        .values('poll__department')
+        .annotate(candidates=Count('candidate_id', distinct=True),
+                  votes=Sum('votes', filter=~Q(poll_id__in=list(sharded))))
+    }
+    for poll_id, department in polls.filter(pk__in=list(sharded)).values_list('id', 'department'):
+        if department in choice_stats:
+            stats = choice_stats[department]
+            stats['votes'] = (stats['votes'] or 0) + sum(sharded[poll_id].values())
+
+    for department, _ in Poll.DEPARTMENT_CHOICES:
+        if department not in elections:
+            continue
+        stats = choice_stats.get(department, {})
+        yield [department, elections[department], stats.get('candidates', 0), stats.get('votes') or 0]
+
+
+def ballot_rows(poll_ids=None):
+    polls = Poll.objects.order_by('id')
+    if poll_ids is not None:
+        polls = polls.filter(pk__in=poll_ids)
+
+    # Candidate names are looked up once rather than joined per row
+    names = dict(
+        Choice.objects.filter(candidate__isnull=False)
+        .values_list('id', 'candidate__name')
+    )
+
+    # Closed polls may have been moved to a ballot archive; iter_ballots reads
+    # whichever store holds the poll's ballots
+    for poll_id in polls.values_list('id', flat=True):
+        for voter_id, choice_id, voted_at in archive.iter_ballots(poll_id):
+            yield [poll_id, choice_id, names.get(choice_id, 'Unknown'), voted_at.isoformat(), voter_token(voter_id)]
+
+
+EXPORTS = {
+    'tally': (TALLY_HEADER, tally_rows),
+    'departments': (DEPARTMENT_HEADER, department_rows),
+    'ballots': (BALLOT_HEADER, ballot_rows),
+}
+
+
+class _Echo:
+    """File-like object whose write() just hands back the line, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def _encode_csv(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _encode_jsonl(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), default=str) + '\n'
+
+
+def _buffered(lines):
+    # Sending one chunk per row is slow; group rows into ~64KB chunks instead
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_BYTES:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export_stream(kind, fmt, poll_ids=None):
+    """Return an iterator of text chunks for the given export"""
+    header, rows = EXPORTS[kind]
+    encode = _encode_csv if fmt == 'csv' else _encode_jsonl
+    return _buffered(encode(header, rows(poll_ids)))
@@ -11,9 +11,10 @@ class UserRegistrationForm(UserCreationForm):
 class VoterProfileForm(forms.ModelForm):
     class Meta:
         model = Voter
-        fields = ('age', 'sex', 'srn')
+        fields = ('age', 'sex', 'srn', 'branch')
         widgets = {
             'sex': forms.Select(attrs={'class': 'form-control'}),
+            'branch': forms.Select(attrs={'class': 'form-control'}),
         }
 
 class CandidateRegistrationForm(forms.ModelForm):
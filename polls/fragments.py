@@ -0,0 +1,74 @@
+"""
+Pre-rendered ballot fragments.
+
+The candidate list on a poll's detail page is the same for every voter,
+so it is rendered once per poll version and state and reused. The only
+per-request part inside it, the CSRF token, is left as a sentinel and
+spliced in with a string replace. Messages, errors and staff buttons stay
+in detail.html around the fragment.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import get_template, render_to_string
+from django.utils.html import escape
+
+from . import metadata
+
+TEMPLATE = 'polls/_ballot_body.html'
+
+CSRF_SENTINEL = '__BALLOT_CSRF_TOKEN__'
+
+# Fragments kept per process
+LRU_SIZE = 256
+
+# Seconds a fragment lives in the shared cache
+CACHE_TIMEOUT = 24 * 60 * 60
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+_template_hash = None
+
+
+def _state(poll):
+    # Whether voting is open depends on today's date, so it is part of the key
+    if poll.is_currently_active():
+        return 'open'
+    return 'active' if poll.is_active else 'closed'
+
+
+def _template_fingerprint():
+    # A deploy that changes the template must not reuse old fragments
+    global _template_hash
+    if _template_hash is None:
+        source = get_template(TEMPLATE).template.source
+        _template_hash = hashlib.sha1(source.encode()).hexdigest()[:12]
+    return _template_hash
+
+
+def _fragment(poll):
+    key = f'polls:ballot:{poll.id}:{metadata.version(poll.id)}:{_state(poll)}:{_template_fingerprint()}'
+    with _lock:
+        html = _lru.get(key)
+        if html is not None:
+            _lru.move_to_end(key)
+            return html
+
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string(TEMPLATE, {'poll': poll, 'csrf_sentinel': CSRF_SENTINEL})
+        cache.set(key, html, CACHE_TIMEOUT)
+
+    with _lock:
+        _lru[key] = html
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
+    return html
+
+
+def ballot_body(request, poll):
+    """The poll's ballot body HTML with this request's CSRF token filled in"""
+    return _fragment(poll).replace(CSRF_SENTINEL, escape(get_token(request)))
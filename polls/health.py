@@ -0,0 +1,193 @@
+"""
+Liveness and readiness probes.
+
+/health/live/ (and the old /health/) only says the process is serving
+requests. /health/ready/ tells the load balancer whether this worker
+should get traffic:
+
+- database: the default database answers a trivial query
+- schema: every migration on disk has been applied
+- cache: the shared cache takes a write and reads it back
+- metadata: every poll open today has its metadata in the shared cache;
+  polls that went cold (an edit replaces the version) are warmed here,
+  so one save in the admin can't take every worker out of rotation
+- ingestion: how far ballots are ahead of the reconcile_tallies
+  watermark; only fails when READINESS['MAX_INGESTION_LAG'] is set
+
+Each check runs on its own pool thread with READINESS['TIMEOUT'] seconds
+to answer, and the combined result is kept for READINESS['CACHE_SECONDS']
+so a burst of probes costs one evaluation per worker. A check still stuck
+from an earlier probe isn't started again (it fails until it returns), so
+hung checks can't pile up and take the pool.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from . import metadata, sharding
+
+_lock = threading.Lock()
+# The future of each check's latest run
+_running = {}
+_last = {'result': None, 'at': 0.0}
+_disk_migrations = None
+
+
+class NotReady(Exception):
+    pass
+
+
+def get_config():
+    """Return the readiness settings merged over the defaults"""
+    config = {
+        'TIMEOUT': 1.0,
+        'CACHE_SECONDS': 5.0,
+        'MAX_INGESTION_LAG': None,
+    }
+    config.update(getattr(settings, 'READINESS', {}))
+    return config
+
+
+def check_database():
+    with connections['default'].cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+    return 'ok'
+
+
+def check_schema():
+    global _disk_migrations
+    if _disk_migrations is None:
+        # Migrations on disk don't change while the process runs
+        _disk_migrations = set(MigrationLoader(None, ignore_no_migrations=True).disk_migrations)
+    applied = set(MigrationRecorder(connections['default']).applied_migrations())
+    missing = sorted(f'{app}.{name}' for app, name in _disk_migrations - applied)
+    if missing:
+        raise NotReady(f'{len(missing)} unapplied migration(s), e.g. {missing[0]}')
+    return f'{len(_disk_migrations)} migrations applied'
+
+
+def check_cache():
+    token = str(time.time_ns())
+    cache.set('polls:readiness-probe', token, 60)
+    if cache.get('polls:readiness-probe') != token:
+        raise NotReady('cache did not return the value just written')
+    return 'ok'
+
+
+def check_metadata():
+    from .models import Poll
+
+    today = timezone.now().date()
+    poll_ids = list(Poll.objects.filter(is_active=True, pub_date__date=today).values_list('id', flat=True))
+    cold = [poll_id for poll_id in poll_ids if not metadata.is_cached(poll_id)]
+    if cold:
+        metadata.warm(cold)
+        return f'{len(poll_ids)} open poll(s) warm, {len(cold)} warmed now'
+    return f'{len(poll_ids)} open poll(s) warm'
+
+
+def check_ingestion():
+    from .models import Vote
+    from .tallies import unreconciled_votes
+
+    # Every ballot database (shards included) has its own watermark
+    pending = {db: unreconciled_votes(db) for db in sharding.ballot_databases()}
+    if all(votes is None for votes in pending.values()):
+        return 'no watermark (reconcile_tallies not in use)'
+
+    oldest = None
+    for db, votes in pending.items():
+        if votes is None:
+            # Not reconciled incrementally yet, so none of its ballots are
+            votes = Vote.objects.using(db).all()
+        voted_at = votes.order_by('voted_at').values_list('voted_at', flat=True).first()
+        if voted_at is not None and (oldest is None or voted_at < oldest):
+            oldest = voted_at
+    if oldest is None:
+        return 'caught up'
+
+    lag = (timezone.now() - oldest).total_seconds()
+    max_lag = get_config()['MAX_INGESTION_LAG']
+    if max_lag is not None and lag > max_lag:
+        raise NotReady(f'oldest unreconciled ballot is {lag:.0f}s old (limit {max_lag}s)')
+    return f'oldest unreconciled ballot is {lag:.0f}s old'
+
+
+CHECKS = {
+    'database': check_database,
+    'schema': check_schema,
+    'cache': check_cache,
+    'metadata': check_metadata,
+    'ingestion': check_ingestion,
+}
+
+# One thread per check, so no check waits behind another for a thread
+_executor = ThreadPoolExecutor(max_workers=len(CHECKS), thread_name_prefix='readiness')
+
+
+def _run(check):
+    started = time.perf_counter()
+    try:
+        return check(), time.perf_counter() - started
+    finally:
+        # Pool threads keep their own connections; don't leave them open
+        connections.close_all()
+
+
+def evaluate():
+    config = get_config()
+    results = {}
+    futures = {}
+    for name, check in CHECKS.items():
+        previous = _running.get(name)
+        if previous is not None and not previous.done():
+            # Hung since an earlier probe: report it rather than queue
+            # another run behind it
+            results[name] = {'ok': False, 'detail': 'still running from an earlier probe'}
+            continue
+        futures[name] = _running[name] = _executor.submit(_run, check)
+
+    deadline = time.monotonic() + config['TIMEOUT']
+    for name, future in futures.items():
+        try:
+            detail, seconds = future.result(timeout=max(deadline - time.monotonic(), 0))
+            results[name] = {'ok': True, 'detail': detail, 'ms': round(seconds * 1000, 1)}
+        except FutureTimeout:
+            results[name] = {'ok': False, 'detail': f'no answer within {config["TIMEOUT"]}s'}
+        except Exception as e:
+            results[name] = {'ok': False, 'detail': str(e) or e.__class__.__name__}
+
+    return {
+        'ready': all(result['ok'] for result in results.values()),
+        'checks': {name: results[name] for name in CHECKS},
+        'checked_at': timezone.now().isoformat(),
+    }
+
+
+def readiness():
+    """The latest readiness result, re-evaluated at most every CACHE_SECONDS"""
+    max_age = get_config()['CACHE_SECONDS']
+    with _lock:
+        if _last['result'] is None or time.monotonic() - _last['at'] >= max_age:
+            _last['result'] = evaluate()
+            _last['at'] = time.monotonic()
+        return _last['result']
+
+
+def live(request):
+    return HttpResponse('OK')
+
+
+def ready(request):
+    result = readiness()
+    return JsonResponse(result, status=200 if result['ready'] else 503)
@@ -0,0 +1,266 @@
+"""
+A small database-backed job queue.
+
+Work that is too heavy for a request (purging a deleted poll's
+ballots, archiving closed elections, recomputing tallies, writing
+exports) is stored as a Job row and run by `manage.py run_jobs`, which
+start.sh keeps running next to the web server. No broker is needed: the
+jobs table is the queue.
+
+A runner claims a job with a conditional UPDATE (status still queued),
+or on PostgreSQL with SELECT ... FOR UPDATE SKIP LOCKED, so two runners
+never take the same job, and holds it with a lease. A job whose runner
+died is requeued once its lease is older than LEASE_SECONDS. A failed
+attempt is retried with exponential backoff up to the job's max_attempts.
+
+Handlers are registered with @handler('kind') and are called with the Job
+and its payload as keyword arguments. They can report progress with
+report(job, done, total, message), which is what the admin shows.
+
+Housekeeping that has to happen on a schedule (purging expired sessions)
+is listed in settings.RECURRING_JOBS; idle runners queue each kind once
+its interval has passed.
+"""
+import logging
+import os
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('polls.jobs')
+
+# Seconds before a running job whose runner stopped reporting is requeued
+LEASE_SECONDS = 15 * 60
+
+# First retry delay in seconds, doubled for every further attempt
+RETRY_BASE_SECONDS = 30
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=3, unique=False):
+    """
+    Queue a job and return it.
+
+    With unique=True nothing is added while a job of the same kind and
+    payload is still queued or running; that job is returned instead.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    payload = payload or {}
+    if unique:
+        pending = Job.objects.filter(kind=kind, payload=payload, status__in=[Job.QUEUED, Job.RUNNING]).first()
+        if pending is not None:
+            return pending
+    return Job.objects.create(
+        kind=kind,
+        payload=payload,
+        max_attempts=max_attempts,
+        # By id: request.user may be the voter context's stand-in
+        created_by_id=user.pk if user is not None and user.is_authenticated else None,
+    )
+
+
+def report(job, done, total=None, message=None):
+    """Record a job's progress; also renews its lease"""
+    job.progress_done = done
+    fields = {'progress_done': done, 'locked_at': timezone.now()}
+    if total is not None:
+        job.progress_total = fields['progress_total'] = total
+    if message is not None:
+        job.message = fields['message'] = message[:255]
+    Job.objects.filter(pk=job.pk).update(**fields)
+
+
+def requeue_stale():
+    """Put back jobs whose runner stopped renewing its lease"""
+    cutoff = timezone.now() - timedelta(seconds=LEASE_SECONDS)
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff).update(
+        status=Job.QUEUED, locked_by='', locked_at=None, message='Requeued after its runner stopped'
+    )
+
+
+def claim(worker, kinds=None):
+    """Take the next due job for this runner, or return None"""
+    now = timezone.now()
+    candidates = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('run_after', 'id')
+    if kinds:
+        candidates = candidates.filter(kind__in=kinds)
+
+    if connection.features.has_select_for_update_skip_locked:
+        # PostgreSQL: runners lock different rows instead of racing for one
+        with transaction.atomic():
+            job = candidates.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            job.status, job.locked_by, job.locked_at, job.started_at, job.error = Job.RUNNING, worker, now, now, ''
+            job.attempts += 1
+            job.save(update_fields=['status', 'locked_by', 'locked_at', 'started_at', 'error', 'attempts'])
+        return job
+
+    for job_id in candidates.values_list('id', flat=True)[:10]:
+        # Only the runner whose UPDATE still sees the job queued gets it
+        claimed = Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now,
+            attempts=F('attempts') + 1, started_at=now, error='',
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def run(job):
+    """Run a claimed job and record how it ended"""
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise ValueError(f'Unknown job kind: {job.kind}')
+        result = func(job, **job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s attempt %s failed:\n%s', job, job.attempts, error)
+        if job.attempts < job.max_attempts:
+            delay = RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, locked_by='', locked_at=None, error=error,
+                run_after=timezone.now() + timedelta(seconds=delay),
+                message=f'Attempt {job.attempts} failed, retrying in {delay}s',
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED, locked_by='', error=error, finished_at=timezone.now(),
+                message=f'Failed after {job.attempts} attempt(s)',
+            )
+        return False
+
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.SUCCEEDED, locked_by='', result=result, finished_at=timezone.now(),
+        progress_done=F('progress_total'), message='Done',
+    )
+    return True
+
+
+def enqueue_recurring():
+    """Queue every recurring job whose interval has passed since it was last queued"""
+    for kind, seconds in getattr(settings, 'RECURRING_JOBS', {}).items():
+        # The cache key throttles this across runners sharing the cache;
+        # unique=True covers the ones that don't
+        if seconds and cache.add(f'polls:recurring:{kind}', True, seconds):
+            enqueue(kind, unique=True)
+
+
+def run_next(worker, kinds=None):
+    """Claim and run one job; returns False when nothing was due"""
+    close_old_connections()
+    job = claim(worker, kinds)
+    if job is None:
+        return False
+    try:
+        run(job)
+    finally:
+        close_old_connections()
+    return True
+
+
+def output_path(job, extension):
+    """Where a job writes a file for download"""
+    os.makedirs(settings.JOB_OUTPUT_DIR, exist_ok=True)
+    return os.path.join(settings.JOB_OUTPUT_DIR, f'{job.kind}-{job.pk}.{extension}')
+
+
+# Handlers
+
+@handler('delete_polls')
+def delete_polls(job, poll_ids):
+    from . import deletion
+
+    def progress(done, total):
+        report(job, done, total, f'Deleted {done} of {total} ballots')
+    return deletion.purge(poll_ids, progress)
+
+
+@handler('close_expired_polls')
+def close_expired_polls(job):
+    """Mark polls whose election day has passed as inactive"""
+    from . import metadata
+    from .models import Poll
+
+    today = timezone.now().date()
+    expired_ids = list(Poll.objects.filter(pub_date__date__lt=today, is_active=True).values_list('id', flat=True))
+    if expired_ids:
+        Poll.objects.filter(pk__in=expired_ids).update(is_active=False)
+        # update() sends no signals, so drop the cached metadata ourselves
+        for poll_id in expired_ids:
+            metadata.invalidate(poll_id)
+    return {'closed': expired_ids}
+
+
+@handler('purge_sessions')
+def purge_sessions(job):
+    from . import sessions
+
+    return {'purged': sessions.purge_expired()}
+
+
+@handler('archive_elections')
+def archive_elections(job, poll_ids=None):
+    from . import archive
+
+    archive.finish_interrupted()
+    polls = archive.archivable_polls()
+    if poll_ids:
+        polls = polls.filter(pk__in=poll_ids)
+    polls = list(polls)
+    archived = {}
+    report(job, 0, len(polls), f'Archiving {len(polls)} election(s)')
+    for done, poll in enumerate(polls, 1):
+        archived[poll.id] = archive.archive_poll(poll).ballot_count
+        report(job, done)
+    return {'archived': archived}
+
+
+@handler('reconcile_tallies')
+def reconcile_tallies(job, incremental=False, poll_ids=None):
+    from .tallies import reconcile
+
+    report(job, 0, 1, 'Recomputing vote counters')
+    drifts, scanned = reconcile(incremental=incremental, repair=True, poll_ids=poll_ids)
+    return {'scanned': scanned, 'repaired': [str(drift) for drift in drifts]}
+
+
+@handler('rebuild_demographics')
+def rebuild_demographics(job, poll_ids=None):
+    from . import demographics
+
+    report(job, 0, 1, 'Recomputing the turnout cube')
+    return {'cells': demographics.rebuild(poll_ids=poll_ids)}
+
+
+@handler('export')
+def export(job, kind, fmt='csv', poll_ids=None):
+    from . import exports, replicas
+
+    path = output_path(job, fmt)
+    written = 0
+    with open(path, 'wb') as f, replicas.reading_from(replicas.choose()):
+        for chunk in exports.export_stream(kind, fmt, poll_ids):
+            f.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+            written += 1
+            if written % 100 == 0:
+                report(job, written, message=f'{written} chunks written')
+    return {'path': path, 'bytes': os.path.getsize(path)}
+
@@ -0,0 +1,68 @@
+import zlib
+from django.core.management.base import BaseCommand
+from polls import archive, jobs
+from polls.models import BallotArchive
+
+class Command(BaseCommand):
+    help = ('Moves the ballots of closed elections out of the Vote table into compact '
+            'per-election archives, keeping the final tally in place')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Only archive this poll id (can be repeated)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List the elections that would be archived')
+        parser.add_argument('--verify', action='store_true',
+                            help='Check the checksum of every existing archive instead of archiving')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the archive as a job for run_jobs instead of running it here')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify_archives()
+            return
+
+        if options['background'] and not options['dry_run']:
+            job = jobs.enqueue('archive_elections', {'poll_ids': options['polls']}, unique=True)
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.id}'))
+            return
+
+        if not options['dry_run']:
+            for poll_id in archive.finish_interrupted():
+                self.stdout.write(self.style.WARNING(f'Finished deleting archived ballots of #{poll_id}'))
+
+        polls = archive.archivable_polls()
+        if options['polls']:
+            polls = polls.filter(pk__in=options['polls'])
+
+        if not polls.exists():
+            self.stdout.write(self.style.SUCCESS('No closed elections left to archive'))
+            return
+
+        for poll in polls:
+            if options['dry_run']:
+                self.stdout.write(f'Would archive: {poll.title()} (#{poll.id})')
+                continue
+
+            ballot_archive = archive.archive_poll(poll)
+            raw_size = ballot_archive.ballot_count * archive.RECORD.size
+            self.stdout.write(self.style.SUCCESS(
+                f'Archived {ballot_archive.ballot_count} ballots for {poll.title()} (#{poll.id}): '
+                f'{raw_size} bytes packed, {len(ballot_archive.payload)} bytes stored'
+            ))
+
+    def verify_archives(self):
+        failures = 0
+        for ballot_archive in BallotArchive.objects.select_related('poll'):
+            try:
+                archive.unpack_archive(ballot_archive)
+            except (ValueError, zlib.error) as e:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'{ballot_archive.poll.title()} (#{ballot_archive.poll_id}): {e}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{ballot_archive.poll.title()} (#{ballot_archive.poll_id}): {ballot_archive.ballot_count} ballots OK'
+                ))
+
+        if failures:
+            self.stdout.write(self.style.ERROR(f'{failures} archive(s) failed verification'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from polls import rollups
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-minute and per-hour turnout rollups from the Vote table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Only rebuild this poll id (can be repeated)')
+
+    def handle(self, *args, **options):
+        created = rollups.backfill(poll_ids=options['polls'])
+        scope = f'{len(options["polls"])} election(s)' if options['polls'] else 'all elections'
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} turnout buckets for {scope}'))
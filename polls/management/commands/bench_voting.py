@@ -0,0 +1,308 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from polls.models import Choice, Poll, Voter
+from polls.views import RESULTS_STREAM_INTERVAL
+
+class Command(BaseCommand):
+    help = ('Simulates election-day traffic (log in, open the index, vote, view results) from '
+            'concurrent voters against a throwaway poll, and compares session modes and the '
+            'sync (WSGI) and async (ASGI) request paths, optionally with live results streams '
+            'open at the same time. '
+            'With --scenario stats, instead measures render time and bytes on the wire of the '
+            'election statistics page for each response encoding. '
+            'Everything the run creates is deleted afterwards. '
+            'With --backend, runs the same benchmark once per database backend (DB_ENGINE).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=['voting', 'stats'], default='voting',
+                            help='What to benchmark (default voting)')
+        parser.add_argument('--voters', type=int, default=40,
+                            help='Voters simulated per session mode')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Voters in flight at the same time')
+        parser.add_argument('--session-mode', action='append', dest='session_modes',
+                            choices=list(settings.SESSION_ENGINES),
+                            help='Session mode to run (can be repeated; default all)')
+        parser.add_argument('--server', action='append', dest='servers', choices=['wsgi', 'asgi'],
+                            help='Request path to run through (can be repeated; default both)')
+        parser.add_argument('--streams', type=int, default=0,
+                            help='Live results streams kept open during each run')
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Stats page requests per encoding (stats scenario)')
+        parser.add_argument('--backend', action='append', dest='backends', choices=['sqlite', 'postgres'],
+                            help='Run against this database backend in a subprocess (can be repeated)')
+
+    def handle(self, *args, **options):
+        if options['backends']:
+            return self.bench_backends(options['backends'])
+
+        vendor = connection.vendor
+        self.stdout.write(f'Database: {vendor} ({connection.settings_dict["NAME"]})')
+        if options['scenario'] == 'stats':
+            return self.bench_stats(options['requests'])
+
+        modes = options['session_modes'] or list(settings.SESSION_ENGINES)
+        servers = options['servers'] or ['wsgi', 'asgi']
+
+        results = []
+        for server in servers:
+            for mode in modes:
+                self.stdout.write(f'Running {options["voters"]} voters through {server} with '
+                                  f'SESSION_MODE={mode} and {options["streams"]} results streams...')
+                poll, users = self.setup(options['voters'] + options['streams'])
+                voters, watchers = users[:options['voters']], users[options['voters']:]
+                session_keys = []
+                run = self.run if server == 'wsgi' else self.run_async
+                try:
+                    with override_settings(SESSION_ENGINE=settings.SESSION_ENGINES[mode]):
+                        results.append((server, mode, run(poll, voters, watchers, options['threads'], session_keys)))
+                finally:
+                    self.teardown(poll, users, session_keys)
+
+        self.stdout.write('')
+        self.stdout.write(f'{"server":<7} {"mode":<15} {"votes/s":>8} {"vote p50":>9} {"vote p95":>9} '
+                          f'{"session writes":>15} {"stream events":>14} {"errors":>7}')
+        for server, mode, result in results:
+            self.stdout.write(
+                f'{server:<7} {mode:<15} {result["rate"]:>8.1f} {result["p50"]:>7.1f}ms {result["p95"]:>7.1f}ms '
+                f'{result["session_writes"]:>15} {result["stream_events"]:>14} {result["errors"]:>7}'
+            )
+
+    def bench_backends(self, backends):
+        # Everything after the --backend options, passed through unchanged
+        argv = []
+        skip = False
+        for arg in sys.argv[2:]:
+            if skip:
+                skip = False
+            elif arg == '--backend':
+                skip = True
+            elif not arg.startswith('--backend='):
+                argv.append(arg)
+
+        for backend in backends:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Backend: {backend}'))
+            env = {**os.environ, 'DB_ENGINE': backend}
+            manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+            try:
+                subprocess.run([*manage, 'migrate', '--verbosity', '0'], env=env, check=True)
+                subprocess.run([*manage, 'bench_voting', *argv], env=env, check=True)
+            except subprocess.CalledProcessError:
+                raise CommandError(f'The {backend} run failed; is its database reachable?')
+            self.stdout.write('')
+
+    def bench_stats(self, count):
+        polls = Poll.objects.count()
+        self.stdout.write(f'Rendering the stats page {count} times per encoding ({polls} polls, '
+                          f'DEBUG={settings.DEBUG})...')
+        user = User.objects.create(username=f'bench_{int(time.time() * 1000):x}_stats')
+        try:
+            client = Client()
+            client.force_login(user)
+            # The first render warms the template cache
+            client.get('/stats/')
+            results = []
+            for encoding in ('identity', 'gzip', 'br'):
+                timings = []
+                for _ in range(count):
+                    started = time.perf_counter()
+                    response = client.get('/stats/', HTTP_ACCEPT_ENCODING=encoding)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                results.append((encoding, response.get('Content-Encoding', 'identity'),
+                                len(response.content), timings))
+        finally:
+            user.delete()
+
+        self.stdout.write('')
+        self.stdout.write(f'{"accept":<10} {"sent as":<10} {"bytes":>9} {"render p50":>11} {"render p95":>11}')
+        for encoding, sent_as, size, timings in results:
+            self.stdout.write(
+                f'{encoding:<10} {sent_as:<10} {size:>9} {statistics.median(timings):>9.1f}ms '
+                f'{timings[max(int(len(timings) * 0.95) - 1, 0)]:>9.1f}ms'
+            )
+
+    def setup(self, count):
+        stamp = f'{int(time.time() * 1000):x}'
+        poll = Poll.objects.create(question=f'Benchmark {stamp}', department='Social',
+                                   pub_date=timezone.now(), is_active=True)
+        Choice.objects.bulk_create([Choice(poll=poll) for _ in range(3)])
+        users = User.objects.bulk_create([User(username=f'bench_{stamp}_{i}') for i in range(count)])
+        Voter.objects.bulk_create([Voter(user=user, name=user.username, sex='O') for user in users])
+        return poll, users
+
+    def teardown(self, poll, users, session_keys):
+        poll.delete()
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        Session.objects.filter(session_key__in=session_keys).delete()
+
+    def run(self, poll, users, watchers, threads, session_keys):
+        """Voters go through the sync handler on a pool of `threads` workers, like gunicorn sync workers"""
+        choice_ids = list(poll.choices.values_list('id', flat=True))
+        lock = threading.Lock()
+        latencies = []
+        totals = {'session_writes': 0, 'errors': 0, 'stream_events': 0}
+        done = threading.Event()
+
+        def count_session_writes(execute, sql, params, many, context):
+            if 'django_session' in sql and not sql.lstrip().upper().startswith('SELECT'):
+                with lock:
+                    totals['session_writes'] += 1
+            return execute(sql, params, many, context)
+
+        def simulate(index):
+            user = users[index]
+            try:
+                with connection.execute_wrapper(count_session_writes):
+                    client = Client()
+                    client.force_login(user)
+                    client.get('/')
+                    started = time.perf_counter()
+                    response = client.post(f'/{poll.id}/vote/', {'choice': str(choice_ids[index % len(choice_ids)])})
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if response.status_code != 302:
+                        error = response.context.get('error_message') if response.context else None
+                        raise RuntimeError(error or f'vote returned {response.status_code}')
+                    client.get(response['Location'])
+                with lock:
+                    latencies.append(elapsed)
+                    cookie = client.cookies.get(settings.SESSION_COOKIE_NAME)
+                    if cookie is not None:
+                        session_keys.append(cookie.value)
+            except Exception as e:
+                with lock:
+                    totals['errors'] += 1
+                self.stderr.write(f'{user.username}: {e}')
+            finally:
+                connection.close()
+
+        def watch(user):
+            # Under WSGI the stream answers with a snapshot and the browser
+            # reconnects, so a watcher is a poll every RESULTS_STREAM_INTERVAL
+            try:
+                client = Client()
+                client.force_login(user)
+                while not done.is_set():
+                    response = client.get(f'/{poll.id}/results/stream/')
+                    with lock:
+                        totals['stream_events'] += response.content.count(b'data:')
+                    done.wait(RESULTS_STREAM_INTERVAL)
+            finally:
+                connection.close()
+
+        watcher_threads = [threading.Thread(target=watch, args=(user,)) for user in watchers]
+        for thread in watcher_threads:
+            thread.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(simulate, range(len(users))))
+        wall = time.perf_counter() - started
+        done.set()
+        for thread in watcher_threads:
+            thread.join()
+
+        return self.summarize(latencies, wall, totals)
+
+    def run_async(self, poll, users, watchers, concurrency, session_keys):
+        """Voters go through the async handler, `concurrency` at a time, like one uvicorn worker"""
+        choice_ids = list(poll.choices.values_list('id', flat=True))
+        latencies = []
+        totals = {'session_writes': 0, 'errors': 0, 'stream_events': 0}
+
+        def count_session_writes(execute, sql, params, many, context):
+            if 'django_session' in sql and not sql.lstrip().upper().startswith('SELECT'):
+                totals['session_writes'] += 1
+            return execute(sql, params, many, context)
+
+        def attach_counter():
+            wrapper_cm = connection.execute_wrapper(count_session_writes)
+            wrapper_cm.__enter__()
+            return wrapper_cm
+
+        def detach_counter(wrapper_cm):
+            wrapper_cm.__exit__(None, None, None)
+            connection.close()
+
+        async def simulate(index, slots):
+            user = users[index]
+            async with slots:
+                # One sync thread per request, as the ASGI handler does
+                async with ThreadSensitiveContext():
+                    wrapper_cm = await sync_to_async(attach_counter)()
+                    try:
+                        client = AsyncClient()
+                        await client.aforce_login(user)
+                        await client.get('/')
+                        started = time.perf_counter()
+                        response = await client.post(f'/{poll.id}/vote/',
+                                                     {'choice': str(choice_ids[index % len(choice_ids)])})
+                        elapsed = (time.perf_counter() - started) * 1000
+                        if response.status_code != 302:
+                            raise RuntimeError(f'vote returned {response.status_code}')
+                        await client.get(response['Location'])
+                        latencies.append(elapsed)
+                        cookie = client.cookies.get(settings.SESSION_COOKIE_NAME)
+                        if cookie is not None:
+                            session_keys.append(cookie.value)
+                    except Exception as e:
+                        totals['errors'] += 1
+                        self.stderr.write(f'{user.username}: {e}')
+                    finally:
+                        await sync_to_async(detach_counter)(wrapper_cm)
+
+        async def watch(user, done):
+            # One long-lived connection per watcher
+            async with ThreadSensitiveContext():
+                try:
+                    client = AsyncClient()
+                    await client.aforce_login(user)
+                    response = await client.get(f'/{poll.id}/results/stream/')
+                    events = aiter(response.streaming_content)
+                    while not done.is_set():
+                        chunk = asyncio.ensure_future(anext(events))
+                        await asyncio.wait([chunk, asyncio.ensure_future(done.wait())],
+                                           return_when=asyncio.FIRST_COMPLETED)
+                        if not chunk.done():
+                            chunk.cancel()
+                            break
+                        totals['stream_events'] += chunk.result().count(b'data:')
+                finally:
+                    await sync_to_async(connection.close)()
+
+        async def main():
+            slots = asyncio.Semaphore(concurrency)
+            done = asyncio.Event()
+            watcher_tasks = [asyncio.ensure_future(watch(user, done)) for user in watchers]
+            started = time.perf_counter()
+            await asyncio.gather(*(simulate(index, slots) for index in range(len(users))))
+            wall = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*watcher_tasks, return_exceptions=True)
+            return wall
+
+        wall = asyncio.run(main())
+        return self.summarize(latencies, wall, totals)
+
+    def summarize(self, latencies, wall, totals):
+        latencies.sort()
+        return {
+            'rate': len(latencies) / wall if wall else 0.0,
+            'p50': statistics.median(latencies) if latencies else 0.0,
+            'p95': latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0,
+            **totals,
+        }
@@ -0,0 +1,28 @@
+import sys
+from django.core.management.base import BaseCommand
+from polls import exports
+
+class Command(BaseCommand):
+    help = 'Streams election tallies, department summaries or the anonymised ballot ledger as CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS), help='What to export')
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv', help='Output format')
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Only export this poll id (can be repeated)')
+        parser.add_argument('--output', help='File to write to (defaults to stdout)')
+
+    def handle(self, *args, **options):
+        chunks = exports.export_stream(options['kind'], options['format'], options['polls'])
+
+        if not options['output']:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+
+        written = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+                written += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Wrote {written} bytes to {options["output"]}'))
@@ -1,8 +1,10 @@
 import random
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from django.contrib.auth.models import User
 from polls.models import Poll, Choice, Vote, Voter, Candidate
+from polls import deletion, demographics, rollups, sharding, tallies
 
 class Command(BaseCommand):
     help = 'Populates the database with elections for each department and adds fake votes'
@@ -26,14 +28,9 @@ class Command(BaseCommand):
         # Clear existing department polls if requested
         if clear_existing:
             self.stdout.write(self.style.WARNING('Clearing existing department polls...'))
-            for dept in departments:
-                polls = Poll.objects.filter(department=dept)
-                for poll in polls:
-                    # Delete related choices and votes
-                    Choice.objects.filter(poll=poll).delete()
-                    Vote.objects.filter(poll=poll).delete()
-                # Delete the polls
-                polls.delete()
+            # Ballots go in batches rather than one cascade per poll
+            poll_ids = Poll.objects.filter(department__in=departments).values_list('id', flat=True)
+            deletion.purge(list(poll_ids))
             self.stdout.write(self.style.SUCCESS('Cleared existing department polls'))
         
         # Make sure we have enough candidates and voters
@@ -74,6 +71,7 @@ class Command(BaseCommand):
             # Generate votes for this poll
             choices = Choice.objects.filter(poll=poll)
             weights = self.generate_realistic_weights(choices.count())
+            ballot_db = sharding.db_for_poll(poll.id)
             
             created_votes = 0
             for i in range(votes_per_dept):
@@ -83,7 +81,7 @@ class Command(BaseCommand):
                 voter = voters[i]
                 
                 # Skip if voter already voted in this poll
-                if Vote.objects.filter(voter=voter, poll=poll).exists():
+                if Vote.objects.using(ballot_db).filter(voter=voter, poll=poll).exists():
                     continue
                 
                 # Select a choice based on weights
@@ -93,16 +91,17 @@ class Command(BaseCommand):
                     k=1
                 )[0]
                 
-                # Create vote
-                Vote.objects.create(
-                    voter=voter,
-                    poll=poll,
-                    choice=selected_choice
-                )
-                
-                # Update vote count
-                selected_choice.votes += 1
-                selected_choice.save()
+                # Create the vote and bump the counter together so they can't drift apart;
+                # all of it lives in the poll's ballot database
+                with transaction.atomic(using=ballot_db):
+                    vote = Vote.objects.using(ballot_db).create(
+                        voter=voter,
+                        poll=poll,
+                        choice=selected_choice
+                    )
+                    tallies.record_votes([vote], using=ballot_db)
+                    rollups.record_vote(poll.id, vote.voted_at, using=ballot_db)
+                    demographics.record_votes(voter, [poll.id], using=ballot_db)
                 
                 created_votes += 1
             
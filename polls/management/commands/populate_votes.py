@@ -1,8 +1,10 @@
 import random
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from django.contrib.auth.models import User
-from polls.models import Poll, Choice, Vote, Voter, Candidate
+from polls.models import Poll, Choice, ChoiceTally, Vote, Voter, Candidate
+from polls import demographics, rollups, sharding, tallies
 
 class Command(BaseCommand):
     help = 'Populates the database with fake votes for testing'
@@ -26,7 +28,9 @@ class Command(BaseCommand):
         
         # Clear existing votes if requested
         if clear_votes:
-            Vote.objects.all().delete()
+            for ballot_db in sharding.ballot_databases():
+                Vote.objects.using(ballot_db).all().delete()
+                ChoiceTally.objects.using(ballot_db).all().delete()
             # Reset vote counts for all choices
             Choice.objects.all().update(votes=0)
             self.stdout.write(self.style.SUCCESS('Cleared existing votes'))
@@ -50,11 +54,12 @@ class Command(BaseCommand):
             # Distribute votes somewhat realistically
             # Create a weighted distribution for choices
             weights = self.generate_realistic_weights(choices.count())
+            ballot_db = sharding.db_for_poll(poll.id)
             
             # Assign each voter to a choice based on weighted distribution
             for voter in voters:
                 # Skip if voter already voted in this poll
-                if Vote.objects.filter(voter=voter, poll=poll).exists():
+                if Vote.objects.using(ballot_db).filter(voter=voter, poll=poll).exists():
                     skipped_votes += 1
                     continue
                 
@@ -65,16 +70,17 @@ class Command(BaseCommand):
                     k=1
                 )[0]
                 
-                # Create vote
-                Vote.objects.create(
-                    voter=voter,
-                    poll=poll,
-                    choice=selected_choice
-                )
-                
-                # Update vote count
-                selected_choice.votes += 1
-                selected_choice.save()
+                # Create the vote and bump the counter together so they can't drift apart;
+                # all of it lives in the poll's ballot database
+                with transaction.atomic(using=ballot_db):
+                    vote = Vote.objects.using(ballot_db).create(
+                        voter=voter,
+                        poll=poll,
+                        choice=selected_choice
+                    )
+                    tallies.record_votes([vote], using=ballot_db)
+                    rollups.record_vote(poll.id, vote.voted_at, using=ballot_db)
+                    demographics.record_votes(voter, [poll.id], using=ballot_db)
                 
                 created_votes += 1
                 
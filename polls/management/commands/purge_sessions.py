@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from polls import sessions
+
+class Command(BaseCommand):
+    help = ('Deletes expired sessions in small batches so the purge never holds the database '
+            'write lock for long. The job runner also does this on its own (RECURRING_JOBS); '
+            'use --every to keep running on an interval instead.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches, letting vote inserts take the lock')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Repeat every N seconds instead of running once')
+
+    def handle(self, *args, **options):
+        while True:
+            purged = sessions.purge_expired(options['batch_size'], options['pause'])
+            self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired sessions'))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
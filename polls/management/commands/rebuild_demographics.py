@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from polls import demographics, jobs
+
+class Command(BaseCommand):
+    help = ('Rebuilds the turnout cube (ballots and eligible voters per poll, branch, sex and age band) '
+            'from the Vote and Voter tables')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Only rebuild this poll id (can be repeated)')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the rebuild as a job for run_jobs instead of running it here')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = jobs.enqueue('rebuild_demographics', {'poll_ids': options['polls']}, unique=True)
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.id}'))
+            return
+
+        cells = demographics.rebuild(poll_ids=options['polls'])
+        scope = f'{len(options["polls"])} election(s)' if options['polls'] else 'all elections'
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {cells} turnout cells for {scope}'))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from polls import jobs
+from polls.models import TallyWatermark
+from polls.tallies import reconcile, WATERMARK_NAME
+
+class Command(BaseCommand):
+    help = ('Recomputes Choice vote counters from the Vote table and repairs any drift. '
+            'Use --incremental to only scan votes newer than the stored watermark; '
+            'run a full pass occasionally to catch deleted votes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only scan votes newer than the stored (voted_at, id) watermark')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without repairing counters or moving the watermark')
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Restrict a full pass to this poll id (can be repeated)')
+        parser.add_argument('--lag', type=int, default=5,
+                            help='Seconds of recent votes to re-scan on the next run')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the pass as a job for run_jobs instead of running it here')
+
+    def handle(self, *args, **options):
+        incremental = options['incremental']
+        if incremental and options['polls']:
+            self.stdout.write(self.style.WARNING('--poll implies a full pass; ignoring --incremental'))
+            incremental = False
+
+        if incremental and not TallyWatermark.objects.filter(name=WATERMARK_NAME).exists():
+            self.stdout.write(self.style.WARNING('No watermark stored yet, running a full pass'))
+            incremental = False
+
+        if options['background'] and not options['dry_run']:
+            job = jobs.enqueue('reconcile_tallies', {'incremental': incremental, 'poll_ids': options['polls']},
+                               unique=True)
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.id}'))
+            return
+
+        drifts, scanned = reconcile(
+            incremental=incremental,
+            repair=not options['dry_run'],
+            lag_seconds=options['lag'],
+            poll_ids=options['polls'],
+        )
+
+        mode = 'incremental' if incremental else 'full'
+        self.stdout.write(self.style.SUCCESS(f'Scanned {scanned} votes ({mode} pass)'))
+
+        if not drifts:
+            self.stdout.write(self.style.SUCCESS('All vote counters match'))
+            return
+
+        for drift in drifts:
+            self.stdout.write(self.style.WARNING(str(drift)))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Found {len(drifts)} drifted counters (dry run, nothing changed)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifts)} drifted counters'))
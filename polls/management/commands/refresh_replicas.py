@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from polls import boot, replicas
+
+class Command(BaseCommand):
+    help = ('Copies the primary database into every SQLite read replica with the backup API. '
+            'Use --loop to keep them current.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=0,
+                            help='Repeat every N seconds instead of running once')
+        parser.add_argument('--loop', action='store_true',
+                            help='Repeat every READ_REPLICAS["REFRESH_SECONDS"] seconds')
+
+    def handle(self, *args, **options):
+        config = replicas.get_config()
+        aliases = [alias for alias in config['ALIASES'] if boot.sqlite_path(alias) is not None]
+        if not aliases:
+            raise CommandError('No SQLite read replicas configured (set READ_REPLICAS)')
+
+        every = config['REFRESH_SECONDS'] if options['loop'] else options['every']
+        while True:
+            for alias in aliases:
+                started = time.perf_counter()
+                replicas.refresh(alias)
+                if not every:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Refreshed {alias} in {time.perf_counter() - started:.2f}s'
+                    ))
+            if not every:
+                return
+            time.sleep(every)
@@ -0,0 +1,67 @@
+import os
+import socket
+import threading
+import time
+from django.core.management.base import BaseCommand
+from polls import jobs
+
+class Command(BaseCommand):
+    help = ('Runs queued background jobs (poll deletes, archives, tally recomputes, exports). '
+            'Keeps polling for new jobs until stopped, or with --burst exits once the queue is empty.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Jobs to run at the same time, one thread each')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit when no job is due instead of waiting for more')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait before looking again when the queue is empty')
+        parser.add_argument('--kind', action='append', dest='kinds', choices=sorted(jobs.HANDLERS),
+                            help='Only run jobs of this kind (can be repeated)')
+        parser.add_argument('--lease', type=int, default=jobs.LEASE_SECONDS,
+                            help='Seconds without progress before a running job is given to another runner')
+
+    def handle(self, *args, **options):
+        jobs.LEASE_SECONDS = options['lease']
+        self.options = options
+        self.stop = threading.Event()
+        self.counts = {'ran': 0}
+        self.counts_lock = threading.Lock()
+
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} job(s) left running by a stopped runner'))
+
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        threads = [
+            threading.Thread(target=self.work, args=(f'{prefix}:{n}',), daemon=True)
+            for n in range(max(options['concurrency'], 1))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the running jobs finish...')
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(self.style.SUCCESS(f"Ran {self.counts['ran']} job(s)"))
+
+    def work(self, worker):
+        last_requeue = time.monotonic()
+        while not self.stop.is_set():
+            if jobs.run_next(worker, self.options['kinds']):
+                with self.counts_lock:
+                    self.counts['ran'] += 1
+                continue
+            if self.options['burst']:
+                return
+            jobs.enqueue_recurring()
+            if time.monotonic() - last_requeue > 60:
+                jobs.requeue_stale()
+                last_requeue = time.monotonic()
+            self.stop.wait(self.options['poll_interval'])
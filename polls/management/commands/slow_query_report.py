@@ -0,0 +1,66 @@
+import json
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from polls.slow_queries import get_config, log_files
+
+class Command(BaseCommand):
+    help = 'Summarises the slow query log, ranking statement shapes by total time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Log path whose per-process files to read (defaults to SLOW_QUERY_LOG["PATH"])')
+        parser.add_argument('--limit', type=int, default=20, help='Number of statement shapes to show')
+        parser.add_argument('--plans', action='store_true', help='Print the captured query plan for each shape')
+
+    def handle(self, *args, **options):
+        path = options['path'] or str(get_config()['PATH'])
+
+        # Every process's file, rotated ones included
+        files = log_files(path)
+        if not files:
+            self.stdout.write(self.style.WARNING(f'No slow query log found at {path}'))
+            return
+
+        shapes = defaultdict(lambda: {
+            'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'views': set(), 'plan': None,
+        })
+        skipped = 0
+
+        for filename in files:
+            with open(filename, encoding='utf-8') as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        skipped += 1
+                        continue
+
+                    stats = shapes[entry['shape']]
+                    stats['count'] += 1
+                    stats['total_ms'] += entry['duration_ms']
+                    stats['max_ms'] = max(stats['max_ms'], entry['duration_ms'])
+                    if entry.get('view'):
+                        stats['views'].add(entry['view'])
+                    if entry.get('plan') and not stats['plan']:
+                        stats['plan'] = entry['plan']
+
+        ranked = sorted(shapes.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(s["count"] for s in shapes.values())} slow queries across {len(shapes)} statement shapes'
+        ))
+
+        for rank, (shape, stats) in enumerate(ranked[:options['limit']], start=1):
+            mean_ms = stats['total_ms'] / stats['count']
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'#{rank}  total {stats["total_ms"]:.1f} ms  count {stats["count"]}  '
+                f'mean {mean_ms:.1f} ms  max {stats["max_ms"]:.1f} ms'
+            ))
+            self.stdout.write(f'    views: {", ".join(sorted(stats["views"])) or "-"}')
+            self.stdout.write(f'    {shape}')
+            if options['plans'] and stats['plan']:
+                for row in stats['plan']:
+                    self.stdout.write(f'      plan: {row}')
+
+        if skipped:
+            self.stdout.write(self.style.WARNING(f'Skipped {skipped} unreadable log lines'))
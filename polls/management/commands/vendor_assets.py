@@ -0,0 +1,76 @@
+import os
+import posixpath
+import re
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from polls.assets import VENDOR_ASSETS, source_path
+
+# Google Fonts only serves woff2 to browsers it recognises
+USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/120.0 Safari/537.36')
+
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+class Command(BaseCommand):
+    help = ('Downloads the pinned Bootstrap, Font Awesome, Chart.js and Open Sans files into '
+            'polls/static/polls/vendor/ so they are served (hashed and compressed) by our own '
+            'static pipeline instead of third-party CDNs. Fonts referenced by the CSS are '
+            'fetched too.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Download again even if a file is already present')
+
+    def handle(self, *args, **options):
+        failed = []
+        for key, asset in VENDOR_ASSETS.items():
+            path = source_path(key)
+            if os.path.exists(path) and not options['force']:
+                self.stdout.write(f'{asset["path"]} already present')
+                continue
+            try:
+                body = self.fetch(asset['url'])
+                if path.endswith('.css'):
+                    body = self.localize_css(body.decode(), asset['url'], os.path.dirname(path)).encode()
+                self.write(path, body)
+            except OSError as e:
+                failed.append(key)
+                self.stderr.write(self.style.ERROR(f'{key}: {e}'))
+                continue
+            self.stdout.write(self.style.SUCCESS(f'Vendored {asset["path"]}'))
+
+        if failed:
+            raise CommandError(f'Could not vendor {", ".join(failed)}; pages will use the CDN for these')
+
+    def fetch(self, url):
+        request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.read()
+
+    def write(self, path, body):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(body)
+
+    def localize_css(self, css, css_url, css_dir):
+        """Download the files a stylesheet refers to and point its url()s at the local copies"""
+        fetched = {}
+
+        def replace(match):
+            ref = match.group(2)
+            if ref.startswith(('data:', '#')):
+                return match.group(0)
+            if ref not in fetched:
+                if urlsplit(ref).scheme:
+                    # Absolute URLs (Google's font files) are saved under fonts/
+                    local = posixpath.join('fonts', posixpath.basename(urlsplit(ref).path))
+                else:
+                    local = urlsplit(ref).path
+                target = os.path.normpath(os.path.join(css_dir, *local.split('/')))
+                if not os.path.exists(target):
+                    self.write(target, self.fetch(urljoin(css_url, ref)))
+                fetched[ref] = local
+            return f'url("{fetched[ref]}")'
+
+        return CSS_URL_RE.sub(replace, css)
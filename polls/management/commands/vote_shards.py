@@ -0,0 +1,122 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from polls import sharding
+from polls.models import BallotArchive, ChoiceTally, Poll, TurnoutBucket, TurnoutCell, Vote
+
+class Command(BaseCommand):
+    help = 'Lists, creates, migrates and detaches the per-election ballot databases used when VOTE_SHARDING is enabled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'create', 'migrate', 'detach'])
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='Poll id to create or detach a shard for (can be repeated)')
+        parser.add_argument('--destination', help='Directory detached shard files are moved to')
+        parser.add_argument('--force', action='store_true',
+                            help='Detach even if the election is open or its ballots are not archived')
+
+    def handle(self, *args, **options):
+        if not sharding.is_enabled():
+            raise CommandError('Vote sharding is disabled. Set VOTE_SHARDING=1 to use per-election databases.')
+
+        if options['action'] == 'list':
+            self.list_shards()
+            return
+
+        if options['action'] == 'migrate':
+            aliases = sharding.shard_aliases()
+            for alias in aliases:
+                sharding.migrate_shard(alias)
+            self.stdout.write(self.style.SUCCESS(f'Migrated {len(aliases)} vote shard(s)'))
+            return
+
+        if not options['polls']:
+            raise CommandError(f'--poll is required for {options["action"]}')
+
+        for poll_id in options['polls']:
+            try:
+                poll = Poll.objects.get(pk=poll_id)
+            except Poll.DoesNotExist:
+                raise CommandError(f'Poll {poll_id} does not exist')
+
+            if options['action'] == 'create':
+                self.create(poll)
+            else:
+                self.detach(poll, options['destination'], options['force'])
+
+    def list_shards(self):
+        aliases = sharding.shard_aliases()
+        if not aliases:
+            self.stdout.write('No vote shards found')
+            return
+        for alias in aliases:
+            poll_id = int(alias[len(sharding.ALIAS_PREFIX):])
+            size = os.path.getsize(sharding.shard_path(poll_id))
+            votes = Vote.objects.using(alias).count()
+            self.stdout.write(f'{alias}: {votes} votes, {size} bytes ({sharding.shard_path(poll_id)})')
+
+    def create(self, poll):
+        if sharding.db_for_poll(poll.id) != 'default':
+            self.stdout.write(self.style.WARNING(f'{poll.title()} (#{poll.id}) already has a shard'))
+            return
+
+        alias = sharding.create_shard(poll.id)
+
+        # Move any ballots and rollups the poll already has out of the default
+        # database, with its vote counters and turnout cells, which live next
+        # to the ballots from now on. The shard commits first, so a failure
+        # leaves copies, not gaps
+        votes = Vote.objects.filter(poll=poll)
+        buckets = TurnoutBucket.objects.filter(poll=poll)
+        cells = TurnoutCell.objects.using('default').filter(poll=poll)
+        with transaction.atomic(), transaction.atomic(using=alias):
+            copies = [
+                Vote(id=v.id, voter_id=v.voter_id, poll_id=v.poll_id, choice_id=v.choice_id,
+                     voted_at=v.voted_at, ranking=v.ranking)
+                for v in votes.iterator(chunk_size=5000)
+            ]
+            voted_at = [copy.voted_at for copy in copies]
+            Vote.objects.using(alias).bulk_create(copies, batch_size=500)
+            # voted_at is auto_now_add, so the insert stamped the copies with
+            # the current time; bulk_update writes the values as they are
+            for copy, stamp in zip(copies, voted_at):
+                copy.voted_at = stamp
+            Vote.objects.using(alias).bulk_update(copies, ['voted_at'], batch_size=500)
+            TurnoutBucket.objects.using(alias).bulk_create(
+                [TurnoutBucket(poll_id=b.poll_id, resolution=b.resolution, bucket_start=b.bucket_start, votes=b.votes)
+                 for b in buckets],
+                batch_size=500,
+            )
+            ChoiceTally.objects.using(alias).bulk_create(
+                [ChoiceTally(poll_id=poll.id, choice_id=choice_id, votes=n)
+                 for choice_id, n in poll.choices.filter(votes__gt=0).values_list('id', 'votes')],
+                batch_size=500,
+            )
+            TurnoutCell.objects.using(alias).bulk_create(
+                [TurnoutCell(poll_id=c.poll_id, branch_id=c.branch_id, sex=c.sex, age_band=c.age_band,
+                             votes=c.votes, eligible=c.eligible)
+                 for c in cells],
+                batch_size=500,
+            )
+            moved = votes.count()
+            votes.delete()
+            buckets.delete()
+            cells.delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Created {alias} for {poll.title()} and moved {moved} votes into it'))
+
+    def detach(self, poll, destination, force):
+        if sharding.db_for_poll(poll.id) == 'default':
+            self.stdout.write(self.style.WARNING(f'{poll.title()} (#{poll.id}) has no shard'))
+            return
+        if not force:
+            if not poll.is_past_election():
+                raise CommandError(f'{poll.title()} has not closed yet (use --force to detach anyway)')
+            if not BallotArchive.objects.filter(poll=poll).exists():
+                raise CommandError(
+                    f'Ballots for {poll.title()} are not archived; run archive_elections first '
+                    f'(or use --force to detach anyway)'
+                )
+
+        target = sharding.detach_shard(poll.id, destination)
+        self.stdout.write(self.style.SUCCESS(f'Detached shard for {poll.title()} to {target}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from polls import metadata
+from polls.models import Poll
+
+class Command(BaseCommand):
+    help = 'Loads poll, choice and candidate metadata for current and upcoming elections into the shared cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Warm every poll, including past elections')
+
+    def handle(self, *args, **options):
+        polls = Poll.objects.all()
+        if not options['all']:
+            polls = polls.filter(pub_date__date__gte=timezone.now().date())
+
+        poll_ids = list(polls.values_list('id', flat=True))
+        metadata.warm(poll_ids)
+        self.stdout.write(self.style.SUCCESS(f'Warmed metadata for {len(poll_ids)} poll(s)'))
@@ -0,0 +1,140 @@
+"""
+Cached per-poll metadata.
+
+A poll's question, department, dates, choices and candidates don't
+change once it is open, but the detail, results, stats and vote views
+used to load them on every request. get_poll() returns a Poll with its
+choices and candidates already prefetched from a per-process LRU,
+falling back to the shared cache and finally the database.
+
+Entries are keyed by poll id and a version token kept in the shared
+cache. Saving or deleting a Poll, Choice or Candidate replaces the token
+(see the signal receivers below), which orphans every cached copy in
+every worker. Bulk updates don't send signals, so code that changes polls
+with QuerySet.update() must call invalidate() itself.
+
+Vote counts are not metadata: pass with_votes=True to overlay the current
+counters with one small query (see tallies.choice_votes).
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import replicas, tallies
+from .models import Candidate, Choice, Poll
+
+# Polls kept per process
+LRU_SIZE = 256
+
+# Seconds an entry lives in the shared cache
+CACHE_TIMEOUT = 24 * 60 * 60
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+
+
+def _version_key(poll_id):
+    return f'polls:meta-version:{poll_id}'
+
+
+def _entry_key(poll_id, token):
+    return f'polls:meta:{poll_id}:{token}'
+
+
+def version(poll_id):
+    """The poll's current version token"""
+    token = cache.get(_version_key(poll_id))
+    if token is None:
+        # A fresh token rather than a counter, so a version key that was
+        # evicted can never come back matching an old entry
+        cache.add(_version_key(poll_id), time.time_ns(), None)
+        token = cache.get(_version_key(poll_id))
+    return token
+
+
+def invalidate(poll_id):
+    cache.set(_version_key(poll_id), time.time_ns(), None)
+    with _lock:
+        for key in [key for key in _lru if key[0] == poll_id]:
+            del _lru[key]
+
+
+def _load(poll_id):
+    # Shared by every worker under the current version, so never filled
+    # from a replica that may not have the edit yet
+    with replicas.use_primary():
+        choices = Choice.objects.select_related('candidate').order_by('id')
+        poll = Poll.objects.prefetch_related(Prefetch('choices', queryset=choices)).get(pk=poll_id)
+    return pickle.dumps(poll, pickle.HIGHEST_PROTOCOL)
+
+
+def _payload(poll_id):
+    token = version(poll_id)
+    key = (poll_id, token)
+    with _lock:
+        payload = _lru.get(key)
+        if payload is not None:
+            _lru.move_to_end(key)
+            return payload
+
+    payload = cache.get(_entry_key(poll_id, token))
+    if payload is None:
+        payload = _load(poll_id)
+        cache.set(_entry_key(poll_id, token), payload, CACHE_TIMEOUT)
+
+    with _lock:
+        _lru[key] = payload
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
+    return payload
+
+
+def get_poll(poll_id, with_votes=False):
+    """
+    Return the poll with poll.choices.all() and choice.candidate loaded.
+
+    Each call returns a fresh copy, so callers may modify it. Raises
+    Poll.DoesNotExist like a normal lookup.
+    """
+    poll = pickle.loads(_payload(int(poll_id)))
+    if with_votes:
+        counts = tallies.choice_votes([poll.id])
+        for choice in poll.choices.all():
+            choice.votes = counts.get(choice.id, 0)
+    return poll
+
+
+def is_cached(poll_id):
+    """Whether the poll's current metadata is in the shared cache"""
+    return cache.has_key(_entry_key(poll_id, version(poll_id)))
+
+
+def warm(poll_ids):
+    """Load polls into the shared cache (and this process's LRU)"""
+    for poll_id in poll_ids:
+        _payload(poll_id)
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+def _poll_changed(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def _choice_changed(sender, instance, **kwargs):
+    invalidate(instance.poll_id)
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+def _candidate_changed(sender, instance, **kwargs):
+    for poll_id in set(Choice.objects.filter(candidate=instance).values_list('poll_id', flat=True)):
+        invalidate(poll_id)
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_remove_poll_end_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TallyWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('voted_at', models.DateTimeField(blank=True, null=True)),
+                ('vote_id', models.BigIntegerField(default=0)),
+                ('counts', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['voted_at', 'id'], name='polls_vote_voted_at_id_idx'),
+        ),
+    ]
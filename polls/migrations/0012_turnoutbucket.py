@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_tallywatermark_vote_voted_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnoutBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour')], max_length=8)),
+                ('bucket_start', models.DateTimeField()),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_buckets', to='polls.poll')),
+            ],
+            options={
+                'unique_together': {('poll', 'resolution', 'bucket_start')},
+            },
+        ),
+    ]
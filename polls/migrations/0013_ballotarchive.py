@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_turnoutbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BallotArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format_version', models.PositiveSmallIntegerField(default=1)),
+                ('ballot_count', models.PositiveIntegerField(default=0)),
+                ('payload', models.BinaryField()),
+                ('checksum', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ballot_archive', to='polls.poll')),
+            ],
+        ),
+    ]
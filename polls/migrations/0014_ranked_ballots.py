@@ -0,0 +1,38 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_ballotarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ballotarchive',
+            name='ranking_width',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ballotarchive',
+            name='rankings',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='seats',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='voting_method',
+            field=models.CharField(choices=[('plurality', 'Plurality (single choice)'), ('irv', 'Instant-runoff (ranked)'), ('stv', 'Single transferable vote (ranked, multi-seat)')], default='plurality', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='ranking',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
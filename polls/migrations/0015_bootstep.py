@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0014_ranked_ballots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BootStep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('completed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0016_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0017_poll_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='poll',
+            name='department',
+            field=models.CharField(blank=True, choices=[('Cultural', 'Cultural'), ('Technical', 'Technical'), ('President', 'President'), ('Vice President', 'Vice President'), ('Social', 'Social')], db_index=True, max_length=32, null=True),
+        ),
+    ]
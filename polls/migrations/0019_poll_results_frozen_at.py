@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0018_poll_department_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='results_frozen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
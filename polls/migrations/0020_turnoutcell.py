@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0019_poll_results_frozen_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnoutCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sex', models.CharField(blank=True, max_length=1)),
+                ('age_band', models.CharField(max_length=8)),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('eligible', models.PositiveIntegerField(default=0)),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.branch')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_cells', to='polls.poll')),
+            ],
+            options={
+                'unique_together': {('poll', 'branch', 'sex', 'age_band')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.2 on 2026-10-19 02:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def move_counters_into_shard(apps, schema_editor):
+    # Shards migrated before the turnout cells moved into them have 0020
+    # recorded without its table. Shards already holding ballots count them
+    # into their new counters and take over the cells the default database
+    # kept for them
+    connection = schema_editor.connection
+    if not connection.alias.startswith('poll_shard_'):
+        return
+    TurnoutCell = apps.get_model('polls', 'TurnoutCell')
+    if TurnoutCell._meta.db_table not in connection.introspection.table_names():
+        schema_editor.create_model(TurnoutCell)
+
+    poll_id = int(connection.alias[len('poll_shard_'):])
+    Vote = apps.get_model('polls', 'Vote')
+    ChoiceTally = apps.get_model('polls', 'ChoiceTally')
+    counts = (
+        Vote.objects.using(connection.alias).filter(poll_id=poll_id).order_by()
+        .values_list('choice_id').annotate(n=Count('id'))
+    )
+    ChoiceTally.objects.using(connection.alias).bulk_create([
+        ChoiceTally(poll_id=poll_id, choice_id=choice_id, votes=n) for choice_id, n in counts
+    ])
+    if not counts:
+        return
+    TurnoutCell.objects.using(connection.alias).bulk_create([
+        TurnoutCell(poll_id=poll_id, branch_id=cell.branch_id, sex=cell.sex, age_band=cell.age_band,
+                    votes=cell.votes, eligible=cell.eligible)
+        for cell in TurnoutCell.objects.using('default').filter(poll_id=poll_id)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0020_turnoutcell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoiceTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('choice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.choice')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.poll')),
+            ],
+        ),
+        migrations.RunPython(
+            move_counters_into_shard, migrations.RunPython.noop, hints={'model_name': 'turnoutcell'}
+        ),
+    ]
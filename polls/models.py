@@ -54,6 +54,12 @@ class Candidate(models.Model):
         position_str = f" - {self.position}" if self.position else ""
         return f"{self.name}{position_str}"
 
+class LivePollManager(models.Manager):
+    # Deleted polls stay in the table until their ballots have been purged
+    # in the background (see polls/deletion.py); nothing else sees them
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 class Poll(models.Model):
     DEPARTMENT_CHOICES = [
         ('Cultural', 'Cultural'),
@@ -62,11 +68,25 @@ class Poll(models.Model):
         ('Vice President', 'Vice President'),
         ('Social', 'Social'),
     ]
+    VOTING_METHOD_CHOICES = [
+        ('plurality', 'Plurality (single choice)'),
+        ('irv', 'Instant-runoff (ranked)'),
+        ('stv', 'Single transferable vote (ranked, multi-seat)'),
+    ]
     question = models.CharField(max_length=200, null=True, blank=True)
     pub_date = models.DateTimeField('date published', default=timezone.now)
     is_active = models.BooleanField(default=True)
-    department = models.CharField(max_length=32, choices=DEPARTMENT_CHOICES, null=True, blank=True)
+    department = models.CharField(max_length=32, choices=DEPARTMENT_CHOICES, null=True, blank=True, db_index=True)
     branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True)
+    voting_method = models.CharField(max_length=16, choices=VOTING_METHOD_CHOICES, default='plurality')
+    seats = models.PositiveSmallIntegerField(default=1)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Set when staff certify the tally: voting is closed and the counters
+    # are final, so reconcile_tallies leaves them alone
+    results_frozen_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LivePollManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         date_str = self.pub_date.strftime("%d %b %Y")
@@ -80,8 +100,8 @@ class Poll(models.Model):
         # Check if the election is today
         date_match = (now == election_date)
         
-        # Return true if the election is active and today's date matches the election date
-        return self.is_active and date_match
+        # Return true if the election is active, not frozen, and today's date matches the election date
+        return self.is_active and date_match and self.results_frozen_at is None
 
     def is_past_election(self):
         # Check if the election date has passed
@@ -91,6 +111,9 @@ class Poll(models.Model):
         # Return true if today's date is after the election date
         return now > election_date
 
+    def is_ranked(self):
+        return self.voting_method != 'plurality'
+
     def title(self):
         if self.question:
             return self.question
@@ -118,6 +141,151 @@ class Vote(models.Model):
     poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     voted_at = models.DateTimeField(auto_now_add=True)
+    # Ranked polls only: choice ids in preference order, packed as little-endian
+    # uint32 (see polls/ranked.py). `choice` holds the first preference
+    ranking = models.BinaryField(null=True, blank=True)
 
     class Meta:
         unique_together = ('voter', 'poll')
+        indexes = [
+            # Supports incremental scans past a (voted_at, id) watermark
+            models.Index(fields=['voted_at', 'id'], name='polls_vote_voted_at_id_idx'),
+        ]
+
+class TallyWatermark(models.Model):
+    # Records how far reconcile_tallies has verified the Vote table, and the
+    # per-choice vote counts (keyed by choice id) up to that point
+    name = models.CharField(max_length=64, unique=True)
+    voted_at = models.DateTimeField(null=True, blank=True)
+    vote_id = models.BigIntegerField(default=0)
+    counts = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.voted_at} #{self.vote_id}"
+
+class ChoiceTally(models.Model):
+    # Vote counter of a choice in a sharded poll, kept in the poll's shard
+    # and written with its ballots; Choice.votes takes over again when the
+    # ballots are archived. See polls/tallies.py
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='+')
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE, related_name='+')
+    votes = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Choice {self.choice_id} (poll {self.poll_id}): {self.votes}"
+
+class TurnoutBucket(models.Model):
+    # Per-poll vote counts rolled up into fixed time buckets, kept up to date
+    # by the vote path so turnout charts never have to scan Vote
+    RESOLUTION_CHOICES = [
+        ('minute', 'Minute'),
+        ('hour', 'Hour'),
+    ]
+
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='turnout_buckets')
+    resolution = models.CharField(max_length=8, choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField()
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('poll', 'resolution', 'bucket_start')
+
+    def __str__(self):
+        return f"{self.poll} {self.resolution} {self.bucket_start:%Y-%m-%d %H:%M}: {self.votes}"
+
+class TurnoutCell(models.Model):
+    # Ballots cast and voters eligible per poll and voter group (branch, sex,
+    # age band), kept up to date by the vote path so demographic turnout
+    # never has to scan Vote; see polls/demographics.py
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='turnout_cells')
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True)
+    sex = models.CharField(max_length=1, blank=True)
+    age_band = models.CharField(max_length=8)
+    votes = models.PositiveIntegerField(default=0)
+    eligible = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('poll', 'branch', 'sex', 'age_band')
+
+    def __str__(self):
+        return f"{self.poll} {self.branch_id}/{self.sex or '-'}/{self.age_band}: {self.votes}/{self.eligible}"
+
+class BallotArchive(models.Model):
+    # Ballots of a closed poll, moved out of the Vote table. The payload is a
+    # zlib-compressed array of little-endian (voter_id, choice_id, voted_at
+    # in epoch microseconds) int64 triples; see polls/archive.py
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, related_name='ballot_archive')
+    format_version = models.PositiveSmallIntegerField(default=1)
+    ballot_count = models.PositiveIntegerField(default=0)
+    payload = models.BinaryField()
+    checksum = models.CharField(max_length=64)
+    # Ranked polls only: zlib-compressed ballots x ranking_width matrix of
+    # uint32 choice ids in the same order as the payload, zero padded
+    rankings = models.BinaryField(null=True, blank=True)
+    ranking_width = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archive of {self.poll} ({self.ballot_count} ballots)"
+
+class BootStep(models.Model):
+    # Startup steps `manage.py boot` has completed, with the fingerprint of
+    # what they were run against (migration set, seed scripts) so an
+    # unchanged deploy can skip them; see polls/boot.py
+    name = models.CharField(max_length=32, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    completed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} {self.fingerprint[:12]} @ {self.completed_at}"
+
+class Job(models.Model):
+    # Heavy maintenance work (deletes, archives, recomputes, exports) queued
+    # from requests and commands and run by `manage.py run_jobs`; see
+    # polls/jobs.py
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    # Not picked up before this; pushed back after a failed attempt
+    run_after = models.DateTimeField(default=timezone.now)
+    # Set while running; a lease older than the runner's timeout is reclaimed
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='polls_job_status_run_after_idx'),
+        ]
+
+    def percent(self):
+        if not self.progress_total:
+            return 100 if self.status == self.SUCCEEDED else 0
+        return min(round(self.progress_done * 100 / self.progress_total), 100)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
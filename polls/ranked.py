@@ -0,0 +1,236 @@
+"""
+Ranked-choice counting (instant-runoff and single transferable vote).
+
+Ranked ballots are stored on Vote.ranking as packed little-endian uint32
+choice ids. To count a poll its ballots are loaded into one integer
+matrix (ballots x preferences, -1 padded), and every elimination round is
+a handful of NumPy operations over that matrix rather than a Python loop
+over ballots.
+"""
+import zlib
+
+import numpy as np
+from django.core.cache import cache
+
+from . import sharding
+from .archive import iter_archive
+from .models import BallotArchive, Vote
+
+RANKING_DTYPE = np.dtype('<u4')
+
+# Seconds a finished count is cached for; the key also changes with every vote
+CACHE_TIMEOUT = 300
+
+
+def encode_ranking(choice_ids):
+    return np.asarray(choice_ids, dtype=RANKING_DTYPE).tobytes()
+
+
+def decode_ranking(data):
+    return np.frombuffer(bytes(data), dtype=RANKING_DTYPE).tolist()
+
+
+def _to_indexes(ids, choice_ids):
+    """Map choice ids to column indexes 0..C-1, with -1 for padding and unknown ids"""
+    order = np.argsort(choice_ids)
+    sorted_ids = np.asarray(choice_ids, dtype=np.int64)[order]
+    ids = ids.astype(np.int64)
+    pos = np.clip(np.searchsorted(sorted_ids, ids), 0, len(sorted_ids) - 1)
+    found = (sorted_ids[pos] == ids) & (ids != 0)
+    return np.where(found, order[pos], -1).astype(np.int32)
+
+
+def _matrix_from_rows(rankings, width):
+    """Build a zero padded id matrix from a list of packed rankings"""
+    lengths = np.fromiter((len(r) // RANKING_DTYPE.itemsize for r in rankings), dtype=np.int64, count=len(rankings))
+    lengths = np.minimum(lengths, width)
+    flat = np.frombuffer(b''.join(bytes(r)[:width * RANKING_DTYPE.itemsize] for r in rankings), dtype=RANKING_DTYPE)
+
+    matrix = np.zeros((len(rankings), width), dtype=RANKING_DTYPE)
+    rows = np.repeat(np.arange(len(rankings)), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    matrix[rows, np.arange(len(flat)) - starts] = flat
+    return matrix
+
+
+def load_ballots(poll, choice_ids):
+    """Return the poll's ballots as an (n, len(choice_ids)) matrix of choice indexes"""
+    width = len(choice_ids)
+
+    ballot_archive = BallotArchive.objects.filter(poll=poll).first()
+    if ballot_archive is not None:
+        if ballot_archive.ranking_width:
+            ids = np.frombuffer(zlib.decompress(bytes(ballot_archive.rankings)), dtype=RANKING_DTYPE)
+            ids = ids.reshape(-1, ballot_archive.ranking_width)
+        else:
+            first = (choice_id for _, choice_id, _ in iter_archive(ballot_archive))
+            ids = np.fromiter(first, dtype=RANKING_DTYPE).reshape(-1, 1)
+        matrix = np.zeros((len(ids), width), dtype=RANKING_DTYPE)
+        kept = min(width, ids.shape[1])
+        matrix[:, :kept] = ids[:, :kept]
+        return _to_indexes(matrix, choice_ids)
+
+    rankings = []
+    rows = (
+        Vote.objects.using(sharding.db_for_poll(poll.id))
+        .filter(poll=poll)
+        .values_list('ranking', 'choice_id')
+        .iterator(chunk_size=10000)
+    )
+    for ranking, choice_id in rows:
+        # Ballots cast before the poll became ranked only carry a first preference
+        rankings.append(ranking if ranking else encode_ranking([choice_id]))
+
+    if not rankings:
+        return np.full((0, width), -1, dtype=np.int32)
+    return _to_indexes(_matrix_from_rows(rankings, width), choice_ids)
+
+
+def _current_preferences(ballots, continuing):
+    """Index of each ballot's highest-ranked continuing candidate, or -1 if exhausted"""
+    valid = ballots >= 0
+    live = valid & continuing[np.where(valid, ballots, 0)]
+    has_live = live.any(axis=1)
+    first = live.argmax(axis=1)
+    top = ballots[np.arange(len(ballots)), first]
+    return np.where(has_live, top, -1)
+
+
+def _lowest(tallies, candidates, history):
+    """Pick the candidate to eliminate, breaking ties on earlier rounds then position"""
+    lowest = tallies[candidates].min()
+    tied = [c for c in candidates if np.isclose(tallies[c], lowest)]
+    for previous in reversed(history):
+        if len(tied) == 1:
+            break
+        low = min(previous[c] for c in tied)
+        tied = [c for c in tied if np.isclose(previous[c], low)]
+    return tied[0]
+
+
+def count(ballots, num_candidates, seats=1, method='irv'):
+    """
+    Run an IRV or STV count over a ballot matrix of candidate indexes.
+
+    IRV elects the first candidate to hold a majority of the continuing
+    votes. STV uses the Droop quota and moves surpluses on at fractional
+    value (Gregory method). Returns (rounds, elected, quota) where each
+    round is a dict of tallies, elected, eliminated and exhausted votes.
+    Without any valid ballot there are no rounds and no one is elected.
+    """
+    n = len(ballots)
+    weights = np.ones(n, dtype=np.float64)
+    continuing = np.ones(num_candidates, dtype=bool)
+    elected = []
+    rounds = []
+    history = []
+
+    valid_ballots = int((ballots >= 0).any(axis=1).sum()) if n else 0
+    quota = None if method == 'irv' else valid_ballots // (seats + 1) + 1
+    if not valid_ballots:
+        # Nobody ranked anyone, so nobody is elected
+        return rounds, elected, quota
+
+    while len(elected) < seats and continuing.any():
+        top = _current_preferences(ballots, continuing)
+        assigned = top >= 0
+        tallies = np.bincount(top[assigned], weights=weights[assigned], minlength=num_candidates)
+        exhausted = float(weights[~assigned].sum())
+
+        candidates = [int(c) for c in np.flatnonzero(continuing)]
+        round_info = {
+            'tallies': tallies.copy(),
+            'elected': [],
+            'eliminated': [],
+            'exhausted': exhausted,
+        }
+
+        if len(candidates) + len(elected) <= seats:
+            # Everyone left fills the remaining seats
+            winners = sorted(candidates, key=lambda c: -tallies[c])
+            round_info['elected'] = winners
+            elected.extend(winners)
+            continuing[:] = False
+            rounds.append(round_info)
+            break
+
+        if method == 'irv':
+            threshold = tallies[candidates].sum() / 2
+            leader = max(candidates, key=lambda c: tallies[c])
+            if tallies[leader] > threshold or len(candidates) == 1:
+                round_info['elected'] = [leader]
+                elected.append(leader)
+                rounds.append(round_info)
+                break
+        else:
+            over_quota = [c for c in candidates if tallies[c] >= quota]
+            if over_quota:
+                winner = max(over_quota, key=lambda c: tallies[c])
+                surplus = tallies[winner] - quota
+                # Ballots sitting with the winner carry on at the surplus fraction
+                if tallies[winner] > 0:
+                    weights[top == winner] *= surplus / tallies[winner]
+                continuing[winner] = False
+                elected.append(winner)
+                round_info['elected'] = [winner]
+                rounds.append(round_info)
+                history.append(tallies)
+                continue
+
+        loser = _lowest(tallies, candidates, history)
+        continuing[loser] = False
+        round_info['eliminated'] = [loser]
+        rounds.append(round_info)
+        history.append(tallies)
+
+    return rounds, elected, quota
+
+
+def count_poll(poll, choices, total_votes):
+    """
+    Count a ranked poll and describe each round for the stats page.
+
+    ``choices`` is the poll's Choice list (with candidates loaded) and
+    ``total_votes`` its first-preference total, which keys the cache so a
+    new ballot invalidates it.
+    """
+    key = f'polls:ranked:{poll.id}:{poll.voting_method}:{poll.seats}:{total_votes}'
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    choices = list(choices)
+    choice_ids = [choice.id for choice in choices]
+    names = [choice.candidate.name if choice.candidate else 'Unknown' for choice in choices]
+
+    ballots = load_ballots(poll, choice_ids)
+    seats = 1 if poll.voting_method == 'irv' else max(poll.seats, 1)
+    rounds, elected, quota = count(ballots, len(choice_ids), seats=seats, method=poll.voting_method)
+
+    out_after = {}
+    for number, round_info in enumerate(rounds, start=1):
+        for c in round_info['elected'] + round_info['eliminated']:
+            out_after[c] = number
+
+    result = {
+        'method': poll.get_voting_method_display(),
+        'seats': seats,
+        'quota': quota,
+        'ballots': len(ballots),
+        'round_numbers': list(range(1, len(rounds) + 1)),
+        'winners': [names[c] for c in elected],
+        'rows': [
+            {
+                'name': names[c],
+                'elected': c in elected,
+                'tallies': [
+                    round(float(r['tallies'][c]), 2) if out_after.get(c, len(rounds)) >= number else None
+                    for number, r in enumerate(rounds, start=1)
+                ],
+            }
+            for c in range(len(choice_ids))
+        ],
+        'exhausted': [round(r['exhausted'], 2) for r in rounds],
+    }
+    cache.set(key, result, CACHE_TIMEOUT)
+    return result
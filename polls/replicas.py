@@ -0,0 +1,206 @@
+"""
+Read replicas for the read-heavy pages.
+
+Results, past elections, stats and exports only read, and on a busy
+election day they compete with ballots for the primary. Views wrapped in
+@read_from_replica run their queries against one of
+READ_REPLICAS['ALIASES'] instead; everything else, every write, and
+every view not wrapped (voting, the admin) stays on 'default'.
+
+A replica is either a SQLite copy of the primary, refreshed in place with
+the backup API by `manage.py refresh_replicas`, or any other database
+alias (a Postgres standby) kept current by its own replication. A SQLite
+copy older than MAX_LAG_SECONDS (its refresher stopped) is skipped.
+
+Read-your-writes: any successful POST (a vote, an admin edit) sets a
+short-lived cookie, and while it is present that browser's reads stay on
+the primary, so a voter never sees results from before their own ballot.
+STICKY_SECONDS should be longer than a replica's refresh interval.
+
+The Vote and TurnoutBucket routing of polls.sharding comes first and is
+unaffected.
+"""
+import contextvars
+import os
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from . import boot
+
+PIN_COOKIE = 'primary_pin'
+
+# The replica alias the current view reads from, if any
+_replica = contextvars.ContextVar('replica', default=None)
+
+
+def get_config():
+    """Return the replica settings merged over the defaults"""
+    config = {
+        'ALIASES': [],
+        'STICKY_SECONDS': 15,
+        'REFRESH_SECONDS': 10,
+        'MAX_LAG_SECONDS': 60,
+    }
+    config.update(getattr(settings, 'READ_REPLICAS', {}))
+    return config
+
+
+def is_replica(alias):
+    return alias in get_config()['ALIASES']
+
+
+def is_available(alias, config=None):
+    """Whether a replica can serve reads; SQLite copies must exist and be fresh"""
+    config = config or get_config()
+    path = boot.sqlite_path(alias)
+    if path is None:
+        return True
+    try:
+        refreshed = os.stat(path).st_mtime
+    except OSError:
+        return False
+    return time.time() - refreshed <= config['MAX_LAG_SECONDS']
+
+
+def choose():
+    """A replica alias to read from, or None to use the primary"""
+    config = get_config()
+    aliases = [alias for alias in config['ALIASES'] if is_available(alias, config)]
+    return random.choice(aliases) if aliases else None
+
+
+def is_pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+@contextmanager
+def reading_from(alias):
+    """Route reads inside the block to this alias (None for the primary)"""
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def current():
+    """The replica the current view reads from, or None"""
+    return _replica.get()
+
+
+def use_primary():
+    """Route reads inside the block to the primary, e.g. to fill a shared cache"""
+    return reading_from(None)
+
+
+def stream_from(alias, iterator):
+    """Read from a replica while a streamed response is being iterated"""
+    iterator = iter(iterator)
+    while True:
+        with reading_from(alias):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def read_from_replica(view):
+    """Run a view's reads against a replica unless the client is pinned to the primary"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            alias = None if is_pinned(request) else choose()
+            with reading_from(alias):
+                return await view(request, *args, **kwargs)
+        return markcoroutinefunction(wrapper)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = None if is_pinned(request) else choose()
+        with reading_from(alias):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReadFromReplicaMixin:
+    """@read_from_replica for class-based views"""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return read_from_replica(super().as_view(**initkwargs))
+
+
+def refresh(alias):
+    """Copy the primary into a SQLite replica, in place so open connections stay valid"""
+    source = boot.sqlite_path('default')
+    target = boot.sqlite_path(alias)
+    if source is None or target is None:
+        raise ValueError(f'{alias} is not a SQLite copy of a SQLite primary; it is kept current by its own replication')
+    boot.copy_sqlite(connections['default'].settings_dict['NAME'], target)
+    # The copy keeps the primary's schema and rows; mtime marks its freshness
+    os.utime(target)
+
+
+class PinToPrimaryMiddleware:
+    """After a successful write, keep this client's reads on the primary for a while"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        config = get_config()
+        if config['ALIASES'] and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, '1', max_age=config['STICKY_SECONDS'], httponly=True, samesite='Lax')
+        return response
+
+
+class ReplicaRouter:
+    """Send reads in @read_from_replica views to a replica, and every write to the primary"""
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is not None:
+            return alias
+        # A related lookup from an object loaded off a replica, outside
+        # a replica view, goes back to the primary
+        instance = hints.get('instance')
+        if instance is not None and is_replica(instance._state.db or ''):
+            return 'default'
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Without this, saving an object read from a replica would write to it
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        copies = {'default', *get_config()['ALIASES']}
+        if obj1._state.db in copies and obj2._state.db in copies:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if is_replica(db):
+            return False
+        return None
@@ -0,0 +1,177 @@
+import math
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncHour, TruncMinute
+
+from . import sharding
+from .models import BallotArchive, TurnoutBucket, Vote
+
+# Bucket width in seconds for each stored resolution
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 3600,
+}
+
+_TRUNCATE = {
+    'minute': TruncMinute,
+    'hour': TruncHour,
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def bucket_start(ts, seconds):
+    """Floor a timestamp to the start of its bucket"""
+    offset = int((ts - _EPOCH).total_seconds()) // seconds * seconds
+    return _EPOCH + timedelta(seconds=offset)
+
+
+def record_votes(poll_id, timestamps, using=None):
+    """
+    Add votes to the poll's turnout buckets.
+
+    Meant to run inside the transaction that inserts the votes, so the
+    rollups commit or roll back together with them.
+    """
+    buckets = TurnoutBucket.objects.db_manager(using)
+    for resolution, seconds in RESOLUTIONS.items():
+        counts = Counter(bucket_start(ts, seconds) for ts in timestamps)
+        for start, n in counts.items():
+            _add(buckets, {'poll_id': poll_id, 'resolution': resolution, 'bucket_start': start}, n)
+
+
+def _add(buckets, lookup, n):
+    if buckets.filter(**lookup).update(votes=F('votes') + n):
+        return
+    try:
+        with transaction.atomic(using=buckets.db):
+            buckets.create(votes=n, **lookup)
+    except IntegrityError:
+        # Another request created the bucket first
+        buckets.filter(**lookup).update(votes=F('votes') + n)
+
+
+def record_vote(poll_id, voted_at, using=None):
+    record_votes(poll_id, [voted_at], using=using)
+
+
+def record_poll_votes(poll_ids, voted_at, using=None):
+    """
+    Add one vote at the same moment to each of several polls' buckets.
+
+    Used by the combined ballot: one UPDATE per resolution covers every
+    poll whose bucket already exists, and the missing ones are inserted
+    together.
+    """
+    buckets = TurnoutBucket.objects.db_manager(using)
+    for resolution, seconds in RESOLUTIONS.items():
+        start = bucket_start(voted_at, seconds)
+        existing = buckets.filter(poll_id__in=poll_ids, resolution=resolution, bucket_start=start)
+        if existing.update(votes=F('votes') + 1) == len(poll_ids):
+            continue
+        # Only the first ballot of a bucket gets here
+        have = set(existing.values_list('poll_id', flat=True))
+        missing = [poll_id for poll_id in poll_ids if poll_id not in have]
+        try:
+            with transaction.atomic(using=buckets.db):
+                buckets.bulk_create([
+                    TurnoutBucket(poll_id=poll_id, resolution=resolution, bucket_start=start, votes=1)
+                    for poll_id in missing
+                ])
+        except IntegrityError:
+            # Raced with another request creating some of them; go one by one
+            for poll_id in missing:
+                _add(buckets, {'poll_id': poll_id, 'resolution': resolution, 'bucket_start': start}, 1)
+
+
+def backfill(poll_ids=None):
+    """Rebuild turnout buckets from the Vote table with one grouped query per resolution"""
+    # Archived polls no longer have Vote rows, so keep the buckets they closed with
+    archived = set(BallotArchive.objects.values_list('poll_id', flat=True))
+
+    created = 0
+    for using in sharding.ballot_databases():
+        created += _backfill_database(using, poll_ids, archived)
+    return created
+
+
+def _backfill_database(using, poll_ids, archived):
+    votes = Vote.objects.using(using).all()
+    buckets = TurnoutBucket.objects.using(using).exclude(poll_id__in=archived)
+    if poll_ids is not None:
+        votes = votes.filter(poll_id__in=poll_ids)
+        buckets = buckets.filter(poll_id__in=poll_ids)
+
+    created = 0
+    with transaction.atomic(using=using):
+        buckets.delete()
+        for resolution, truncate in _TRUNCATE.items():
+            rows = (
+                votes.annotate(bucket=truncate('voted_at', tzinfo=dt_timezone.utc))
+                .order_by()
+                .values('poll_id', 'bucket')
+                .annotate(n=Count('id'))
+            )
+            objs = [
+                TurnoutBucket(poll_id=row['poll_id'], resolution=resolution,
+                              bucket_start=row['bucket'], votes=row['n'])
+                for row in rows
+                if row['poll_id'] not in archived
+            ]
+            TurnoutBucket.objects.using(using).bulk_create(objs, batch_size=500)
+            created += len(objs)
+    return created
+
+
+def timeline(poll_id, start=None, end=None, max_points=120):
+    """
+    Return a downsampled turnout series for a poll.
+
+    Reads minute buckets when they fit in the requested number of points
+    (with up to 10x merging) and hour buckets otherwise, so the cost is
+    bounded by the number of stored buckets in the window, never by votes.
+    """
+    buckets = TurnoutBucket.objects.using(sharding.db_for_poll(poll_id)).filter(poll_id=poll_id)
+
+    if start is None or end is None:
+        bounds = buckets.filter(resolution='minute').order_by('bucket_start').values_list('bucket_start', flat=True)
+        first, last = bounds.first(), bounds.last()
+        if first is None:
+            return {'step_seconds': 0, 'labels': [], 'votes': [], 'cumulative': []}
+        start = start or first
+        end = end or last + timedelta(minutes=1)
+
+    window = max((end - start).total_seconds(), 1)
+    resolution = 'minute' if window / RESOLUTIONS['minute'] <= max_points * 10 else 'hour'
+    width = RESOLUTIONS[resolution]
+
+    # Merge whole stored buckets together until we're under max_points
+    step = width * max(1, math.ceil(window / width / max_points))
+    origin = bucket_start(start, width)
+    points = max(1, math.ceil((end - origin).total_seconds() / step))
+
+    series = [0] * points
+    rows = (
+        buckets.filter(resolution=resolution, bucket_start__gte=origin, bucket_start__lt=end)
+        .values_list('bucket_start', 'votes')
+    )
+    for ts, n in rows:
+        index = int((ts - origin).total_seconds()) // step
+        if 0 <= index < points:
+            series[index] += n
+
+    cumulative = []
+    running = 0
+    for n in series:
+        running += n
+        cumulative.append(running)
+
+    return {
+        'step_seconds': step,
+        'labels': [(origin + timedelta(seconds=i * step)).isoformat() for i in range(points)],
+        'votes': series,
+        'cumulative': cumulative,
+    }
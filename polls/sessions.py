@@ -0,0 +1,88 @@
+"""
+Cached database sessions with coalesced writes.
+
+Select with SESSION_MODE=coalesced. Every save goes to the session cache,
+but django_session is only written when something other than the
+volatile keys (flash messages and the voter context) changed, or when the
+last database write is more than SESSION_COALESCE_SECONDS old. Logins and
+logouts therefore still hit the database straight away, while the saves a
+vote causes mostly don't take the SQLite write lock.
+
+If the cache entry is lost, the session falls back to its database copy,
+which may lack up to SESSION_COALESCE_SECONDS of volatile changes.
+
+purge_expired() removes expired django_session rows in lock-sized
+batches; the job runner calls it on the RECURRING_JOBS schedule.
+"""
+import hashlib
+import json
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.utils import timezone
+
+from .voter_context import SESSION_KEY as VOTER_CONTEXT_KEY
+
+# Session keys whose changes alone don't need to reach the database
+VOLATILE_KEYS = {'_messages', VOTER_CONTEXT_KEY}
+
+_FINGERPRINT_KEY = '_coalesce_fingerprint'
+_SAVED_AT_KEY = '_coalesce_saved_at'
+
+
+def _fingerprint(data):
+    durable = {
+        key: value for key, value in data.items()
+        if key not in VOLATILE_KEYS and key not in (_FINGERPRINT_KEY, _SAVED_AT_KEY)
+    }
+    return hashlib.sha1(json.dumps(durable, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = 'polls.sessions.coalesced'
+
+    def save(self, must_create=False):
+        data = self._get_session(no_load=must_create)
+        fingerprint = _fingerprint(data)
+        interval = getattr(settings, 'SESSION_COALESCE_SECONDS', 60)
+
+        if (not must_create and self.session_key is not None
+                and data.get(_FINGERPRINT_KEY) == fingerprint
+                and time.time() - data.get(_SAVED_AT_KEY, 0) < interval):
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+            return
+
+        data[_FINGERPRINT_KEY] = fingerprint
+        data[_SAVED_AT_KEY] = time.time()
+        super().save(must_create)
+
+
+def purge_expired(batch_size=500, pause=0.05):
+    """
+    Delete expired django_session rows in small transactions.
+
+    A single DELETE of every expired row would hold the SQLite write lock
+    for as long as it takes; batches with a pause in between let vote
+    inserts in. Each batch is one DELETE ... WHERE session_key IN (SELECT
+    ... LIMIT n), so the rows aren't read first under a lock that then has
+    to be upgraded. Returns the number of sessions deleted.
+    """
+    from django.contrib.sessions.models import Session
+
+    engine = import_module(settings.SESSION_ENGINE)
+    if not issubclass(engine.SessionStore, DBStore):
+        # Cache and cookie sessions expire by themselves
+        engine.SessionStore.clear_expired()
+        return 0
+
+    purged = 0
+    while True:
+        expired = Session.objects.filter(expire_date__lt=timezone.now()).values('session_key')[:batch_size]
+        deleted, _ = Session.objects.filter(session_key__in=expired).delete()
+        if not deleted:
+            return purged
+        purged += deleted
+        time.sleep(pause)
@@ -0,0 +1,198 @@
+"""
+Opt-in per-election storage for ballots.
+
+When VOTE_SHARDING['ENABLED'] is set, every new poll gets its own SQLite
+file holding its ballots and everything written with them (Vote,
+ChoiceTally, TurnoutBucket and TurnoutCell rows), reached through a
+database alias named ``poll_shard_<poll id>``. Casting a ballot then only
+writes that file, so ballots for different elections take different
+write locks, and a closed election's ballots can be detached as a single
+file. Everything else (users, polls, choices) stays in the default
+database.
+"""
+import copy
+import os
+import shutil
+import threading
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+ALIAS_PREFIX = 'poll_shard_'
+
+# Models whose rows live in the per-election shard
+SHARDED_MODELS = {'vote', 'choicetally', 'turnoutbucket', 'turnoutcell'}
+
+_known_shards = set()
+_lock = threading.Lock()
+
+
+def get_config():
+    config = {
+        'ENABLED': False,
+        'DIRECTORY': os.path.join(settings.BASE_DIR, 'vote_shards'),
+    }
+    config.update(getattr(settings, 'VOTE_SHARDING', {}))
+    return config
+
+
+def is_enabled():
+    return get_config()['ENABLED']
+
+
+def shard_alias(poll_id):
+    return f'{ALIAS_PREFIX}{poll_id}'
+
+
+def is_shard_alias(alias):
+    return alias.startswith(ALIAS_PREFIX)
+
+
+def shard_path(poll_id):
+    return os.path.join(get_config()['DIRECTORY'], f'poll_{poll_id}.sqlite3')
+
+
+def _register(poll_id):
+    alias = shard_alias(poll_id)
+    with _lock:
+        if alias not in connections.settings:
+            # connections.settings is settings.DATABASES with defaults filled in
+            config = copy.deepcopy(connections.settings['default'])
+            config['NAME'] = shard_path(poll_id)
+            config['TEST'] = {**config.get('TEST', {}), 'NAME': None, 'MIRROR': None}
+            connections.settings[alias] = config
+        _known_shards.add(poll_id)
+    return alias
+
+
+def db_for_poll(poll_id):
+    """Return the database alias holding the ballots of a poll"""
+    if poll_id is None or not is_enabled():
+        return 'default'
+    if poll_id in _known_shards:
+        return shard_alias(poll_id)
+    # Shards created by another worker show up on disk; remember them once seen
+    if os.path.exists(shard_path(poll_id)):
+        return _register(poll_id)
+    return 'default'
+
+
+def shard_aliases():
+    """Aliases of every shard on disk, registering any we haven't seen yet"""
+    if not is_enabled():
+        return []
+    directory = get_config()['DIRECTORY']
+    if not os.path.isdir(directory):
+        return []
+    aliases = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith('poll_') and filename.endswith('.sqlite3'):
+            poll_id = int(filename[len('poll_'):-len('.sqlite3')])
+            aliases.append(_register(poll_id))
+    return aliases
+
+
+def ballot_databases():
+    """Every database that may hold Vote rows"""
+    return ['default'] + shard_aliases()
+
+
+def migrate_shard(alias):
+    call_command('migrate', 'polls', database=alias, verbosity=0, interactive=False)
+    # The schema editor turns foreign key enforcement back on when it exits;
+    # reconnect so the next query gets a connection with it relaxed again
+    connections[alias].close()
+
+
+def create_shard(poll_id):
+    """Create and migrate the shard file for a poll"""
+    os.makedirs(get_config()['DIRECTORY'], exist_ok=True)
+    alias = _register(poll_id)
+    migrate_shard(alias)
+    return alias
+
+
+def detach_shard(poll_id, destination=None):
+    """
+    Close and unregister a poll's shard, moving its file aside.
+
+    Returns the path the file was moved to.
+    """
+    alias = shard_alias(poll_id)
+    path = shard_path(poll_id)
+    with _lock:
+        if alias in connections.settings:
+            connections[alias].close()
+            del connections.settings[alias]
+        _known_shards.discard(poll_id)
+
+    if destination is None:
+        destination = os.path.join(get_config()['DIRECTORY'], 'detached')
+    os.makedirs(destination, exist_ok=True)
+    target = os.path.join(destination, os.path.basename(path))
+    if os.path.exists(path):
+        shutil.move(path, target)
+    return target
+
+
+def drop_shard(poll_id):
+    """Close a poll's shard and delete its file"""
+    target = detach_shard(poll_id)
+    if os.path.exists(target):
+        os.remove(target)
+
+
+@receiver(connection_created)
+def _relax_shard_foreign_keys(sender, connection, **kwargs):
+    # A shard only has the ballot tables; the voters, polls and choices its
+    # foreign keys point at live in the default database
+    if is_shard_alias(connection.alias) and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA foreign_keys = OFF')
+        # Migrations run a foreign key check on exit, which every shard row
+        # would fail for the same reason
+        connection.check_constraints = lambda table_names=None: None
+
+
+def _poll_id_from_hints(hints):
+    instance = hints.get('instance')
+    if instance is None:
+        return None
+    if instance._meta.model_name == 'poll':
+        return instance.pk
+    return getattr(instance, 'poll_id', None)
+
+
+class VoteShardRouter:
+    """Route ballot rows (see SHARDED_MODELS) to their election's shard"""
+
+    def _route(self, model, hints):
+        if model._meta.app_label == 'polls' and model._meta.model_name in SHARDED_MODELS:
+            poll_id = _poll_id_from_hints(hints)
+            return db_for_poll(poll_id) if poll_id is not None else None
+
+        # Related objects of a sharded row (vote.voter, vote.choice, ...)
+        # always come from the default database
+        instance = hints.get('instance')
+        if instance is not None and is_shard_alias(instance._state.db or ''):
+            return 'default'
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.model_name in SHARDED_MODELS or obj2._meta.model_name in SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if is_shard_alias(db):
+            return app_label == 'polls' and model_name in SHARDED_MODELS
+        return None
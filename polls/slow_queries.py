@@ -0,0 +1,321 @@
+"""
+Slow query log for the polls views.
+
+Every database connection gets one execute wrapper, installed as the
+connection is opened (connection_created) since connections are per
+thread. It times the query and, if a polls request is being served in the
+current context, logs the slow ones for that request. The request is
+carried in a context variable, so queries run through sync_to_async from
+the async views, and those run while a streamed response is being sent,
+are attributed to it as well.
+
+Each process writes and rotates a log file of its own, PATH with the pid
+before the extension (slow_queries.<pid>.jsonl): worker processes sharing
+one RotatingFileHandler file would rename it from under each other and
+lose lines. slow_query_report reads them all back together.
+"""
+import contextvars
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from logging.handlers import RotatingFileHandler
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+logger = logging.getLogger('polls.slow_queries')
+
+# Statement shapes we've already captured an EXPLAIN for (per process)
+_explained_shapes = set()
+_explain_lock = threading.Lock()
+_handler_lock = threading.Lock()
+# (pid, handler) for the file handler this module attached
+_handler = None
+
+# The recorder of the polls request being served, if any
+_recorder = contextvars.ContextVar('slow_query_recorder', default=None)
+
+# Set while this thread runs an EXPLAIN, which shouldn't be timed itself
+_local = threading.local()
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def get_config():
+    """Return the slow query settings merged over the defaults"""
+    config = {
+        'ENABLED': False,
+        'THRESHOLD_MS': 100,
+        'PATH': os.path.join(settings.BASE_DIR, 'logs', 'slow_queries.jsonl'),
+        'MAX_BYTES': 5 * 1024 * 1024,
+        'BACKUP_COUNT': 5,
+        'STACK_DEPTH': 8,
+    }
+    config.update(getattr(settings, 'SLOW_QUERY_LOG', {}))
+    return config
+
+
+def statement_shape(sql):
+    """Normalise a SQL statement so queries differing only in literals group together"""
+    shape = _STRING_LITERAL.sub('?', sql)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _IN_LIST.sub('IN (...)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+def process_log_path(path, pid=None):
+    """The file one process logs to: logs/slow_queries.jsonl -> logs/slow_queries.<pid>.jsonl"""
+    root, ext = os.path.splitext(str(path))
+    return f'{root}.{pid or os.getpid()}{ext}'
+
+
+def log_files(path):
+    """Every process's log file for PATH, rotated ones included"""
+    root, ext = os.path.splitext(str(path))
+    # The per-process files, their rotations (.1, .2, ...) and a log from
+    # before they were split, but nothing else that starts with the name
+    pattern = re.compile(re.escape(root) + r'(\.\d+)?' + re.escape(ext) + r'(\.\d+)?')
+    return sorted(name for name in glob.glob(f'{glob.escape(root)}*') if pattern.fullmatch(name))
+
+
+def _ensure_handler(config):
+    # The file handler is attached lazily so a disabled log never touches the disk
+    global _handler
+    pid = os.getpid()
+    if _handler is not None and _handler[0] == pid:
+        return
+    with _handler_lock:
+        if _handler is None and logger.handlers:
+            # Configured through LOGGING instead
+            return
+        if _handler is not None:
+            if _handler[0] == pid:
+                return
+            # Inherited from the parent across a fork; that file is the parent's
+            logger.removeHandler(_handler[1])
+        path = process_log_path(config['PATH'], pid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=config['MAX_BYTES'],
+            backupCount=config['BACKUP_COUNT'],
+            encoding='utf-8',
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        _handler = (pid, handler)
+
+
+def _stack_summary(depth):
+    """Return the innermost project frames that led to the query"""
+    base_dir = str(settings.BASE_DIR)
+    frames = []
+    for frame in traceback.extract_stack()[:-3]:
+        filename = frame.filename
+        if not filename.startswith(base_dir) or 'site-packages' in filename:
+            continue
+        if filename == __file__:
+            continue
+        frames.append(f'{os.path.relpath(filename, base_dir)}:{frame.lineno} in {frame.name}')
+    return frames[-depth:]
+
+
+def _explain(connection, sql, params):
+    if connection.vendor == 'sqlite':
+        explain_sql = f'EXPLAIN QUERY PLAN {sql}'
+    elif connection.vendor == 'postgresql':
+        explain_sql = f'EXPLAIN {sql}'
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(explain_sql, params)
+            return [' | '.join(str(col) for col in row) for row in cursor.fetchall()]
+    except Exception as e:
+        return [f'EXPLAIN failed: {e}']
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Time a query and hand slow ones to the current request's recorder"""
+    recorder = _recorder.get()
+    if recorder is None or not recorder.active or getattr(_local, 'explaining', False):
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        if duration >= recorder.threshold:
+            recorder.record(context['connection'], sql, params, many, duration)
+
+
+def install(connection):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+@receiver(connection_created)
+def _connection_created(sender, connection, **kwargs):
+    if get_config()['ENABLED']:
+        install(connection)
+
+
+class SlowQueryRecorder:
+    """Logs the slow queries of one request, once it's known to be for a polls view"""
+
+    def __init__(self, request, config):
+        self.request = request
+        self.config = config
+        self.threshold = config['THRESHOLD_MS'] / 1000.0
+        self.active = False
+
+    def record(self, connection, sql, params, many, duration):
+        shape = statement_shape(sql)
+        entry = {
+            'ts': timezone.now().isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'database': connection.alias,
+            'shape': shape,
+            'sql': sql,
+            'params': None if many else _jsonable(params),
+            'many': many,
+            'view': getattr(getattr(self.request, 'resolver_match', None), 'view_name', None),
+            'path': self.request.path,
+            'method': self.request.method,
+            'stack': _stack_summary(self.config['STACK_DEPTH']),
+        }
+
+        # Only capture the plan the first time we see this statement shape
+        with _explain_lock:
+            first_sighting = shape not in _explained_shapes
+            _explained_shapes.add(shape)
+        if first_sighting and not many and sql.lstrip().upper().startswith('SELECT'):
+            _local.explaining = True
+            try:
+                entry['plan'] = _explain(connection, sql, params)
+            finally:
+                _local.explaining = False
+
+        _ensure_handler(self.config)
+        logger.info(json.dumps(entry, default=str))
+
+
+def _jsonable(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _jsonable_value(v) for k, v in params.items()}
+    return [_jsonable_value(v) for v in params]
+
+
+def _jsonable_value(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (bytes, memoryview)):
+        return f'<{len(value)} bytes>'
+    return str(value)
+
+
+def _stream_recorded(recorder, iterator):
+    # The body of a streamed response is produced after the view returned
+    iterator = iter(iterator)
+    while True:
+        token = _recorder.set(recorder)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _recorder.reset(token)
+        yield chunk
+
+
+async def _astream_recorded(recorder, iterator):
+    iterator = aiter(iterator)
+    while True:
+        token = _recorder.set(recorder)
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        finally:
+            _recorder.reset(token)
+        yield chunk
+
+
+class SlowQueryMiddleware:
+    """Time every query issued while a polls view runs and log the slow ones"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = get_config()
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        recorder = request._slow_query_recorder = SlowQueryRecorder(request, config)
+        token = _recorder.set(recorder)
+        try:
+            return self.process_response(request, self.get_response(request))
+        finally:
+            _recorder.reset(token)
+
+    async def __acall__(self, request):
+        config = get_config()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+
+        recorder = request._slow_query_recorder = SlowQueryRecorder(request, config)
+        token = _recorder.set(recorder)
+        try:
+            return self.process_response(request, await self.get_response(request))
+        finally:
+            _recorder.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = getattr(request, '_slow_query_recorder', None)
+        if recorder is None:
+            return None
+        match = request.resolver_match
+        if match is None or 'polls' not in match.namespaces:
+            return None
+
+        # Connections this thread opened before logging was enabled
+        for connection in connections.all(initialized_only=True):
+            install(connection)
+        # The recorder object is shared with every context copied from the
+        # request's (sync_to_async threads), so this reaches them all
+        recorder.active = True
+        return None
+
+    def process_response(self, request, response):
+        recorder = request._slow_query_recorder
+        if recorder.active and response.streaming:
+            if response.is_async:
+                response.streaming_content = _astream_recorded(recorder, response.streaming_content)
+            else:
+                response.streaming_content = _stream_recorded(recorder, response.streaming_content)
+        return response
@@ -0,0 +1,53 @@
+"""
+Static files storage used by collectstatic.
+
+WhiteNoise's CompressedManifestStaticFilesStorage gives every file a
+content hash in its name (which WhiteNoise then serves with an immutable,
+far-future Cache-Control) and writes .gz and .br variants next to it. On
+top of that, a .webp copy of each JPEG and PNG is generated when Pillow is
+installed, so CSS can offer it with image-set().
+"""
+import io
+import os
+
+from django.core.files.base import ContentFile
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+WEBP_SOURCES = ('.jpg', '.jpeg', '.png')
+
+WEBP_QUALITY = 80
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    # A template referring to a file collectstatic didn't see should get
+    # the unhashed URL rather than a 500
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = dict(paths)
+            paths.update(self._webp_variants(paths))
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+
+    def _webp_variants(self, paths):
+        try:
+            from PIL import Image
+        except ImportError:
+            return {}
+
+        variants = {}
+        for name in paths:
+            root, ext = os.path.splitext(name)
+            webp_name = root + '.webp'
+            if ext.lower() not in WEBP_SOURCES or webp_name in paths:
+                continue
+            with self.open(name) as f, Image.open(f) as image:
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                buffer = io.BytesIO()
+                image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+            if self.exists(webp_name):
+                self.delete(webp_name)
+            self.save(webp_name, ContentFile(buffer.getvalue()))
+            variants[webp_name] = (self, webp_name)
+        return variants
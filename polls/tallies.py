@@ -0,0 +1,271 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import sharding
+from .models import Choice, ChoiceTally, Vote, TallyWatermark
+
+WATERMARK_NAME = 'votes'
+
+
+class Drift:
+    """A choice whose stored counter disagrees with the Vote table"""
+
+    def __init__(self, choice_id, poll_id, stored, counted):
+        self.choice_id = choice_id
+        self.poll_id = poll_id
+        self.stored = stored
+        self.counted = counted
+
+    def __str__(self):
+        return (f"Choice {self.choice_id} (poll {self.poll_id}): "
+                f"stored {self.stored}, counted {self.counted}")
+
+
+def _next_watermark(votes, cutoff):
+    """Return the greatest (voted_at, id) among votes at or before the cutoff"""
+    return (
+        votes.filter(voted_at__lte=cutoff)
+        .order_by('-voted_at', '-id')
+        .values_list('voted_at', 'id')
+        .first()
+    )
+
+
+def _after_watermark(watermark):
+    if watermark.voted_at is None:
+        return Q()
+    return Q(voted_at__gt=watermark.voted_at) | Q(voted_at=watermark.voted_at, id__gt=watermark.vote_id)
+
+
+def record_votes(votes, using='default'):
+    """
+    Count ballots in their choices' counters.
+
+    Meant to run inside the transaction that inserts the ballots. Counters
+    live next to the ballots: Choice.votes in the default database, or the
+    poll's ChoiceTally rows in its shard, so a sharded ballot doesn't write
+    the default database at all. One UPDATE covers every choice already
+    counted; only a choice's first ballot in a shard creates its row.
+    """
+    choice_ids = [vote.choice_id for vote in votes]
+    if using == 'default':
+        Choice.objects.filter(pk__in=choice_ids).update(votes=F('votes') + 1)
+        return
+    tallies = ChoiceTally.objects.using(using)
+    if tallies.filter(choice_id__in=choice_ids).update(votes=F('votes') + 1) == len(choice_ids):
+        return
+    have = set(tallies.filter(choice_id__in=choice_ids).values_list('choice_id', flat=True))
+    tallies.bulk_create([
+        ChoiceTally(poll_id=vote.poll_id, choice_id=vote.choice_id, votes=1)
+        for vote in votes if vote.choice_id not in have
+    ])
+
+
+def sharded_votes(poll_ids=None):
+    """
+    {poll_id: {choice_id: votes}} for the sharded polls among poll_ids (or
+    all of them), with one query per shard. Choices without a ballot yet
+    have no counter and are left out.
+    """
+    if poll_ids is None:
+        aliases = sharding.shard_aliases()
+    else:
+        aliases = {sharding.db_for_poll(poll_id) for poll_id in poll_ids} - {'default'}
+    counts = {}
+    for alias in aliases:
+        counts[int(alias[len(sharding.ALIAS_PREFIX):])] = dict(
+            ChoiceTally.objects.using(alias).values_list('choice_id', 'votes')
+        )
+    return counts
+
+
+def choice_votes(poll_ids):
+    """{choice_id: votes} for the polls, from wherever their counters live"""
+    sharded = sharded_votes(poll_ids)
+    counts = dict(
+        Choice.objects.filter(poll_id__in=[poll_id for poll_id in poll_ids if poll_id not in sharded])
+        .values_list('id', 'votes')
+    )
+    for poll_counts in sharded.values():
+        counts.update(poll_counts)
+    return counts
+
+
+def _compare(expected, stored):
+    """Drifts between expected counts and stored {choice_id: (poll_id, votes)}"""
+    drifts = []
+    for choice_id, (poll_id, votes) in stored.items():
+        counted = expected.get(choice_id, 0)
+        if votes != counted:
+            drifts.append(Drift(choice_id, poll_id, votes, counted))
+    return drifts
+
+
+def _repair(drifts, using):
+    """
+    Add each drift's difference to its counter.
+
+    Ballots cast since the scan have bumped their counter and the Vote table
+    alike, so the difference still holds; writing the counted total back
+    would undo them. The UPDATEs come first, so on SQLite the write lock is
+    held before the missing shard counters are looked for.
+    """
+    by_delta = {}
+    for drift in drifts:
+        by_delta.setdefault(drift.counted - drift.stored, []).append(drift.choice_id)
+    if using == 'default':
+        for delta, choice_ids in by_delta.items():
+            Choice.objects.filter(pk__in=choice_ids).update(votes=F('votes') + delta)
+        return
+    tallies = ChoiceTally.objects.using(using)
+    for delta, choice_ids in by_delta.items():
+        tallies.filter(choice_id__in=choice_ids).update(votes=F('votes') + delta)
+    # A counter that is still missing had no ballot when it was read, so it stored 0
+    have = set(tallies.filter(choice_id__in=[drift.choice_id for drift in drifts]).values_list('choice_id', flat=True))
+    tallies.bulk_create(
+        [ChoiceTally(poll_id=drift.poll_id, choice_id=drift.choice_id, votes=drift.counted)
+         for drift in drifts if drift.choice_id not in have],
+        batch_size=500,
+    )
+
+
+def _live_choices(poll_ids):
+    # Archived polls have no Vote rows left and frozen polls have a
+    # certified tally; either way their counters are final
+    choices = Choice.objects.filter(poll__ballot_archive__isnull=True, poll__results_frozen_at__isnull=True)
+    if poll_ids is not None:
+        choices = choices.filter(poll_id__in=poll_ids)
+    return choices
+
+
+def _stored(using, choices, poll_ids):
+    """
+    {choice_id: (poll_id, votes)} from a database's counters, locked on
+    backends that can, so no ballot moves them before the scan that follows
+    """
+    if using == 'default':
+        counters = _live_choices(poll_ids).select_for_update(of=('self',))
+        votes = dict(counters.values_list('id', 'votes'))
+    else:
+        counters = ChoiceTally.objects.using(using).select_for_update().filter(choice_id__in=[choice.id for choice in choices])
+        votes = dict(counters.values_list('choice_id', 'votes'))
+    return {choice.id: (choice.poll_id, votes.get(choice.id, 0)) for choice in choices}
+
+
+def _save_watermark(scan, live_ids):
+    counts = {str(choice_id): n for choice_id, n in scan['settled'].items() if n and choice_id in live_ids}
+    fields = {'counts': counts, 'updated_at': timezone.now()}
+    if scan['position'] is not None:
+        fields['voted_at'], fields['vote_id'] = scan['position']
+    # UPDATE before INSERT, so SQLite takes the write lock with its first statement
+    name = _watermark_name(scan['using'])
+    if not TallyWatermark.objects.filter(name=name).update(**fields):
+        TallyWatermark.objects.create(name=name, **fields)
+
+
+def _watermark_name(using):
+    return WATERMARK_NAME if using == 'default' else f'{WATERMARK_NAME}:{using}'
+
+
+def unreconciled_votes(using='default'):
+    """
+    A ballot database's votes past its own watermark, i.e. not yet verified
+    by an incremental run, or None if that database has no watermark yet.
+    """
+    watermark = TallyWatermark.objects.filter(name=_watermark_name(using)).first()
+    if watermark is None:
+        return None
+    return Vote.objects.using(using).filter(_after_watermark(watermark))
+
+
+def _scan(using, poll_ids, incremental, cutoff):
+    """Count one database's votes per choice, past its watermark when incremental"""
+    watermark = None
+    if incremental:
+        watermark = TallyWatermark.objects.filter(name=_watermark_name(using)).first()
+
+    votes = Vote.objects.using(using).all()
+    if poll_ids is not None:
+        votes = votes.filter(poll_id__in=poll_ids)
+
+    if watermark is not None:
+        base = {int(choice_id): n for choice_id, n in watermark.counts.items()}
+        votes = votes.filter(_after_watermark(watermark))
+    else:
+        base = {}
+
+    rows = (
+        votes.order_by()
+        .values('choice_id')
+        .annotate(total=Count('id'), settled=Count('id', filter=Q(voted_at__lte=cutoff)))
+    )
+
+    expected = dict(base)
+    settled = dict(base)
+    scanned = 0
+    for row in rows:
+        expected[row['choice_id']] = expected.get(row['choice_id'], 0) + row['total']
+        settled[row['choice_id']] = settled.get(row['choice_id'], 0) + row['settled']
+        scanned += row['total']
+
+    return {
+        'using': using,
+        'watermark': watermark,
+        'position': _next_watermark(votes, cutoff),
+        'expected': expected,
+        'settled': settled,
+        'scanned': scanned,
+    }
+
+
+def reconcile(incremental=False, repair=True, lag_seconds=5, poll_ids=None):
+    """
+    Recompute the vote counters from the Vote table and repair any drift.
+
+    A full run counts every vote with one GROUP BY choice_id. An incremental
+    run only groups the votes newer than the stored (voted_at, id) watermark
+    and adds them to the per-choice counts saved with it. Votes from the last
+    ``lag_seconds`` are counted but the watermark is not advanced past them,
+    so a transaction that commits a little late is still picked up next run.
+
+    Each ballot database (the default one and any vote shards) is scanned,
+    watermarked and repaired separately, against the counters kept in it:
+    Choice.votes in the default database, ChoiceTally rows in a shard. The
+    counters are read in the same transaction as the scan, locked where the
+    backend allows, and the drift is then added to them in a short write
+    transaction of its own; on SQLite the scan only ever holds a read lock.
+
+    Returns (drifts, scanned_votes).
+    """
+    cutoff = timezone.now() - timedelta(seconds=lag_seconds)
+    incremental = incremental and poll_ids is None
+
+    choices = list(_live_choices(poll_ids).only('id', 'poll_id'))
+    live_ids = {choice.id for choice in choices}
+
+    by_db = {}
+    for choice in choices:
+        by_db.setdefault(sharding.db_for_poll(choice.poll_id), []).append(choice)
+
+    drifts = []
+    scanned = 0
+    for using in sharding.ballot_databases():
+        with transaction.atomic(using=using):
+            stored = _stored(using, by_db.get(using, []), poll_ids)
+            scan = _scan(using, poll_ids, incremental, cutoff)
+        db_drifts = _compare(scan['expected'], stored)
+        drifts += db_drifts
+        scanned += scan['scanned']
+        if not repair:
+            continue
+        if db_drifts:
+            with transaction.atomic(using=using):
+                _repair(db_drifts, using)
+        # A poll-restricted run can't speak for the whole table, so it never moves the watermark
+        if poll_ids is None:
+            _save_watermark(scan, live_ids)
+
+    return drifts, scanned
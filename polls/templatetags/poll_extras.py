@@ -1,4 +1,5 @@
 from django import template
+from django.utils.safestring import mark_safe
 import time
 
 register = template.Library()
@@ -9,4 +10,18 @@ def timestamp(value):
     try:
         return time.mktime(value.timetuple())
     except (AttributeError, ValueError):
-        return '' 
\ No newline at end of file
+        return ''
+
+
+@register.simple_tag(takes_context=True)
+def ballot_body(context, poll):
+    """Render the poll's cached ballot fragment with this request's CSRF token"""
+    from polls.fragments import ballot_body as render_ballot_body
+    return mark_safe(render_ballot_body(context['request'], poll))
+
+
+@register.simple_tag
+def vendor_url(key):
+    """URL of a vendored library (see polls/assets.py), or its CDN URL if not downloaded"""
+    from polls.assets import vendor_url as asset_url
+    return asset_url(key)
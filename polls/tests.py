@@ -1,3 +1,1331 @@
-from django.test import TestCase
+import contextlib
+import copy
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zlib
+from datetime import datetime, timezone as dt_timezone
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    admin, archive, assets, boot, bulk, casting, compression, deletion, demographics, exports, fragments, health, jobs,
+    metadata, ranked, replicas, rollups, sessions, sharding, slow_queries, tallies, voter_context,
+)
+from .management.commands import boot as boot_command, vendor_assets
+from .models import Branch, Candidate, Choice, ChoiceTally, Job, Poll, TallyWatermark, TurnoutBucket, TurnoutCell, Vote, Voter
+from .replicas import PIN_COOKIE, PinToPrimaryMiddleware, ReplicaRouter, read_from_replica
+
+REPLICA = 'replica_test'
+
+# Keeps tests out of the file caches the settings point at
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'tests-{alias}'}
+    for alias in ('default', 'sessions')
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'slow.jsonl')
+        config = override_settings(SLOW_QUERY_LOG={'ENABLED': True, 'THRESHOLD_MS': 0, 'PATH': self.path})
+        config.enable()
+        self.addCleanup(config.disable)
+        self.addCleanup(self.detach_handler)
+
+    def detach_handler(self):
+        if slow_queries._handler is not None:
+            _, handler = slow_queries._handler
+            slow_queries.logger.removeHandler(handler)
+            handler.close()
+            slow_queries._handler = None
+
+    def test_a_polls_view_logs_its_queries_to_this_process_file(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get(reverse('polls:index')).status_code, 200)
+
+        with open(slow_queries.process_log_path(self.path)) as fh:
+            entries = [json.loads(line) for line in fh]
+        self.assertTrue(entries)
+        self.assertEqual({entry['view'] for entry in entries}, {'polls:index'})
+        self.assertEqual(slow_queries.log_files(self.path), [slow_queries.process_log_path(self.path)])
+
+    def test_the_report_reads_every_process_file(self):
+        lines = {
+            slow_queries.process_log_path(self.path, 101): [('SELECT 1', 5)],
+            slow_queries.process_log_path(self.path, 101) + '.1': [('SELECT 1', 7)],
+            slow_queries.process_log_path(self.path, 202): [('SELECT 2', 3)],
+            self.path + '.bak': [('SELECT 3', 1)],
+        }
+        for filename, entries in lines.items():
+            with open(filename, 'w') as fh:
+                for shape, duration_ms in entries:
+                    fh.write(json.dumps({'shape': shape, 'duration_ms': duration_ms}) + '\n')
+
+        out = io.StringIO()
+        call_command('slow_query_report', stdout=out)
+        self.assertIn('3 slow queries across 2 statement shapes', out.getvalue())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite replicas are copies of a SQLite primary')
+@override_settings(READ_REPLICAS={'ALIASES': [REPLICA], 'STICKY_SECONDS': 15, 'MAX_LAG_SECONDS': 60})
+class ReplicaRoutingTests(TransactionTestCase):
+    """The primary and a replica as two SQLite files, the replica refreshed with the backup API"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        config = copy.deepcopy(connections.settings['default'])
+        config['NAME'] = os.path.join(self.directory, 'replica.sqlite3')
+        config['TEST'] = {**config.get('TEST', {}), 'NAME': None, 'MIRROR': None}
+        connections.settings[REPLICA] = config
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(self.directory)
+
+    def poll_ids(self):
+        return set(Poll.objects.values_list('id', flat=True))
+
+    def test_router_sends_reads_to_the_replica_and_writes_to_the_primary(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Poll))
+        with replicas.reading_from(REPLICA):
+            self.assertEqual(router.db_for_read(Poll), REPLICA)
+            self.assertEqual(router.db_for_write(Poll), 'default')
+            with replicas.use_primary():
+                self.assertIsNone(router.db_for_read(Poll))
+        self.assertFalse(router.allow_migrate(REPLICA, 'polls', 'poll'))
+
+    def test_replica_reads_see_the_primary_as_of_the_last_refresh(self):
+        first = Poll.objects.create(question='First', pub_date=timezone.now())
+        replicas.refresh(REPLICA)
+        second = Poll.objects.create(question='Second', pub_date=timezone.now())
+
+        with replicas.reading_from(REPLICA):
+            self.assertEqual(self.poll_ids(), {first.id})
+        self.assertEqual(self.poll_ids(), {first.id, second.id})
+
+        replicas.refresh(REPLICA)
+        with replicas.reading_from(REPLICA):
+            self.assertEqual(self.poll_ids(), {first.id, second.id})
+
+    def test_objects_read_from_the_replica_are_saved_to_the_primary(self):
+        poll = Poll.objects.create(question='Before', pub_date=timezone.now())
+        replicas.refresh(REPLICA)
+
+        with replicas.reading_from(REPLICA):
+            stale = Poll.objects.get(pk=poll.id)
+        self.assertEqual(stale._state.db, REPLICA)
+        stale.question = 'After'
+        stale.save()
+        Choice.objects.create(poll=stale)
+
+        self.assertEqual(Poll.objects.get(pk=poll.id).question, 'After')
+        self.assertEqual(Choice.objects.filter(poll=poll).count(), 1)
+        with replicas.reading_from(REPLICA):
+            self.assertEqual(Poll.objects.get(pk=poll.id).question, 'Before')
+
+    def test_view_reads_from_the_replica_unless_pinned(self):
+        poll = Poll.objects.create(question='Before', pub_date=timezone.now())
+        replicas.refresh(REPLICA)
+        Poll.objects.filter(pk=poll.id).update(question='After')
+
+        @read_from_replica
+        def view(request):
+            return HttpResponse(Poll.objects.get(pk=poll.id).question)
+
+        self.assertEqual(view(self.factory.get('/')).content, b'Before')
+
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(view(request).content, b'After')
+
+    def test_missing_or_stale_replica_falls_back_to_the_primary(self):
+        self.assertIsNone(replicas.choose())
+        replicas.refresh(REPLICA)
+        self.assertEqual(replicas.choose(), REPLICA)
+
+        old = timezone.now().timestamp() - 120
+        os.utime(connections.settings[REPLICA]['NAME'], (old, old))
+        self.assertIsNone(replicas.choose())
+
+    def test_successful_writes_pin_the_client_to_the_primary(self):
+        middleware = PinToPrimaryMiddleware(lambda request: HttpResponse(status=302))
+        response = middleware(self.factory.post('/1/vote/'))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 15)
+
+        self.assertNotIn(PIN_COOKIE, middleware(self.factory.get('/1/results/')).cookies)
+
+        failing = PinToPrimaryMiddleware(lambda request: HttpResponse(status=403))
+        self.assertNotIn(PIN_COOKIE, failing(self.factory.post('/1/vote/')).cookies)
+
+
+class EligibilityTests(TestCase):
+    def test_active_polls_only_lists_polls_open_to_the_branch(self):
+        cse = Branch.objects.create(branch_name='Computer Science', branch_code='CSE')
+        ece = Branch.objects.create(branch_name='Electronics', branch_code='ECE')
+        everyone = Poll.objects.create(question='Everyone', pub_date=timezone.now())
+        cse_only = Poll.objects.create(question='CSE only', pub_date=timezone.now(), branch=cse)
+        Poll.objects.create(question='ECE only', pub_date=timezone.now(), branch=ece)
+
+        self.assertEqual({poll.id for poll in casting.active_polls(cse.id)}, {everyone.id, cse_only.id})
+        self.assertEqual({poll.id for poll in casting.active_polls(None)}, {everyone.id})
+
+class TurnoutCubeTests(TestCase):
+    """The (poll, branch, sex, age band) turnout cube kept by the vote path"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cse = Branch.objects.create(branch_name='Computer Science', branch_code='CSE')
+        cls.ece = Branch.objects.create(branch_name='Electronics', branch_code='ECE')
+        people = [
+            ('asha', cls.cse, 'F', 19),
+            ('ravi', cls.cse, 'M', 19),
+            ('meera', cls.cse, 'F', 22),
+            ('kiran', cls.ece, 'M', 31),
+            ('dev', cls.ece, 'M', None),
+        ]
+        cls.voters = {}
+        for name, branch, sex, age in people:
+            user = User.objects.create_user(name)
+            cls.voters[name] = Voter.objects.create(user=user, name=name, branch=branch, sex=sex, age=age)
+        cls.open_poll = Poll.objects.create(question='Open to all', pub_date=timezone.now())
+        cls.cse_poll = Poll.objects.create(question='CSE only', pub_date=timezone.now(), branch=cls.cse)
+        cls.open_choice = Choice.objects.create(poll=cls.open_poll)
+        cls.cse_choice = Choice.objects.create(poll=cls.cse_poll)
+
+    def vote(self, name, *polls):
+        choices = {self.open_poll.id: self.open_choice, self.cse_poll.id: self.cse_choice}
+        casting.cast_votes(self.voters[name], [(poll, choices[poll.id], None) for poll in polls])
+
+    def cells(self):
+        return set(TurnoutCell.objects.values_list('poll_id', 'branch_id', 'sex', 'age_band', 'votes', 'eligible'))
+
+    def test_ballots_are_counted_per_group_and_match_a_rebuild(self):
+        self.vote('asha', self.open_poll, self.cse_poll)
+        self.vote('ravi', self.open_poll)
+        self.vote('kiran', self.open_poll)
+        incremental = self.cells()
+
+        self.assertIn((self.open_poll.id, self.cse.id, 'F', '18-20', 1, 1), incremental)
+        self.assertIn((self.open_poll.id, self.ece.id, 'M', 'unknown', 0, 1), incremental)
+        # Only CSE voters are eligible in the CSE poll
+        self.assertEqual(
+            {cell[1] for cell in incremental if cell[0] == self.cse_poll.id}, {self.cse.id}
+        )
+
+        demographics.rebuild()
+        self.assertEqual(self.cells(), incremental)
+
+    def test_a_ballot_updates_one_cell_per_submission_once_seeded(self):
+        self.vote('asha', self.open_poll)
+        with CaptureQueriesContext(connection) as queries:
+            self.vote('meera', self.open_poll, self.cse_poll)
+        cube = [query['sql'] for query in queries if TurnoutCell._meta.db_table in query['sql']]
+        # The CSE poll's first ballot seeds its cells
+        self.assertGreater(len(cube), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.vote('ravi', self.open_poll, self.cse_poll)
+        cube = [query['sql'] for query in queries if TurnoutCell._meta.db_table in query['sql']]
+        self.assertEqual(len(cube), 1)
+        # On PostgreSQL the cell UPDATE is part of the single cast statement
+        self.assertTrue(cube[0].lstrip().startswith(('UPDATE', 'WITH')))
+
+    def test_breakdown_costs_the_same_queries_however_many_ballots(self):
+        poll_ids = [self.open_poll.id, self.cse_poll.id]
+        self.vote('asha', self.open_poll)
+        with self.assertNumQueries(1):
+            before = demographics.breakdown(poll_ids, ['sex', 'age'])
+        for name in ('ravi', 'meera', 'kiran', 'dev'):
+            self.vote(name, self.open_poll)
+        self.vote('ravi', self.cse_poll)
+        with self.assertNumQueries(1):
+            after = demographics.breakdown(poll_ids, ['sex', 'age'])
+        self.assertEqual(len(before), len(after))
+        # The branch labels are one more query
+        with self.assertNumQueries(2):
+            by_branch = demographics.breakdown(poll_ids, ['branch'])
+
+        self.assertEqual(
+            [(row['group'], row['votes'], row['eligible']) for row in by_branch],
+            [({'branch': 'Computer Science'}, 4, 6), ({'branch': 'Electronics'}, 2, 2)],
+        )
+        self.assertEqual(
+            demographics.breakdown(poll_ids, []),
+            [{'group': {}, 'votes': 6, 'eligible': 8, 'turnout': 75.0}],
+        )
+
+
+def ballot_matrix(groups, width):
+    """A ballot matrix from (count, [candidate indexes in preference order]) pairs"""
+    rows = []
+    for n, preferences in groups:
+        rows += [preferences + [-1] * (width - len(preferences))] * n
+    return np.array(rows, dtype=np.int32).reshape(-1, width)
+
+
+class RankedCountTests(SimpleTestCase):
+    """Textbook counts for the ranked-choice engine"""
+
+    def test_irv_tennessee_capital(self):
+        memphis, nashville, chattanooga, knoxville = range(4)
+        ballots = ballot_matrix([
+            (42, [memphis, nashville, chattanooga, knoxville]),
+            (26, [nashville, chattanooga, knoxville, memphis]),
+            (15, [chattanooga, knoxville, nashville, memphis]),
+            (17, [knoxville, chattanooga, nashville, memphis]),
+        ], 4)
+        rounds, elected, quota = ranked.count(ballots, 4)
+
+        self.assertEqual(elected, [knoxville])
+        self.assertIsNone(quota)
+        self.assertEqual([r['eliminated'] for r in rounds], [[chattanooga], [nashville], []])
+        self.assertEqual(rounds[-1]['tallies'][knoxville], 58)
+
+    def test_stv_party_food(self):
+        orange, pear, chocolate, strawberry, bonbon = range(5)
+        ballots = ballot_matrix([
+            (4, [orange]),
+            (2, [pear, orange]),
+            (8, [chocolate, strawberry]),
+            (4, [chocolate, bonbon]),
+            (1, [strawberry]),
+            (1, [bonbon]),
+        ], 5)
+        rounds, elected, quota = ranked.count(ballots, 5, seats=3, method='stv')
+
+        self.assertEqual(quota, 6)
+        self.assertEqual(elected, [chocolate, orange, strawberry])
+        # Chocolate's surplus of 6 moves on at half value
+        self.assertEqual(rounds[1]['tallies'][strawberry], 5)
+        self.assertEqual(rounds[1]['tallies'][bonbon], 3)
+
+    def test_no_ballots_elects_nobody(self):
+        for method, seats in (('irv', 1), ('stv', 2)):
+            rounds, elected, _ = ranked.count(ballot_matrix([], 3), 3, seats=seats, method=method)
+            self.assertEqual((rounds, elected), ([], []))
+            blank = ballot_matrix([(5, [])], 3)
+            self.assertEqual(ranked.count(blank, 3, seats=seats, method=method)[1], [])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The single-statement vote path is PostgreSQL only')
+class OneStatementCastTests(TestCase):
+    """casting._cast_in_one_statement, with ids past the 32-bit range of BigAutoField keys"""
+
+    BIG = 2 ** 31 + 7
+
+    @classmethod
+    def setUpTestData(cls):
+        branch = Branch.objects.create(pk=cls.BIG, branch_name='Big', branch_code='BIG')
+        user = User.objects.create_user('big')
+        cls.voter = Voter.objects.create(pk=cls.BIG, user=user, name='Big', branch=branch, sex='F', age=20)
+        cls.poll = Poll.objects.create(pk=cls.BIG, question='Big ids', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(pk=cls.BIG, poll=cls.poll)
+
+    def test_ballot_counter_rollups_and_cell_are_written_together(self):
+        [vote] = casting.cast_votes(self.voter, [(self.poll, self.choice, None)])
+
+        self.assertEqual(Vote.objects.get(pk=vote.pk).choice_id, self.BIG)
+        self.assertEqual(Choice.objects.get(pk=self.BIG).votes, 1)
+        self.assertEqual(TurnoutBucket.objects.filter(poll_id=self.BIG, votes=1).count(), 2)
+        self.assertEqual(TurnoutCell.objects.get(poll_id=self.BIG, branch_id=self.BIG).votes, 1)
+
+    def test_a_second_ballot_is_refused_without_writing_anything(self):
+        casting.cast_votes(self.voter, [(self.poll, self.choice, None)])
+        with self.assertRaises(casting.AlreadyVoted):
+            casting.cast_votes(self.voter, [(self.poll, self.choice, None)])
+
+        self.assertEqual(Vote.objects.filter(poll_id=self.BIG).count(), 1)
+        self.assertEqual(Choice.objects.get(pk=self.BIG).votes, 1)
+        self.assertEqual(TurnoutCell.objects.get(poll_id=self.BIG, branch_id=self.BIG).votes, 1)
+
+
+class TurnoutRollupTests(TestCase):
+    START = datetime(2026, 3, 2, 9, 0, tzinfo=dt_timezone.utc)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.poll = Poll.objects.create(question='Turnout', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(poll=cls.poll)
+
+    def at(self, minutes, seconds=0):
+        return self.START + timezone.timedelta(minutes=minutes, seconds=seconds)
+
+    def buckets(self, resolution):
+        return dict(
+            TurnoutBucket.objects.filter(poll=self.poll, resolution=resolution).values_list('bucket_start', 'votes')
+        )
+
+    def test_buckets_start_on_their_boundary_and_end_just_before_the_next(self):
+        self.assertEqual(rollups.bucket_start(self.at(0, 59.999), 60), self.at(0))
+        self.assertEqual(rollups.bucket_start(self.at(1), 60), self.at(1))
+        self.assertEqual(rollups.bucket_start(self.at(59, 59), 3600), self.at(0))
+        self.assertEqual(rollups.bucket_start(self.at(60), 3600), self.at(60))
+
+    def test_ballots_either_side_of_a_boundary_land_in_their_own_bucket(self):
+        rollups.record_votes(self.poll.id, [self.at(0, 59), self.at(1), self.at(1, 30), self.at(60)])
+
+        self.assertEqual(self.buckets('minute'), {self.at(0): 1, self.at(1): 2, self.at(60): 1})
+        self.assertEqual(self.buckets('hour'), {self.at(0): 3, self.at(60): 1})
+
+    def test_backfill_rebuilds_the_buckets_the_vote_path_keeps(self):
+        times = [self.at(0, 59), self.at(1), self.at(61, 5)]
+        for n, voted_at in enumerate(times):
+            voter = Voter.objects.create(user=User.objects.create_user(f'voter{n}'), name=f'Voter {n}', sex='F', age=20)
+            vote = Vote.objects.create(voter=voter, poll=self.poll, choice=self.choice)
+            Vote.objects.filter(pk=vote.pk).update(voted_at=voted_at)
+        rollups.record_votes(self.poll.id, times)
+        recorded = self.buckets('minute'), self.buckets('hour')
+
+        TurnoutBucket.objects.filter(poll=self.poll, resolution='hour').update(votes=0)
+        rollups.backfill([self.poll.id])
+        self.assertEqual((self.buckets('minute'), self.buckets('hour')), recorded)
+
+    def test_timeline_merges_buckets_into_steps(self):
+        rollups.record_votes(self.poll.id, [self.at(0), self.at(1), self.at(3), self.at(3)])
+
+        series = rollups.timeline(self.poll.id, self.at(0), self.at(4), max_points=2)
+        self.assertEqual(series['step_seconds'], 120)
+        self.assertEqual(series['labels'], [self.at(0).isoformat(), self.at(2).isoformat()])
+        self.assertEqual(series['votes'], [2, 2])
+        self.assertEqual(series['cumulative'], [2, 4])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        voter = Voter.objects.create(user=User.objects.create_user('voter'), name='Voter', sex='F', age=20)
+        cls.voter_id = voter.pk
+        cls.poll = Poll.objects.create(question='Kept', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(poll=cls.poll)
+        cls.deleted = Poll.objects.create(question='Deleted', pub_date=timezone.now())
+        Choice.objects.create(poll=cls.deleted)
+        casting.cast_votes(voter, [(cls.poll, cls.choice, None)])
+        deletion.mark_deleted([cls.deleted.id])
+
+    def export(self, kind, fmt):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('polls:export', args=[kind]), {'format': fmt})
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_the_tally_streams_the_live_polls_choices_only(self):
+        lines = self.export('tally', 'csv').splitlines()
+
+        self.assertEqual(lines[0], ','.join(exports.TALLY_HEADER))
+        self.assertEqual([line.split(',')[:2] for line in lines[1:]], [[str(self.poll.id), 'Kept']])
+        self.assertEqual(lines[1].split(',')[-2:], ['1', '100.0'])
+
+    def test_the_ballot_ledger_streams_one_json_object_per_ballot(self):
+        [row] = [json.loads(line) for line in self.export('ballots', 'jsonl').splitlines()]
+
+        self.assertEqual((row['poll_id'], row['choice_id']), (self.poll.id, self.choice.id))
+        self.assertEqual(row['voter_token'], exports.voter_token(self.voter_id))
+
+
+class ArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.poll = Poll.objects.create(question='Last week', pub_date=timezone.now() - timezone.timedelta(days=7))
+        choices = [Choice.objects.create(poll=cls.poll) for _ in range(2)]
+        Choice.objects.filter(pk=choices[0].pk).update(votes=2)
+        cls.ballots = []
+        for n, choice in enumerate([choices[0], choices[0], choices[1]]):
+            voter = Voter.objects.create(user=User.objects.create_user(f'voter{n}'), name=f'Voter {n}', sex='F', age=20)
+            vote = Vote.objects.create(voter=voter, poll=cls.poll, choice=choice)
+            voted_at = cls.poll.pub_date + timezone.timedelta(hours=n, microseconds=123456)
+            Vote.objects.filter(pk=vote.pk).update(voted_at=voted_at)
+            cls.ballots.append((voter.pk, choice.pk, voted_at))
+
+    def test_ballots_come_back_from_the_archive_as_they_went_in(self):
+        archived = archive.archive_poll(self.poll)
+
+        self.assertEqual(archived.ballot_count, 3)
+        self.assertFalse(Vote.objects.filter(poll=self.poll).exists())
+        self.assertEqual(list(archive.iter_ballots(self.poll.id)), self.ballots)
+        # The tally stays where the results pages read it
+        self.assertEqual(sorted(Choice.objects.filter(poll=self.poll).values_list('votes', flat=True)), [0, 2])
+
+    def test_a_damaged_archive_is_refused(self):
+        archived = archive.archive_poll(self.poll)
+        raw = archive.unpack_archive(archived)
+
+        archived.payload = zlib.compress(raw[:-1] + b'\xff')
+        with self.assertRaisesMessage(ValueError, 'Checksum mismatch'):
+            archive.unpack_archive(archived)
+
+        archived.payload = zlib.compress(raw[:-1])
+        archived.checksum = hashlib.sha256(raw[:-1]).hexdigest()
+        with self.assertRaisesMessage(ValueError, 'truncated'):
+            archive.unpack_archive(archived)
+
+    def test_an_open_poll_is_not_archived(self):
+        today = Poll.objects.create(question='Today', pub_date=timezone.now())
+        with self.assertRaisesMessage(ValueError, 'has not closed yet'):
+            archive.archive_poll(today)
+        self.assertEqual(list(archive.archivable_polls()), [self.poll])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CombinedBallotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.voter = Voter.objects.create(user=User.objects.create_user('voter'), name='Voter', sex='F', age=20)
+        cls.polls = [Poll.objects.create(question=question, pub_date=timezone.now()) for question in ('First', 'Second')]
+        cls.choices = [Choice.objects.create(poll=poll) for poll in cls.polls]
+
+    def setUp(self):
+        self.client.force_login(self.voter.user)
+
+    def submit(self):
+        return self.client.post(
+            reverse('polls:ballot'),
+            {f'choice_{choice.poll_id}': choice.id for choice in self.choices},
+        )
+
+    def test_one_submission_casts_a_ballot_in_every_election(self):
+        self.assertRedirects(self.submit(), reverse('polls:index'), fetch_redirect_response=False)
+
+        self.assertEqual(Vote.objects.filter(voter=self.voter).count(), 2)
+        self.assertEqual(list(Choice.objects.order_by('id').values_list('votes', flat=True)), [1, 1])
+
+    def test_a_ballot_already_cast_rolls_back_the_whole_submission(self):
+        # Cast after the voter context was cached, so it doesn't know about it
+        self.client.get(reverse('polls:ballot'))
+        casting.cast_votes(self.voter, [(self.polls[0], self.choices[0], None)])
+
+        response = self.submit()
+        self.assertContains(response, f'You have already voted in: {self.polls[0].title()}.')
+        self.assertFalse(Vote.objects.filter(poll=self.polls[1]).exists())
+        self.assertEqual(Choice.objects.get(pk=self.choices[1].pk).votes, 0)
+        self.assertFalse(TurnoutBucket.objects.filter(poll=self.polls[1]).exists())
+        self.assertFalse(TurnoutCell.objects.filter(poll=self.polls[1]).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VoterContextTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branches = [Branch.objects.create(branch_name=code, branch_code=code) for code in ('CSE', 'ECE')]
+        cls.voter = Voter.objects.create(
+            user=User.objects.create_user('voter'), name='Voter', branch=cls.branches[0], sex='F', age=20,
+        )
+        cls.poll = Poll.objects.create(question='Open', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(poll=cls.poll)
+
+    def setUp(self):
+        self.client.force_login(self.voter.user)
+
+    def context(self):
+        return self.client.session[voter_context.SESSION_KEY]
+
+    def test_later_requests_answer_from_the_session(self):
+        self.client.get(reverse('polls:index'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('polls:index'))
+
+        tables = ' '.join(query['sql'] for query in queries)
+        for table in ('"auth_user"', '"polls_voter"', '"polls_vote"'):
+            self.assertNotIn(table, tables)
+
+    def test_saving_the_voter_profile_rebuilds_the_context(self):
+        self.client.get(reverse('polls:index'))
+        self.assertEqual(self.context()['branch_id'], self.branches[0].id)
+
+        self.voter.branch = self.branches[1]
+        self.voter.save()
+        self.client.get(reverse('polls:index'))
+        self.assertEqual(self.context()['branch_id'], self.branches[1].id)
+
+    def test_a_vote_through_the_app_is_added_in_place(self):
+        self.client.get(reverse('polls:index'))
+        loaded_at = self.context()['loaded_at']
+
+        self.client.post(reverse('polls:ballot'), {f'choice_{self.poll.id}': self.choice.id})
+        self.assertEqual(self.context()['voted'], [self.poll.id])
+        self.assertEqual(self.context()['loaded_at'], loaded_at)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetadataCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.candidate = Candidate.objects.create(user=User.objects.create_user('candidate'), name='Asha', age=21, sex='F')
+        cls.poll = Poll.objects.create(question='Cached', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(poll=cls.poll, candidate=cls.candidate)
+
+    def setUp(self):
+        # Poll ids come round again after each test's rollback
+        cache.clear()
+        metadata._lru.clear()
+
+    def test_a_cached_poll_costs_no_queries(self):
+        metadata.get_poll(self.poll.id)
+        with self.assertNumQueries(0):
+            poll = metadata.get_poll(self.poll.id)
+            self.assertEqual([choice.candidate.name for choice in poll.choices.all()], ['Asha'])
+
+    def test_callers_get_their_own_copy(self):
+        metadata.get_poll(self.poll.id).question = 'Changed by a caller'
+        self.assertEqual(metadata.get_poll(self.poll.id).question, 'Cached')
+
+    def test_saving_the_poll_or_a_candidate_replaces_the_cached_copy(self):
+        metadata.get_poll(self.poll.id)
+
+        self.poll.question = 'Renamed'
+        self.poll.save()
+        self.assertEqual(metadata.get_poll(self.poll.id).question, 'Renamed')
+
+        self.candidate.name = 'Asha K'
+        self.candidate.save()
+        [choice] = metadata.get_poll(self.poll.id).choices.all()
+        self.assertEqual(choice.candidate.name, 'Asha K')
+
+    def test_bulk_updates_need_an_explicit_invalidate(self):
+        metadata.get_poll(self.poll.id)
+        Poll.objects.filter(pk=self.poll.pk).update(question='Updated')
+        self.assertEqual(metadata.get_poll(self.poll.id).question, 'Cached')
+
+        metadata.invalidate(self.poll.id)
+        self.assertEqual(metadata.get_poll(self.poll.id).question, 'Updated')
+
+    def test_vote_counts_are_read_fresh(self):
+        metadata.get_poll(self.poll.id)
+        Choice.objects.filter(pk=self.choice.pk).update(votes=3)
+
+        [choice] = metadata.get_poll(self.poll.id, with_votes=True).choices.all()
+        self.assertEqual(choice.votes, 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BallotFragmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.voters = [
+            Voter.objects.create(user=User.objects.create_user(name), name=name, sex='F', age=20)
+            for name in ('asha', 'meera')
+        ]
+        cls.poll = Poll.objects.create(question='Fragment', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(poll=cls.poll)
+
+    def setUp(self):
+        cache.clear()
+        metadata._lru.clear()
+        fragments._lru.clear()
+
+    def ballot_page(self, client, voter):
+        client.force_login(voter.user)
+        html = client.get(reverse('polls:detail', args=[self.poll.id])).content.decode()
+        self.assertNotIn(fragments.CSRF_SENTINEL, html)
+        return re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', html).group(1)
+
+    def test_each_request_gets_its_own_token_in_one_shared_fragment(self):
+        with mock.patch.object(fragments, 'render_to_string', wraps=fragments.render_to_string) as render:
+            tokens = [self.ballot_page(Client(), voter) for voter in self.voters]
+
+        self.assertEqual(render.call_count, 1)
+        self.assertNotEqual(tokens[0], tokens[1])
+
+    def test_the_spliced_token_passes_the_csrf_check(self):
+        client = Client(enforce_csrf_checks=True)
+        token = self.ballot_page(client, self.voters[0])
+
+        response = client.post(reverse('polls:vote', args=[self.poll.id]),
+                               {'choice': self.choice.id, 'csrfmiddlewaretoken': token})
+        self.assertNotEqual(response.status_code, 403)
+        self.assertTrue(Vote.objects.filter(voter=self.voters[0], poll=self.poll).exists())
+
+    def test_editing_the_poll_renders_a_new_fragment(self):
+        self.ballot_page(self.client, self.voters[0])
+        candidate = Candidate.objects.create(user=User.objects.create_user('candidate'), name='Late Entry', age=21, sex='F')
+        Choice.objects.create(poll=self.poll, candidate=candidate)
+
+        html = self.client.get(reverse('polls:detail', args=[self.poll.id])).content.decode()
+        self.assertIn('Late Entry', html)
+
+
+class VendorAssetTests(SimpleTestCase):
+    def setUp(self):
+        assets._vendored.clear()
+        self.addCleanup(assets._vendored.clear)
+
+    def test_a_missing_asset_falls_back_to_the_cdn_with_one_warning(self):
+        with mock.patch.object(assets.finders, 'find', return_value=None), \
+                self.assertLogs('polls.assets', 'WARNING') as logs:
+            self.assertEqual(assets.vendor_url('chartjs'), assets.VENDOR_ASSETS['chartjs']['url'])
+            assets.vendor_url('chartjs')
+        self.assertEqual(len(logs.output), 1)
+
+    @override_settings(STORAGES={'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_a_vendored_asset_is_served_from_our_static_files(self):
+        with mock.patch.object(assets.finders, 'find', return_value=assets.source_path('chartjs')):
+            url = assets.vendor_url('chartjs')
+        self.assertEqual(url, settings.STATIC_URL + assets.VENDOR_ASSETS['chartjs']['path'])
+
+    def test_vendoring_fails_when_a_download_does(self):
+        with mock.patch.object(vendor_assets.Command, 'fetch', side_effect=OSError('unreachable')), \
+                self.assertRaisesMessage(CommandError, 'Could not vendor'):
+            call_command('vendor_assets', force=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+
+@override_settings(RESPONSE_COMPRESSION={'ENABLED': True, 'MIN_SIZE': 200})
+class CompressionTests(SimpleTestCase):
+    BODY = b'<p>' + b'Every ballot counts. ' * 100 + b'</p>'
+
+    def respond(self, response, accept='gzip'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return compression.CompressionMiddleware(lambda request: response)(request)
+
+    def test_large_html_is_gzipped_with_a_weak_etag(self):
+        response = HttpResponse(self.BODY, content_type='text/html; charset=utf-8')
+        response['ETag'] = '"v1"'
+        response = self.respond(response)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.BODY)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['ETag'], 'W/"v1"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_small_responses_vary_but_stay_uncompressed(self):
+        response = self.respond(HttpResponse(b'{"ok": true}', content_type='application/json'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_streams_other_types_and_refused_encodings_are_left_alone(self):
+        responses = [
+            self.respond(StreamingHttpResponse(iter([self.BODY]), content_type='text/html')),
+            self.respond(HttpResponse(self.BODY, content_type='text/csv')),
+            self.respond(HttpResponse(self.BODY, content_type='text/html'), accept='gzip;q=0, identity'),
+        ]
+        for response in responses:
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_the_client_preference_picks_the_encoding(self):
+        self.assertIsNone(compression.choose_encoding(''))
+        self.assertEqual(compression.choose_encoding('deflate, gzip;q=0.8'), 'gzip')
+        preferred = 'br' if compression.brotli is not None else 'gzip'
+        self.assertEqual(compression.choose_encoding('*'), preferred)
+        self.assertEqual(compression.choose_encoding('br;q=0.5, gzip;q=0.9'), 'gzip')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.voter = Voter.objects.create(user=User.objects.create_user('voter'), name='Voter', sex='F', age=20)
+        cls.poll = Poll.objects.create(question='Async', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(poll=cls.poll)
+
+    def setUp(self):
+        cache.clear()
+        metadata._lru.clear()
+
+    async def test_a_vote_through_the_async_view_is_recorded(self):
+        await self.async_client.aforce_login(self.voter.user)
+        response = await self.async_client.post(reverse('polls:vote', args=[self.poll.id]), {'choice': self.choice.id})
+
+        self.assertRedirects(response, reverse('polls:results', args=[self.poll.id]), fetch_redirect_response=False)
+        self.assertEqual(await Vote.objects.filter(voter=self.voter, poll=self.poll).acount(), 1)
+        self.assertEqual((await Choice.objects.aget(pk=self.choice.pk)).votes, 1)
+
+        response = await self.async_client.get(reverse('polls:results', args=[self.poll.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['poll'].choices.all()[0].votes, 1)
+
+    async def test_async_views_send_anonymous_users_to_log_in(self):
+        for url in (reverse('polls:results', args=[self.poll.id]), reverse('polls:results_stream', args=[self.poll.id])):
+            response = await self.async_client.get(url)
+            self.assertRedirects(response, f'{reverse("polls:login")}?next={url}', fetch_redirect_response=False)
+
+    async def test_the_results_stream_pushes_the_counts(self):
+        await self.async_client.aforce_login(self.voter.user)
+        response = await self.async_client.get(reverse('polls:results_stream', args=[self.poll.id]))
+        self.assertTrue(response.streaming)
+
+        events = aiter(response.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b'retry:'))
+        event = json.loads((await anext(events)).decode().removeprefix('data: '))
+        self.assertEqual(event, {'choices': {str(self.choice.id): 0}, 'total': 0})
+        await events.aclose()
+
+    def test_under_wsgi_the_results_stream_is_one_snapshot(self):
+        self.client.force_login(self.voter.user)
+        response = self.client.get(reverse('polls:results_stream', args=[self.poll.id]))
+
+        self.assertFalse(response.streaming)
+        retry, event = response.content.decode().strip().split('\n\n')
+        self.assertTrue(retry.startswith('retry:'))
+        self.assertEqual(json.loads(event.removeprefix('data: '))['total'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BootTests(TestCase):
+    def run_boot(self):
+        # The warm step's own command prints to stdout
+        with mock.patch.object(boot_command.Command, 'migrate') as migrate, \
+                mock.patch.object(boot_command.Command, 'seed') as seed, \
+                contextlib.redirect_stdout(io.StringIO()):
+            call_command('boot', skip_static=True, snapshot=os.path.join(tempfile.gettempdir(), 'no-snapshot'))
+        return migrate, seed
+
+    def test_steps_already_done_for_their_fingerprint_are_skipped(self):
+        boot.record_step('schema', boot.schema_fingerprint())
+        boot.record_step('seed', boot.seed_fingerprint())
+
+        migrate, seed = self.run_boot()
+        migrate.assert_not_called()
+        seed.assert_not_called()
+
+    def test_a_changed_fingerprint_runs_its_step_again(self):
+        boot.record_step('schema', 'migrations before the last deploy')
+        boot.record_step('seed', boot.seed_fingerprint())
+
+        migrate, seed = self.run_boot()
+        migrate.assert_called_once_with(boot.schema_fingerprint())
+        seed.assert_not_called()
+
+    def test_static_files_are_collected_once_per_fingerprint(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with override_settings(STATIC_ROOT=static_root):
+            self.assertFalse(boot.static_collected('abc'))
+            boot.record_static('abc')
+            self.assertTrue(boot.static_collected('abc'))
+            self.assertFalse(boot.static_collected('def'))
+
+
+@override_settings(READINESS={'TIMEOUT': 0.2, 'CACHE_SECONDS': 60, 'MAX_INGESTION_LAG': 60})
+class ReadinessTests(TestCase):
+    def setUp(self):
+        health._running.clear()
+        health._last.update(result=None, at=0.0)
+        self.addCleanup(health._running.clear)
+        self.addCleanup(health._last.update, result=None, at=0.0)
+
+    def test_a_hung_check_fails_the_probe_without_being_started_again(self):
+        released = threading.Event()
+        self.addCleanup(released.set)
+        hung = mock.Mock(side_effect=lambda: released.wait(5) and 'ok')
+
+        with mock.patch.dict(health.CHECKS, {'hung': hung, 'fine': lambda: 'ok'}, clear=True):
+            first = health.evaluate()
+            second = health.evaluate()
+            released.set()
+            health._running['hung'].result(timeout=5)
+            third = health.evaluate()
+
+        self.assertEqual(first['checks']['hung'], {'ok': False, 'detail': 'no answer within 0.2s'})
+        self.assertTrue(first['checks']['fine']['ok'])
+        self.assertEqual(second['checks']['hung'], {'ok': False, 'detail': 'still running from an earlier probe'})
+        self.assertTrue(third['ready'])
+        self.assertEqual(hung.call_count, 2)
+
+    def test_a_failing_check_makes_the_endpoint_unavailable(self):
+        def broken():
+            raise health.NotReady('cache did not return the value just written')
+
+        with mock.patch.dict(health.CHECKS, {'cache': broken}, clear=True):
+            response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['checks']['cache']['detail'], 'cache did not return the value just written')
+
+    def test_probes_within_cache_seconds_share_one_evaluation(self):
+        check = mock.Mock(return_value='ok')
+        with mock.patch.dict(health.CHECKS, {'check': check}, clear=True):
+            health.readiness()
+            health.readiness()
+        self.assertEqual(check.call_count, 1)
+
+    def test_ballots_left_unreconciled_too_long_fail_ingestion(self):
+        voter = Voter.objects.create(user=User.objects.create_user('voter'), name='Voter', sex='F', age=20)
+        poll = Poll.objects.create(question='Lagging', pub_date=timezone.now())
+        vote = Vote.objects.create(voter=voter, poll=poll, choice=Choice.objects.create(poll=poll))
+        TallyWatermark.objects.create(name=tallies.WATERMARK_NAME)
+        self.assertRegex(health.check_ingestion(), r'^oldest unreconciled ballot is \d+s old$')
+
+        Vote.objects.filter(pk=vote.pk).update(voted_at=timezone.now() - timezone.timedelta(minutes=5))
+        with self.assertRaisesMessage(health.NotReady, '(limit 60s)'):
+            health.check_ingestion()
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(jobs.HANDLERS, {'test_job': mock.Mock(return_value={'done': True})})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_a_job_is_claimed_by_one_runner_only(self):
+        job = jobs.enqueue('test_job')
+
+        claimed = jobs.claim('runner-1')
+        self.assertEqual((claimed.pk, claimed.status, claimed.locked_by, claimed.attempts), (job.pk, Job.RUNNING, 'runner-1', 1))
+        self.assertIsNone(jobs.claim('runner-2'))
+
+    def test_unique_jobs_are_queued_once(self):
+        first = jobs.enqueue('test_job', {'poll_ids': [1]}, unique=True)
+        self.assertEqual(jobs.enqueue('test_job', {'poll_ids': [1]}, unique=True), first)
+        self.assertNotEqual(jobs.enqueue('test_job', {'poll_ids': [2]}, unique=True), first)
+
+    def test_a_failed_attempt_is_retried_later_then_given_up(self):
+        jobs.HANDLERS['test_job'].side_effect = RuntimeError('boom')
+        job = jobs.enqueue('test_job', max_attempts=2)
+
+        with self.assertLogs('polls.jobs', 'WARNING'):
+            self.assertFalse(jobs.run(jobs.claim('runner')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(jobs.claim('runner'))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('polls.jobs', 'WARNING'):
+            self.assertFalse(jobs.run(jobs.claim('runner')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('RuntimeError: boom', job.error)
+
+    def test_a_job_whose_runner_stopped_is_requeued(self):
+        jobs.enqueue('test_job')
+        job = jobs.claim('runner-1')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timezone.timedelta(seconds=jobs.LEASE_SECONDS + 1))
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim('runner-2').pk, job.pk)
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, 'needs SELECT ... SKIP LOCKED')
+class ConcurrentJobClaimTests(TransactionTestCase):
+    def test_runners_claim_different_jobs(self):
+        with mock.patch.dict(jobs.HANDLERS, {'test_job': mock.Mock()}):
+            first, second = jobs.enqueue('test_job'), jobs.enqueue('test_job')
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_first_job():
+            try:
+                with transaction.atomic():
+                    Job.objects.select_for_update().get(pk=first.pk)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connections.close_all()
+
+        holder = threading.Thread(target=hold_first_job)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            job = jobs.claim('runner-2')
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(job.pk, second.pk)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.QUEUED)
+
+
+class AdminChangeListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin')
+        cls.branch = Branch.objects.create(branch_name='Computer Science', branch_code='CSE')
+        cls.rows = 0
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            type(self).rows += 1
+            n = self.rows
+            candidate = Candidate.objects.create(
+                user=User.objects.create_user(f'candidate{n}'), name=f'Candidate {n}', age=21, sex='F', branch=self.branch,
+            )
+            voter = Voter.objects.create(
+                user=User.objects.create_user(f'voter{n}'), name=f'Voter {n}', sex='F', age=20, branch=self.branch,
+            )
+            poll = Poll.objects.create(question=f'Poll {n}', pub_date=timezone.now(), branch=self.branch)
+            choice = Choice.objects.create(poll=poll, candidate=candidate)
+            Vote.objects.create(voter=voter, poll=poll, choice=choice)
+
+    def queries_for(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_run_the_same_queries_for_more_rows(self):
+        for model in ('vote', 'choice', 'poll', 'voter', 'candidate'):
+            with self.subTest(model=model):
+                url = reverse(f'admin:polls_{model}_changelist')
+                self.add_rows(1)
+                few = self.queries_for(url)
+                self.add_rows(5)
+                self.assertEqual(self.queries_for(url), few)
+
+    def test_large_unfiltered_lists_show_an_estimated_count(self):
+        self.add_rows(3)
+        url = reverse('admin:polls_vote_changelist')
+
+        with mock.patch.object(admin.EstimatedCountPaginator, 'EXACT_LIMIT', 2), \
+                mock.patch.object(admin, 'estimated_rows', return_value=1000):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            # Only capped counts ran, never a COUNT(*) over the whole table
+            counts = [query['sql'] for query in queries if 'COUNT(' in query['sql']]
+            filtered = self.client.get(url, {'poll__id__exact': Vote.objects.first().poll_id})
+
+        self.assertEqual(response.context['cl'].result_count, 1000)
+        self.assertTrue(counts)
+        self.assertTrue(all('LIMIT' in sql for sql in counts), counts)
+        self.assertEqual(filtered.context['cl'].result_count, 1)
+
+    @skipUnless(connection.vendor == 'sqlite', 'PostgreSQL reads the planner estimate')
+    def test_sqlite_estimates_from_the_highest_id(self):
+        self.add_rows(3)
+        Vote.objects.order_by('pk').first().delete()
+        self.assertEqual(admin.estimated_rows(Vote, 'default'), Vote.objects.aggregate(largest=Max('pk'))['largest'])
+
+
+class BulkOperationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.voter = Voter.objects.create(user=User.objects.create_user('voter'), name='Voter', sex='F', age=20)
+        cls.today = Poll.objects.create(question='Today', pub_date=timezone.now())
+        cls.other = Poll.objects.create(question='Also today', pub_date=timezone.now())
+        cls.past = Poll.objects.create(question='Last week', pub_date=timezone.now() - timezone.timedelta(days=7))
+        cls.choices = {poll.id: Choice.objects.create(poll=poll) for poll in (cls.today, cls.other, cls.past)}
+
+    def test_no_ballot_lands_in_a_poll_frozen_after_it_was_loaded(self):
+        # As loaded from the cached metadata before the freeze
+        stale = [(poll, self.choices[poll.id], None) for poll in (self.today, self.other)]
+        bulk.freeze([self.today.id])
+
+        with self.assertRaisesMessage(casting.BallotError, 'Voting is closed for: Today.'):
+            casting.cast_votes(self.voter, stale)
+        self.assertFalse(Vote.objects.exists())
+        self.assertFalse(Choice.objects.filter(votes__gt=0).exists())
+        self.assertFalse(TurnoutBucket.objects.exists())
+
+    def test_no_ballot_lands_in_a_poll_deleted_after_it_was_loaded(self):
+        stale = [(poll, self.choices[poll.id], None) for poll in (self.today, self.other)]
+        Poll.all_objects.filter(pk=self.today.pk).update(deleted_at=timezone.now())
+
+        with self.assertRaisesMessage(casting.BallotError, 'Voting is closed for: Today.'):
+            casting.cast_votes(self.voter, stale)
+        self.assertFalse(Vote.objects.exists())
+        self.assertFalse(Choice.objects.filter(votes__gt=0).exists())
+
+    def test_archive_reports_the_polls_it_skips(self):
+        result = bulk.archive({self.today.id, self.past.id})
+        self.assertEqual(result['skipped'], [self.today.id])
+        self.assertEqual(Job.objects.get(pk=result['job']).payload, {'poll_ids': [self.past.id]})
+
+        result = bulk.archive({self.today.id})
+        self.assertEqual(result, {'job': None, 'skipped': [self.today.id]})
+
+
+class ReconcileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.voters = [
+            Voter.objects.create(user=User.objects.create_user(f'voter{n}'), name=f'Voter {n}', sex='F', age=20)
+            for n in range(3)
+        ]
+        cls.poll = Poll.objects.create(question='Reconciled', pub_date=timezone.now())
+        cls.choice = Choice.objects.create(poll=cls.poll)
+
+    def cast(self, voter):
+        [vote] = casting.cast_votes(voter, [(self.poll, self.choice, None)])
+        return vote
+
+    def test_drift_is_repaired(self):
+        self.cast(self.voters[0])
+        self.cast(self.voters[1])
+        Choice.objects.filter(pk=self.choice.pk).update(votes=5)
+
+        drifts, scanned = tallies.reconcile(repair=True)
+        self.assertEqual([(d.choice_id, d.stored, d.counted) for d in drifts], [(self.choice.id, 5, 2)])
+        self.assertEqual(scanned, 2)
+        self.assertEqual(Choice.objects.get(pk=self.choice.pk).votes, 2)
+
+    def test_a_ballot_cast_after_the_scan_survives_the_repair(self):
+        self.cast(self.voters[0])
+        Choice.objects.filter(pk=self.choice.pk).update(votes=0)
+        scan = tallies._scan
+
+        def scan_then_cast(*args):
+            result = scan(*args)
+            self.cast(self.voters[1])
+            return result
+
+        with mock.patch.object(tallies, '_scan', scan_then_cast):
+            drifts, _ = tallies.reconcile(repair=True)
+        self.assertEqual([(d.stored, d.counted) for d in drifts], [(0, 1)])
+        self.assertEqual(Choice.objects.get(pk=self.choice.pk).votes, 2)
+
+    def test_incremental_runs_move_the_watermark_past_settled_ballots_only(self):
+        settled = self.cast(self.voters[0])
+        Vote.objects.filter(pk=settled.pk).update(voted_at=timezone.now() - timezone.timedelta(minutes=1))
+        self.cast(self.voters[1])
+
+        self.assertEqual(tallies.reconcile(incremental=True, lag_seconds=5), ([], 2))
+        watermark = TallyWatermark.objects.get(name=tallies.WATERMARK_NAME)
+        self.assertEqual(watermark.vote_id, settled.pk)
+        self.assertEqual(watermark.counts, {str(self.choice.id): 1})
+
+        # The next run counts on from the watermark: the recent ballot and a new one
+        self.cast(self.voters[2])
+        self.assertEqual(tallies.reconcile(incremental=True, lag_seconds=5), ([], 2))
+        self.assertEqual(tallies.unreconciled_votes().count(), 2)
+
+
+class DeletionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.poll = Poll.objects.create(question='Deleted', pub_date=timezone.now())
+        choice = Choice.objects.create(poll=cls.poll)
+        for n in range(5):
+            voter = Voter.objects.create(user=User.objects.create_user(f'voter{n}'), name=f'Voter {n}', sex='F', age=20)
+            casting.cast_votes(voter, [(cls.poll, choice, None)])
+
+    def test_each_chunk_is_a_single_delete(self):
+        config = dict(deletion.get_config(), INITIAL_CHUNK=2, MIN_CHUNK=2, MAX_CHUNK=2, PAUSE_MS=0)
+        chunks = []
+        with CaptureQueriesContext(connection) as queries:
+            deleted, _ = deletion.delete_in_chunks(
+                Vote.objects.filter(poll=self.poll), lambda done, seconds: chunks.append(done), config,
+            )
+
+        self.assertEqual((deleted, chunks), (5, [2, 4, 5]))
+        # Three chunks and the one that finds nothing left
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['DELETE'] * 4)
+
+    def test_chunks_are_sized_to_the_lock_budget(self):
+        config = {'MAX_LOCK_MS': 50, 'MIN_CHUNK': 50, 'MAX_CHUNK': 20000}
+        self.assertEqual(deletion.next_chunk(1000, 0.1, config), 400)
+        # Fast chunks grow at most twofold, and never past the bounds
+        self.assertEqual(deletion.next_chunk(1000, 0.001, config), 2000)
+        self.assertEqual(deletion.next_chunk(1000, 0, config), 2000)
+        self.assertEqual(deletion.next_chunk(15000, 0.001, config), 20000)
+        self.assertEqual(deletion.next_chunk(100, 10, config), 50)
+
+    def test_a_poll_marked_deleted_is_hidden_then_purged(self):
+        deletion.mark_deleted([self.poll.id])
+        self.assertFalse(Poll.objects.filter(pk=self.poll.pk).exists())
+        self.assertTrue(Poll.all_objects.filter(pk=self.poll.pk).exists())
+
+        result = deletion.purge([self.poll.id])
+        self.assertEqual((result['polls'], result['ballots']), (1, 5))
+        self.assertFalse(Poll.all_objects.filter(pk=self.poll.pk).exists())
+        self.assertFalse(Choice.objects.exists())
+        self.assertFalse(Vote.objects.exists())
+        self.assertFalse(TurnoutBucket.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SessionTests(TestCase):
+    def test_every_session_mode_keeps_its_data(self):
+        for mode, engine in settings.SESSION_ENGINES.items():
+            with self.subTest(mode), override_settings(SESSION_ENGINE=engine):
+                store = import_module(engine).SessionStore()
+                store['answer'] = 42
+                store.save()
+                self.assertEqual(import_module(engine).SessionStore(store.session_key)['answer'], 42)
+
+    def test_coalesced_sessions_write_the_database_for_durable_changes_only(self):
+        store = sessions.SessionStore()
+        store['_auth_user_id'] = '1'
+        store.save()
+
+        store = sessions.SessionStore(store.session_key)
+        store['_messages'] = 'Thanks for voting'
+        with CaptureQueriesContext(connection) as queries:
+            store.save()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(sessions.SessionStore(store.session_key)['_messages'], 'Thanks for voting')
+
+        store['_auth_user_id'] = '2'
+        with CaptureQueriesContext(connection) as queries:
+            store.save()
+        self.assertTrue(queries)
+        self.assertEqual(DBSessionStore(store.session_key)['_auth_user_id'], '2')
+
+    def expire_sessions(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f'expired{n}', session_data='', expire_date=now - timezone.timedelta(days=1))
+             for n in range(5)]
+            + [Session(session_key='live', session_data='', expire_date=now + timezone.timedelta(days=1))]
+        )
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_expired_sessions_are_purged_a_batch_per_delete(self):
+        self.expire_sessions()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sessions.purge_expired(batch_size=2, pause=0), 5)
+
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+        # Three batches and the one that finds nothing left
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['DELETE'] * 4)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_sessions_outside_the_database_leave_the_table_alone(self):
+        self.expire_sessions()
+        self.assertEqual(sessions.purge_expired(), 0)
+        self.assertEqual(Session.objects.count(), 6)
+
+    @override_settings(SESSION_ENGINE='polls.sessions')
+    def test_the_purge_job_reports_what_it_removed(self):
+        self.expire_sessions()
+        jobs.enqueue('purge_sessions')
+        job = jobs.claim('tests')
+
+        self.assertTrue(jobs.run(job))
+        self.assertEqual(Job.objects.get(pk=job.pk).result, {'purged': 5})
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Shards sit next to a SQLite primary')
+class ShardedCastTests(TestCase):
+    """Ballots for a poll with its own shard, next to one in the default database"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # One directory for the class: poll ids come round again after each
+        # test's rollback, and connections to a shard outlive its file
+        directory = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, directory)
+        cls.sharded = override_settings(VOTE_SHARDING={'ENABLED': True, 'DIRECTORY': directory})
+
+    def setUp(self):
+        self.sharded.enable()
+        self.addCleanup(self.sharded.disable)
+
+        branch = Branch.objects.create(branch_name='CSE', branch_code='CSE')
+        self.voters = [
+            Voter.objects.create(user=User.objects.create_user(name), name=name, branch=branch, sex='F', age=19)
+            for name in ('asha', 'meera')
+        ]
+        self.poll = Poll.objects.create(question='Sharded', pub_date=timezone.now())
+        self.choice = Choice.objects.create(poll=self.poll)
+        self.addCleanup(sharding.drop_shard, self.poll.id)
+        self.shard = sharding.create_shard(self.poll.id)
+        self.plain = Poll.objects.create(question='Plain', pub_date=timezone.now())
+        self.plain_choice = Choice.objects.create(poll=self.plain)
+
+    def cast(self, voter, *polls):
+        choices = {self.poll.id: self.choice, self.plain.id: self.plain_choice}
+        return casting.cast_votes(voter, [(poll, choices[poll.id], None) for poll in polls])
+
+    def test_a_sharded_ballot_is_counted_in_its_shard_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.cast(self.voters[0], self.poll)
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+
+        self.assertEqual(Vote.objects.using(self.shard).count(), 1)
+        self.assertEqual(ChoiceTally.objects.using(self.shard).get(choice_id=self.choice.id).votes, 1)
+        self.assertEqual(TurnoutBucket.objects.using(self.shard).filter(votes=1).count(), 2)
+        self.assertEqual(TurnoutCell.objects.using(self.shard).get(sex='F', age_band='18-20').votes, 1)
+        self.assertEqual(Choice.objects.get(pk=self.choice.pk).votes, 0)
+        self.assertFalse(TurnoutCell.objects.using('default').exists())
+
+        self.cast(self.voters[1], self.poll)
+        self.assertEqual(tallies.choice_votes([self.poll.id]), {self.choice.id: 2})
+        poll = metadata.get_poll(self.poll.id, with_votes=True)
+        self.assertEqual([choice.votes for choice in poll.choices.all()], [2])
+
+    def test_a_refused_submission_writes_nothing_anywhere(self):
+        self.cast(self.voters[0], self.poll)
+        with self.assertRaises(casting.AlreadyVoted):
+            self.cast(self.voters[0], self.plain, self.poll)
+
+        self.assertFalse(Vote.objects.using('default').exists())
+        self.assertEqual(Choice.objects.get(pk=self.plain_choice.pk).votes, 0)
+        self.assertEqual(Vote.objects.using(self.shard).count(), 1)
+        self.assertEqual(ChoiceTally.objects.using(self.shard).get().votes, 1)
+
+    def test_recount_and_rebuild_repair_the_shard(self):
+        self.cast(self.voters[0], self.plain, self.poll)
+        cells = set(TurnoutCell.objects.using(self.shard).values_list('branch_id', 'sex', 'age_band', 'votes', 'eligible'))
+        ChoiceTally.objects.using(self.shard).update(votes=5)
+        TurnoutCell.objects.using(self.shard).update(votes=5)
+
+        drifts, scanned = tallies.reconcile(repair=True)
+        self.assertEqual([(drift.choice_id, drift.stored, drift.counted) for drift in drifts], [(self.choice.id, 5, 1)])
+        self.assertEqual(scanned, 2)
+        self.assertEqual(tallies.choice_votes([self.poll.id, self.plain.id]), {self.choice.id: 1, self.plain_choice.id: 1})
+
+        demographics.rebuild()
+        self.assertEqual(
+            set(TurnoutCell.objects.using(self.shard).values_list('branch_id', 'sex', 'age_band', 'votes', 'eligible')),
+            cells,
+        )
+
+    def test_no_ballot_lands_after_a_freeze(self):
+        self.cast(self.voters[0], self.poll)
+        self.assertEqual(bulk.freeze([self.poll.id])['repaired'], [])
+        with self.assertRaises(casting.BallotError):
+            self.cast(self.voters[1], self.poll)
+        self.assertEqual(Vote.objects.using(self.shard).count(), 1)
+
+    def test_generated_ballots_are_counted_in_the_shard(self):
+        Poll.objects.filter(pk=self.plain.pk).update(is_active=False)
+        call_command('populate_votes', votes=2, stdout=io.StringIO())
+
+        self.assertEqual(Vote.objects.using(self.shard).count(), 2)
+        self.assertEqual(ChoiceTally.objects.using(self.shard).get(choice_id=self.choice.id).votes, 2)
+        self.assertEqual(TurnoutCell.objects.using(self.shard).get(sex='F', age_band='18-20').votes, 2)
+        self.assertEqual(Choice.objects.get(pk=self.choice.pk).votes, 0)
+        self.assertFalse(TurnoutBucket.objects.using('default').exists())
+        self.assertFalse(TurnoutCell.objects.using('default').exists())
+
+    def test_moving_ballots_into_a_new_shard_keeps_rankings_and_times(self):
+        voted_at = timezone.now() - timezone.timedelta(days=3)
+        ranking = ranked.encode_ranking([self.plain_choice.id, self.choice.id])
+        vote = Vote.objects.create(voter=self.voters[0], poll=self.plain, choice=self.plain_choice, ranking=ranking)
+        Vote.objects.filter(pk=vote.pk).update(voted_at=voted_at)
+
+        self.addCleanup(sharding.drop_shard, self.plain.id)
+        call_command('vote_shards', 'create', poll=[self.plain.id], stdout=io.StringIO())
+        moved = Vote.objects.using(sharding.db_for_poll(self.plain.id)).get(pk=vote.pk)
+        self.assertEqual(bytes(moved.ranking), ranking)
+        self.assertEqual(moved.voted_at, voted_at)
+        self.assertFalse(Vote.objects.using('default').exists())
+
+    def test_archiving_copies_the_counters_out_of_the_shard(self):
+        self.cast(self.voters[0], self.poll)
+        Poll.objects.filter(pk=self.poll.pk).update(pub_date=timezone.now() - timezone.timedelta(days=1))
+
+        archive.archive_poll(Poll.objects.get(pk=self.poll.pk))
+        self.assertFalse(Vote.objects.using(self.shard).exists())
+        self.assertEqual(Choice.objects.get(pk=self.choice.pk).votes, 1)
+        self.assertEqual(TurnoutCell.objects.using('default').get(poll=self.poll, sex='F', age_band='18-20').votes, 1)
@@ -10,12 +10,19 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('candidate/add/', views.add_candidate, name='add_candidate'),
     path('', views.IndexView.as_view(), name='index'),
+    path('ballot/', views.ballot, name='ballot'),
     path('past-elections/', views.PastElectionsView.as_view(), name='past_elections'),
     path('create/', views.create_poll, name='create'),
     path('stats/', views.election_stats, name='stats'),
+    path('stats/turnout/', views.turnout_breakdown, name='turnout_breakdown'),
+    path('export/<str:kind>/', views.export_data, name='export'),
+    path('jobs/<int:job_id>/output/', views.job_output, name='job_output'),
+    path('api/polls/bulk/', views.bulk_polls, name='bulk_polls'),
     path('<int:poll_id>/stats/', views.poll_stats, name='poll_stats'),
+    path('<int:poll_id>/stats/turnout/', views.poll_turnout, name='poll_turnout'),
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results/stream/', views.results_stream, name='results_stream'),
     path('<int:poll_id>/vote/', views.vote, name='vote'),
     path('<int:poll_id>/delete/', views.delete_poll, name='delete_poll'),
 ] 
\ No newline at end of file
@@ -1,18 +1,29 @@
+import asyncio
+import os
+import time
+from functools import wraps
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponseRedirect
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse, Http404
 from django.urls import reverse
 from django.views import generic
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib import messages
+from django.core.cache import cache
 from django.db.models import Count, Sum, Q
-from django.db import models, transaction
+from django.db import transaction
 import json
-from .models import Poll, Choice, Vote, Voter, Candidate, Branch, Department
+from .models import Poll, Choice, Vote, Voter, Candidate, Branch, Department, Job
 from .forms import UserRegistrationForm, VoterProfileForm, CandidateRegistrationForm
+from . import archive, bulk, casting, demographics, eligibility, exports, jobs, metadata, ranked, replicas, rollups, sharding, tallies, voter_context
+from .replicas import ReadFromReplicaMixin, read_from_replica
 
 def register(request):
     if request.method == 'POST':
@@ -74,26 +85,49 @@ def register_candidate(request, user_id):
     
     return render(request, 'polls/register_candidate.html', {'form': form})
 
+def async_login_required(view):
+    """
+    login_required for async views.
+
+    The voter context middleware has already resolved the session's user,
+    so this costs no query (and doesn't touch the lazy request.user, which
+    can't load from the database inside the event loop).
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.voter_context is None:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+# Templates may still touch the database (context processors, lazy
+# relations), so async views render in a worker thread
+arender = sync_to_async(render)
+
 class IndexView(LoginRequiredMixin, generic.ListView):
     template_name = 'polls/index.html'
     context_object_name = 'latest_poll_list'
 
     def get_queryset(self):
-        # Auto-archive: Mark past elections as inactive efficiently
+        # Auto-archive: past elections are marked inactive by a background
+        # job, queued at most once a minute; the list below already leaves
+        # them out by date
         today = timezone.now().date()
-        
-        # Use bulk update to avoid N+1 queries
-        Poll.objects.filter(
-            pub_date__date__lt=today,
-            is_active=True
-        ).update(is_active=False)
-            
+        if cache.add('polls:close-expired-queued', True, 60):
+            jobs.enqueue('close_expired_polls', unique=True)
+
         # Get active polls excluding past elections
-        return Poll.objects.filter(
+        polls = Poll.objects.filter(
             is_active=True,
             pub_date__date__gte=today
         ).order_by('pub_date')
 
+        # Voters only see elections open to their branch; staff see everything
+        context = self.request.voter_context
+        if not context['is_staff'] and context['voter_id'] is not None:
+            polls = polls.filter(eligibility.open_to(context['branch_id']))
+        return polls
+
 class DetailView(LoginRequiredMixin, generic.DetailView):
     model = Poll
     template_name = 'polls/detail.html'
@@ -101,6 +135,13 @@ class DetailView(LoginRequiredMixin, generic.DetailView):
     def get_queryset(self):
         # Return all polls without filtering by pub_date
         return Poll.objects.all()
+
+    def get_object(self, queryset=None):
+        # Poll, choices and candidates come from the metadata cache
+        try:
+            return metadata.get_poll(self.kwargs['pk'])
+        except Poll.DoesNotExist:
+            raise Http404('No poll found matching the query')
         
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -108,86 +149,183 @@ class DetailView(LoginRequiredMixin, generic.DetailView):
         context['now'] = timezone.now()
         return context
 
-class ResultsView(LoginRequiredMixin, generic.DetailView):
-    model = Poll
+class ResultsView(ReadFromReplicaMixin, generic.View):
     template_name = 'polls/results.html'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['now'] = timezone.now()
-        return context
+    async def get(self, request, pk):
+        if request.voter_context is None:
+            return redirect_to_login(request.get_full_path())
+        try:
+            poll = await sync_to_async(metadata.get_poll)(pk, with_votes=True)
+        except Poll.DoesNotExist:
+            raise Http404('No poll found matching the query')
+        return await arender(request, self.template_name, {
+            'poll': poll,
+            'object': poll,
+            'view': self,
+            'now': timezone.now(),
+        })
 
-@login_required
-def vote(request, poll_id):
-    poll = get_object_or_404(Poll, pk=poll_id)
+# Seconds between vote count checks on a live results stream, and how long
+# one connection is kept open before the browser is told to reconnect
+RESULTS_STREAM_INTERVAL = 2
+RESULTS_STREAM_SECONDS = 300
+
+async def _results_event(poll_id):
+    counts = await sync_to_async(tallies.choice_votes)([poll_id])
+    return counts, f'data: {json.dumps({"choices": counts, "total": sum(counts.values())})}\n\n'
+
+@async_login_required
+async def results_stream(request, pk):
+    """Server-sent events with the poll's vote counts whenever they change"""
+    if not await Poll.objects.filter(pk=pk).aexists():
+        raise Http404('No poll found matching the query')
+    retry = f'retry: {RESULTS_STREAM_INTERVAL * 1000}\n\n'
+
+    if not isinstance(request, ASGIRequest):
+        # A held-open stream would tie up a sync worker for its whole
+        # lifetime, so under WSGI send one snapshot and let the browser poll
+        _, event = await _results_event(pk)
+        response = HttpResponse(retry + event, content_type='text/event-stream')
+    else:
+        async def events():
+            yield retry
+            last = None
+            deadline = time.monotonic() + RESULTS_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                counts, event = await _results_event(pk)
+                if counts != last:
+                    last = counts
+                    yield event
+                await asyncio.sleep(RESULTS_STREAM_INTERVAL)
+        response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@async_login_required
+async def vote(request, poll_id):
+    try:
+        poll = await sync_to_async(metadata.get_poll)(poll_id)
+    except Poll.DoesNotExist:
+        raise Http404('No poll found matching the query')
     
     # Make sure the poll is active and today is the election date
     if not poll.is_currently_active():
         messages.error(request, 'This election is not active for today. Voting is only allowed on the scheduled election date.')
         return redirect('polls:index')
     
+    # Check if user is a voter (from the session's cached voter context)
+    context = request.voter_context
+    if context['voter_id'] is None:
+        messages.error(request, 'You need to complete your voter registration profile before voting.')
+        return redirect('polls:register_voter', user_id=context['user_id'])
+    
+    voter = voter_context.voter(context)
+
+    # Branch-scoped elections are only open to voters of that branch
+    if not await sync_to_async(eligibility.is_eligible)(poll.id, voter.branch_id):
+        messages.error(request, 'This election is only open to voters of another branch.')
+        return redirect('polls:index')
+    
     # Check if the user has already voted
-    user = request.user
-    if Vote.objects.filter(poll=poll, voter__user=user).exists():
+    if poll.id in context['voted']:
         messages.error(request, 'You have already voted in this election.')
         return redirect('polls:results', pk=poll.id)
     
-    # Check if user is a voter
-    if not hasattr(user, 'voter'):
-        messages.error(request, 'You need to complete your voter registration profile before voting.')
-        return redirect('polls:register_voter', user_id=user.id)
-    
-    voter = user.voter
-    
     if request.method == 'POST':
-        try:
+        ranking = None
+        if poll.is_ranked():
+            # Ranked polls submit a rank_<choice id> number per candidate
+            try:
+                ranked_choices = casting.parse_ranking(request.POST, poll.choices.all())
+            except casting.BallotError as e:
+                return await arender(request, 'polls/detail.html', {
+                    'poll': poll,
+                    'error_message': str(e),
+                })
+            selected_choice = ranked_choices[0]
+            ranking = ranked.encode_ranking([choice.id for choice in ranked_choices])
+        else:
             # Make sure a choice was selected
             if 'choice' not in request.POST:
-                return render(request, 'polls/detail.html', {
+                return await arender(request, 'polls/detail.html', {
                     'poll': poll,
                     'error_message': "You didn't select a choice.",
                 })
             
             # Ensure the choice exists
             choice_id = request.POST['choice']
-            selected_choice = poll.choices.get(pk=choice_id)
-            
-            # Use database transaction to ensure atomicity
-            with transaction.atomic():
-                # Re-check vote status inside transaction to be safe
-                if Vote.objects.filter(poll=poll, voter=voter).exists():
-                    messages.error(request, 'You have already voted in this election.')
-                    return redirect('polls:results', pk=poll.id)
-
-                # Increment the choice's vote count atomically using F-expression
-                # This prevents race conditions under high concurrency
-                selected_choice.votes = models.F('votes') + 1
-                selected_choice.save()
-                
-                # Record the vote
-                Vote.objects.create(
-                    voter=voter,
-                    poll=poll,
-                    choice=selected_choice
-                )
-            
-            messages.success(request, 'Your vote has been recorded!')
-            return HttpResponseRedirect(reverse('polls:results', args=(poll.id,)))
-            
-        except Choice.DoesNotExist:
-            messages.error(request, 'The selected choice does not exist.')
-            return render(request, 'polls/detail.html', {
-                'poll': poll,
-                'error_message': "The selected choice does not exist.",
-            })
+            selected_choice = next(
+                (choice for choice in poll.choices.all() if str(choice.id) == choice_id), None
+            )
+            if selected_choice is None:
+                messages.error(request, 'The selected choice does not exist.')
+                return await arender(request, 'polls/detail.html', {
+                    'poll': poll,
+                    'error_message': "The selected choice does not exist.",
+                })
+        
+        # The same write-only transaction as the combined ballot (counter,
+        # ballot in the poll's own database, rollups), run in a worker
+        # thread since Django's transactions are sync only. A duplicate is
+        # caught by the unique (voter, poll) constraint
+        try:
+            await sync_to_async(casting.cast_votes)(voter, [(poll, selected_choice, ranking)])
+        except casting.AlreadyVoted:
+            # The session context didn't know about a vote cast elsewhere
+            voter_context.record_votes(request, [poll.id])
+            messages.error(request, 'You have already voted in this election.')
+            return redirect('polls:results', pk=poll.id)
         except Exception as e:
             messages.error(request, f'Error recording vote: {str(e)}')
-            return render(request, 'polls/detail.html', {
+            return await arender(request, 'polls/detail.html', {
                 'poll': poll,
                 'error_message': f"Error recording vote: {str(e)}",
             })
+        
+        voter_context.record_votes(request, [poll.id])
+        messages.success(request, 'Your vote has been recorded!')
+        return HttpResponseRedirect(reverse('polls:results', args=(poll.id,)))
     
-    return render(request, 'polls/detail.html', {'poll': poll})
+    return await arender(request, 'polls/detail.html', {'poll': poll})
+
+@login_required
+def ballot(request):
+    # One page and one POST for every election open today
+    context = request.voter_context
+    if context['voter_id'] is None:
+        messages.error(request, 'You need to complete your voter registration profile before voting.')
+        return redirect('polls:register_voter', user_id=context['user_id'])
+
+    voter = voter_context.voter(context)
+    polls = list(casting.active_polls(voter.branch_id))
+    voted = set(context['voted'])
+
+    if request.method == 'POST':
+        open_polls = [poll for poll in polls if poll.id not in voted]
+        try:
+            selections = casting.parse_selections(request.POST, open_polls)
+            votes = casting.cast_votes(voter, selections)
+        except casting.AlreadyVoted as e:
+            voter_context.record_votes(request, [poll.id for poll in e.polls])
+            return render(request, 'polls/ballot.html', {
+                'polls': polls,
+                'voted_poll_ids': voted | {poll.id for poll in e.polls},
+                'error_message': str(e),
+            })
+        except casting.BallotError as e:
+            return render(request, 'polls/ballot.html', {
+                'polls': polls,
+                'voted_poll_ids': voted,
+                'error_message': str(e),
+            })
+
+        voter_context.record_votes(request, [vote.poll_id for vote in votes])
+        messages.success(request, f'Your votes in {len(votes)} election(s) have been recorded!')
+        return redirect('polls:index')
+
+    return render(request, 'polls/ballot.html', {'polls': polls, 'voted_poll_ids': voted})
 
 @login_required
 def create_poll(request):
@@ -198,13 +336,21 @@ def create_poll(request):
     if request.method == 'POST':
         department = request.POST.get('department')
         question = request.POST.get('question')
+        branch_id = request.POST.get('branch') or None
         start_date = request.POST.get('start_date')
+        voting_method = request.POST.get('voting_method', 'plurality')
+        if voting_method not in dict(Poll.VOTING_METHOD_CHOICES):
+            voting_method = 'plurality'
+        try:
+            seats = max(int(request.POST.get('seats') or 1), 1)
+        except ValueError:
+            seats = 1
         selected_candidates = request.POST.getlist('candidates')
         
         if not selected_candidates:
             messages.error(request, 'Please select at least one candidate for the election.')
             candidates = Candidate.objects.all()
-            return render(request, 'polls/create.html', {'candidates': candidates})
+            return render(request, 'polls/create.html', {'candidates': candidates, 'branches': Branch.objects.all()})
         
         # Parse date if provided
         pub_date = timezone.now()
@@ -216,10 +362,17 @@ def create_poll(request):
         poll = Poll.objects.create(
             department=department,
             question=question,
+            branch_id=branch_id,
             pub_date=pub_date,
-            is_active=True
+            is_active=True,
+            voting_method=voting_method,
+            seats=seats if voting_method == 'stv' else 1
         )
         
+        # Give the election its own ballot database when sharding is on
+        if sharding.is_enabled():
+            sharding.create_shard(poll.id)
+        
         # Add only selected candidates as choices
         for candidate_id in selected_candidates:
             try:
@@ -236,7 +389,7 @@ def create_poll(request):
     
     # Get all candidates to display in the form
     candidates = Candidate.objects.all()
-    return render(request, 'polls/create.html', {'candidates': candidates})
+    return render(request, 'polls/create.html', {'candidates': candidates, 'branches': Branch.objects.all()})
 
 def logout_confirm(request):
     return render(request, 'polls/logout_confirm.html')
@@ -310,22 +463,40 @@ def delete_poll(request, poll_id):
     poll = get_object_or_404(Poll, pk=poll_id)
     
     if request.method == 'POST':
-        # Delete the poll and redirect to index
-        poll_name = poll.title()
-        poll.delete()
-        messages.success(request, f'Election "{poll_name}" has been deleted successfully.')
+        # Hidden from every view now; its ballots are purged in short
+        # transactions by a background job, so a large election doesn't
+        # hold the database write lock for the whole cascade
+        result = bulk.run('delete', [poll.id], user=request.user)
+        messages.success(request, f'Election "{poll.title()}" is being deleted (job #{result["job"]}).')
         return redirect('polls:index')
     
     # Show confirmation page
     return render(request, 'polls/delete_confirm.html', {'poll': poll})
 
-@login_required
-def poll_stats(request, poll_id):
-    poll = get_object_or_404(Poll, pk=poll_id)
-    choices = Choice.objects.filter(poll=poll)
+def _vote_timeline(poll):
+    ballot_archive = getattr(poll, 'ballot_archive', None)
+    if ballot_archive is not None:
+        return archive.recent_archived_ballots(ballot_archive, 50)
+    # Prefetched rather than joined: shard databases have no voter
+    # or choice tables to join against
+    return list(
+        Vote.objects.using(sharding.db_for_poll(poll.id))
+        .filter(poll=poll)
+        .prefetch_related('voter', 'choice__candidate')
+        .order_by('-voted_at')[:50]
+    )
+
+@read_from_replica
+@async_login_required
+async def poll_stats(request, poll_id):
+    try:
+        poll = await sync_to_async(metadata.get_poll)(poll_id, with_votes=True)
+    except Poll.DoesNotExist:
+        raise Http404('No poll found matching the query')
+    choices = poll.choices.all()
     
     # Skip polls with no choices
-    if not choices.exists():
+    if not choices:
         messages.warning(request, 'This election has no candidates to display stats for.')
         return redirect('polls:detail', pk=poll_id)
     
@@ -356,7 +527,7 @@ def poll_stats(request, poll_id):
     chart_data_json = json.dumps(chart_data)
     
     # Get voter information
-    total_voters = Voter.objects.count()
+    total_voters = await Voter.objects.acount()
     participation_rate = 0
     if total_voters > 0:
         participation_rate = round((total_poll_votes / total_voters) * 100, 1)
@@ -369,71 +540,141 @@ def poll_stats(request, poll_id):
         'participation_rate': participation_rate,
     }
     
+    # Ranked polls also get the round-by-round count
+    if poll.is_ranked():
+        context['ranked'] = await sync_to_async(ranked.count_poll)(poll, choices, total_poll_votes)
+    
     # Only include vote timeline for admin users
-    if request.user.is_staff:
-        vote_timeline = Vote.objects.filter(poll=poll).order_by('-voted_at')[:50]
-        context['vote_timeline'] = vote_timeline
+    if request.voter_context['is_staff']:
+        context['vote_timeline'] = await sync_to_async(_vote_timeline)(poll)
     
-    return render(request, 'polls/poll_stats.html', context)
+    return await arender(request, 'polls/poll_stats.html', context)
 
-@login_required
-def election_stats(request):
+@read_from_replica
+@async_login_required
+async def poll_turnout(request, poll_id):
+    try:
+        poll = await Poll.objects.only('id').aget(pk=poll_id)
+    except Poll.DoesNotExist:
+        raise Http404('No poll found matching the query')
+    # Optional ISO-8601 window, e.g. ?start=2025-05-16T08:00:00Z&end=2025-05-16T18:00:00Z
+    start = parse_datetime(request.GET['start']) if request.GET.get('start') else None
+    end = parse_datetime(request.GET['end']) if request.GET.get('end') else None
+    if (request.GET.get('start') and start is None) or (request.GET.get('end') and end is None):
+        return JsonResponse({'error': 'start and end must be ISO-8601 datetimes'}, status=400)
+    if start and timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if end and timezone.is_naive(end):
+        end = timezone.make_aware(end)
+
+    try:
+        points = min(max(int(request.GET.get('points', 120)), 1), 1000)
+    except ValueError:
+        return JsonResponse({'error': 'points must be an integer'}, status=400)
+
+    data = await sync_to_async(rollups.timeline)(poll.id, start=start, end=end, max_points=points)
+    data['poll'] = poll.id
+    return JsonResponse(data)
+
+@read_from_replica
+@async_login_required
+async def turnout_breakdown(request):
+    # Turnout by voter group from the precomputed cube, e.g.
+    # ?poll=3&poll=4&by=branch&by=sex; ?format=json for the raw rows
+    by = [dimension for dimension in request.GET.getlist('by') if dimension in demographics.DIMENSIONS] or ['branch']
+    polls = [poll async for poll in Poll.objects.only('id', 'question', 'department', 'pub_date').order_by('-pub_date')]
+    try:
+        selected = {int(poll_id) for poll_id in request.GET.getlist('poll')}
+    except ValueError:
+        return JsonResponse({'error': 'poll must be an election id'}, status=400)
+    poll_ids = [poll.id for poll in polls if not selected or poll.id in selected]
+
+    rows = await sync_to_async(demographics.breakdown)(poll_ids, by)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'polls': poll_ids, 'by': by, 'rows': rows})
+
+    votes = sum(row['votes'] for row in rows)
+    eligible = sum(row['eligible'] for row in rows)
+    return await arender(request, 'polls/turnout_breakdown.html', {
+        'polls': polls,
+        'selected': selected,
+        'by': by,
+        'dimensions': list(demographics.DIMENSIONS),
+        'rows': rows,
+        'total_votes': votes,
+        'total_eligible': eligible,
+        'total_turnout': round(votes / eligible * 100, 1) if eligible else None,
+    })
+
+@read_from_replica
+@async_login_required
+async def election_stats(request):
     # Get all departments from the DEPARTMENT_CHOICES in Poll model
     departments = [dept[0] for dept in Poll.DEPARTMENT_CHOICES]
     
     # Get total elections, votes, and candidates
-    total_elections = Poll.objects.count()
-    total_votes = Vote.objects.count()
-    total_candidates = Candidate.objects.count()
+    total_elections = await Poll.objects.acount()
+    # Sum the vote counters rather than counting Vote, which no longer
+    # holds the ballots of archived elections. Sharded polls keep theirs
+    # in their shards
+    sharded = await sync_to_async(tallies.sharded_votes)()
+    if sharded:
+        live = {poll_id async for poll_id in Poll.objects.filter(pk__in=list(sharded)).values_list('id', flat=True)}
+        sharded = {poll_id: counts for poll_id, counts in sharded.items() if poll_id in live}
+    total_votes = (await Choice.objects.filter(poll__deleted_at__isnull=True).exclude(poll_id__in=list(sharded))
+                   .aaggregate(total=Sum('votes')))['total'] or 0
+    total_votes += sum(sum(counts.values()) for counts in sharded.values())
+    total_candidates = await Candidate.objects.acount()
+    
+    # Every choice with its candidate in one query, grouped by poll
+    poll_choices = {}
+    async for choice in Choice.objects.select_related('candidate').order_by('id'):
+        poll_choices.setdefault(choice.poll_id, []).append(choice)
+    for poll_id, counts in sharded.items():
+        for choice in poll_choices.get(poll_id, []):
+            choice.votes = counts.get(choice.id, 0)
     
     # Organize polls by department
     dept_polls = {}
-    for dept in departments:
-        polls = Poll.objects.filter(department=dept)
-        
-        # Skip if no polls for this department
-        if not polls.exists():
+    async for poll in Poll.objects.filter(department__in=departments):
+        # Skip polls with no choices
+        choices = poll_choices.get(poll.id)
+        if not choices:
+            dept_polls.setdefault(poll.department, [])
             continue
-            
-        dept_polls[dept] = []
         
-        # Process each poll for chart data
-        for poll in polls:
-            choices = Choice.objects.filter(poll=poll)
-            
-            # Skip polls with no choices
-            if not choices.exists():
-                continue
-                
-            total_poll_votes = sum(choice.votes for choice in choices)
-            
-            # Prepare chart data
-            labels = []
-            votes = []
-            percentages = []
-            
-            for choice in choices:
-                candidate_name = choice.candidate.name if choice.candidate else "Unknown"
-                labels.append(candidate_name)
-                votes.append(choice.votes)
-                percentage = 0
-                if total_poll_votes > 0:
-                    percentage = round((choice.votes / total_poll_votes) * 100, 1)
-                percentages.append(percentage)
-            
-            # Add poll with chart data to department
-            poll_data = {
-                'id': poll.id,
-                'title': poll.title(),
-                'pub_date': poll.pub_date,
-                'chart_data': {
-                    'labels': labels,
-                    'votes': votes,
-                    'percentages': percentages
-                }
+        total_poll_votes = sum(choice.votes for choice in choices)
+        
+        # Prepare chart data
+        labels = []
+        votes = []
+        percentages = []
+        
+        for choice in choices:
+            candidate_name = choice.candidate.name if choice.candidate else "Unknown"
+            labels.append(candidate_name)
+            votes.append(choice.votes)
+            percentage = 0
+            if total_poll_votes > 0:
+                percentage = round((choice.votes / total_poll_votes) * 100, 1)
+            percentages.append(percentage)
+        
+        # Add poll with chart data to department
+        poll_data = {
+            'id': poll.id,
+            'title': poll.title(),
+            'pub_date': poll.pub_date,
+            'chart_data': {
+                'labels': labels,
+                'votes': votes,
+                'percentages': percentages
             }
-            
-            dept_polls[dept].append(poll_data)
+        }
+        
+        dept_polls.setdefault(poll.department, []).append(poll_data)
+    
+    # Keep departments in DEPARTMENT_CHOICES order
+    dept_polls = {dept: dept_polls[dept] for dept in departments if dept in dept_polls}
     
     # Calculate REAL participation data
     participation_data = {
@@ -441,8 +682,7 @@ def election_stats(request):
         'participation': []
     }
     
-    total_registered_voters = Voter.objects.count()
-    
+    total_registered_voters = await Voter.objects.acount()
     for dept in departments:
         if dept in dept_polls and total_registered_voters > 0:
             # Aggregate total votes for all polls in this department
@@ -481,9 +721,90 @@ def election_stats(request):
         'participation_data': participation_data
     }
     
-    return render(request, 'polls/stats.html', context)
+    return await arender(request, 'polls/stats.html', context)
+
+@read_from_replica
+@login_required
+def export_data(request, kind):
+    # Check if user is admin
+    if not request.user.is_staff:
+        messages.error(request, 'Only admins can export election data.')
+        return redirect('polls:index')
+
+    if kind not in exports.EXPORTS:
+        raise Http404('Unknown export')
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        fmt = 'csv'
+
+    poll_ids = None
+    if request.GET.getlist('poll'):
+        try:
+            poll_ids = [int(poll_id) for poll_id in request.GET.getlist('poll')]
+        except ValueError:
+            raise Http404('Invalid poll id')
+
+    if request.GET.get('background'):
+        # Written to a file by the job runner; the admin links to it when done
+        job = jobs.enqueue('export', {'kind': kind, 'fmt': fmt, 'poll_ids': poll_ids}, user=request.user)
+        messages.success(request, f'Export queued as job #{job.id}; download it from the admin when it has finished.')
+        return redirect(reverse('admin:polls_job_change', args=[job.id]))
+
+    # Stream rows straight from the database cursor so memory stays flat
+    # The rows are read after the view has returned, so carry its replica along
+    response = StreamingHttpResponse(
+        replicas.stream_from(replicas.current(), exports.export_stream(kind, fmt, poll_ids)),
+        content_type=exports.FORMATS[fmt],
+    )
+    suffix = f"-poll-{'-'.join(map(str, poll_ids))}" if poll_ids else ''
+    response['Content-Disposition'] = f'attachment; filename="{kind}{suffix}.{fmt}"'
+    return response
+
+def bulk_polls(request):
+    """
+    Staff API: run one operation over a set of polls.
+
+    POST JSON {"action": "close" | "recount" | "freeze" | "archive" |
+    "delete", "polls": [poll ids]}. Archive and delete answer with the id
+    of the job doing the work; archive also lists the polls it skipped
+    because they haven't been held yet or are already archived (with a
+    null job if that was all of them).
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        body = json.loads(request.body)
+        action = body['action']
+        poll_ids = [int(poll_id) for poll_id in body['polls']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"action": ..., "polls": [ids]}'}, status=400)
+    if action not in bulk.ACTIONS:
+        return JsonResponse({'error': f'Unknown action, expected one of {", ".join(bulk.ACTIONS)}'}, status=400)
+
+    found = set(Poll.objects.filter(pk__in=poll_ids).values_list('id', flat=True))
+    missing = sorted(set(poll_ids) - found)
+    if missing:
+        return JsonResponse({'error': 'Unknown polls', 'polls': missing}, status=404)
+
+    result = bulk.run(action, found, user=request.user)
+    return JsonResponse({'action': action, 'polls': sorted(found), 'result': result})
+
+@login_required
+def job_output(request, job_id):
+    if not request.user.is_staff:
+        messages.error(request, 'Only admins can download job output.')
+        return redirect('polls:index')
+
+    job = get_object_or_404(Job, pk=job_id, status=Job.SUCCEEDED)
+    path = (job.result or {}).get('path')
+    if not path or not os.path.exists(path):
+        raise Http404('This job has no output')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
 
-class PastElectionsView(LoginRequiredMixin, generic.ListView):
+class PastElectionsView(ReadFromReplicaMixin, LoginRequiredMixin, generic.ListView):
     template_name = 'polls/past_elections.html'
     context_object_name = 'past_poll_list'
     
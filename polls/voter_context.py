@@ -0,0 +1,167 @@
+"""
+Per-session voter context.
+
+The pages voters hit on election day only need a handful of facts about
+the logged in user: who they are, whether they are staff, their voter
+profile and branch, and which polls they have already voted in. Loading
+those from auth_user, polls_voter and polls_vote on every request is most
+of the query count of the index and the vote pre-checks, so they are kept
+in the session instead and request.user becomes a stand-in that answers
+from them, only loading the real user if something else is asked for.
+
+A context is rebuilt when the user or their voter profile is saved
+(through a per-user version number in the cache), after MAX_AGE seconds,
+or when the session changes hands. Votes cast through the app update it
+in place.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.contrib.auth import SESSION_KEY as AUTH_SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import sharding
+from .models import Vote, Voter
+
+SESSION_KEY = '_voter_context'
+
+# Longest a session trusts its context without going back to the database,
+# which also bounds how long another worker's staff or password change can
+# go unnoticed when the cache isn't shared
+MAX_AGE = 300
+
+
+def _version_key(user_id):
+    return f'polls:voter-context:{user_id}'
+
+
+def invalidate(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), 1, None)
+
+
+def build(user):
+    voter = Voter.objects.filter(user_id=user.pk).values('id', 'branch_id', 'sex', 'age').first()
+    voted = set()
+    if voter is not None:
+        for db in sharding.ballot_databases():
+            voted.update(Vote.objects.using(db).filter(voter_id=voter['id']).values_list('poll_id', flat=True))
+    return {
+        'user_id': user.pk,
+        'username': user.get_username(),
+        'is_staff': user.is_staff,
+        'voter_id': voter['id'] if voter else None,
+        'branch_id': voter['branch_id'] if voter else None,
+        # The voter's group in the turnout cube (polls/demographics.py)
+        'sex': voter['sex'] if voter else '',
+        'age': voter['age'] if voter else None,
+        'voted': sorted(voted),
+        'version': cache.get(_version_key(user.pk), 0),
+        'loaded_at': time.time(),
+    }
+
+
+def get(request):
+    """Return the context for the request's user, or None if nobody is logged in"""
+    session_user_id = request.session.get(AUTH_SESSION_KEY)
+    if session_user_id is None:
+        return None
+
+    context = request.session.get(SESSION_KEY)
+    if (context is not None
+            and str(context['user_id']) == str(session_user_id)
+            and context['version'] == cache.get(_version_key(context['user_id']), 0)
+            and time.time() - context['loaded_at'] < MAX_AGE):
+        return context
+
+    # Full check through the auth backend, including the session hash
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    context = build(user)
+    request.session[SESSION_KEY] = context
+    return context
+
+
+def voter(context):
+    """An unsaved Voter carrying the id, branch, sex and age, for use as a foreign key value"""
+    return Voter(id=context['voter_id'], user_id=context['user_id'], branch_id=context['branch_id'],
+                 sex=context.get('sex', ''), age=context.get('age'))
+
+
+def record_votes(request, poll_ids):
+    context = request.session.get(SESSION_KEY)
+    if context is None:
+        return
+    context['voted'] = sorted(set(context['voted']) | set(poll_ids))
+    # Reassign so the session notices the change
+    request.session[SESSION_KEY] = context
+
+
+class ContextUser:
+    """Stands in for request.user, answering common attributes from the context"""
+
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+
+    def __init__(self, context, user):
+        self._user = user
+        self.id = self.pk = context['user_id']
+        self.username = context['username']
+        self.is_staff = context['is_staff']
+
+    def __getattr__(self, name):
+        # Anything else comes from the real (lazily loaded) user
+        return getattr(self._user, name)
+
+    def get_username(self):
+        return self.username
+
+    def __str__(self):
+        return self.username
+
+
+class VoterContextMiddleware:
+    """Attach request.voter_context for views in the polls app"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Passes the coroutine straight through when the chain is async
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.voter_context = None
+        match = request.resolver_match
+        if match is None or 'polls' not in match.namespaces:
+            return None
+
+        context = get(request)
+        if context is not None:
+            request.voter_context = context
+            request.user = ContextUser(context, request.user)
+        return None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _user_changed(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Voter)
+@receiver(post_delete, sender=Voter)
+def _voter_changed(sender, instance, **kwargs):
+    invalidate(instance.user_id)
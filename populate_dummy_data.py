@@ -7,6 +7,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'voting_system.settings')
 django.setup()
 
 from django.utils import timezone
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 
 from polls.models import Poll, Choice, Candidate, Branch, Department
@@ -34,43 +35,56 @@ def populate():
         "Technical Head Election"
     ]
 
+    # One query to find which polls already exist, rather than several per poll
+    existing = set(Poll.objects.filter(question__in=poll_questions).values_list('question', flat=True))
     for question in poll_questions:
-        # Check if poll already exists to prevent duplicates
-        if not Poll.objects.filter(question=question).exists():
-            dept = random.choice(departments)
-            poll = Poll.objects.create(
-                question=question,
-                pub_date=timezone.now(),
-                is_active=True,
-                department=dept.department_name, # Assuming choice field stores name
-                branch=None # General poll
-            )
-            print(f"Created Poll: {question}")
-
-            # Create Candidates for this poll
-            for i in range(3):
-                username = f"candidate_{poll.id}_{i}"
-                if not User.objects.filter(username=username).exists():
-                    user = User.objects.create_user(username=username, password='password123')
-                    candidate = Candidate.objects.create(
-                        user=user,
-                        name=f"Candidate {i+1} for {question}",
-                        age=20 + i,
-                        sex='M' if i % 2 == 0 else 'F',
-                        branch=random.choice(branches),
-                        department=dept,
-                        position="Representative",
-                        is_candidate=True
-                    )
-                    
-                    Choice.objects.create(
-                        poll=poll,
-                        candidate=candidate,
-                        votes=random.randint(0, 50) # Random initial votes
-                    )
-                    print(f"  Added Candidate/Choice: {candidate.name}")
-        else:
+        if question in existing:
             print(f"Poll '{question}' already exists.")
+    missing = [question for question in poll_questions if question not in existing]
+    if not missing:
+        print("Fake data population complete!")
+        return
+
+    branches = list(branches)
+    departments = list(departments)
+    # Hashing a password is deliberately slow, and every candidate gets the same one
+    password = make_password('password123')
+
+    for question in missing:
+        dept = random.choice(departments)
+        poll = Poll.objects.create(
+            question=question,
+            pub_date=timezone.now(),
+            is_active=True,
+            department=dept.department_name, # Assuming choice field stores name
+            branch=None # General poll
+        )
+        print(f"Created Poll: {question}")
+
+        # Create Candidates for this poll
+        usernames = [f"candidate_{poll.id}_{i}" for i in range(3)]
+        taken = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        new = [(i, username) for i, username in enumerate(usernames) if username not in taken]
+        users = User.objects.bulk_create([User(username=username, password=password) for _, username in new])
+        candidates = Candidate.objects.bulk_create([
+            Candidate(
+                user=user,
+                name=f"Candidate {i+1} for {question}",
+                age=20 + i,
+                sex='M' if i % 2 == 0 else 'F',
+                branch=random.choice(branches),
+                department=dept,
+                position="Representative",
+                is_candidate=True
+            )
+            for (i, _), user in zip(new, users)
+        ])
+        Choice.objects.bulk_create([
+            Choice(poll=poll, candidate=candidate, votes=random.randint(0, 50)) # Random initial votes
+            for candidate in candidates
+        ])
+        for candidate in candidates:
+            print(f"  Added Candidate/Choice: {candidate.name}")
 
     print("Fake data population complete!")
 
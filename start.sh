@@ -1,17 +1,38 @@
 #!/bin/bash
 set -e
 
-echo "Running migrations..."
-python manage.py migrate
+# Time-to-first-request is measured from here (see polls/boot.py)
+export BOOT_STARTED_AT="$(date +%s.%N)"
 
-echo "Seeding initial data..."
-python initial_data.py
+# Production rendering: no debug pages, no template autoreload
+export DJANGO_DEBUG="${DJANGO_DEBUG:-0}"
 
-echo "Populating dummy data..."
-python populate_dummy_data.py
+# Restores the seed snapshot into an empty database, then migrates, seeds,
+# collects static files and warms caches only where something changed
+echo "Booting..."
+python manage.py boot
 
-echo "Collecting static files..."
-python manage.py collectstatic --no-input
+# Background jobs (poll deletes, archives, recomputes, exports) run beside
+# the web server; it exits with the container
+echo "Starting job runner..."
+python manage.py run_jobs --concurrency 2 &
+
+# SQLite read replicas (READ_REPLICAS=path[,path...]) are copied from the
+# primary now and then kept current every REPLICA_REFRESH_SECONDS
+if [ -n "$READ_REPLICAS" ]; then
+    echo "Refreshing read replicas..."
+    python manage.py refresh_replicas
+    python manage.py refresh_replicas --loop &
+fi
+
+# Workers are forked from a master that has already loaded the app
+# SERVER_MODE=asgi serves through uvicorn workers: async views (voting,
+# results, stats, live results streams) then wait on the database and on
+# slow clients without holding a worker
+if [ "$SERVER_MODE" = "asgi" ]; then
+    echo "Starting Gunicorn with Uvicorn workers (ASGI)..."
+    exec gunicorn voting_system.asgi:application -k uvicorn_worker.UvicornWorker --preload --bind 0.0.0.0:7860 --workers 2 --timeout 120
+fi
 
 echo "Starting Gunicorn..."
-exec gunicorn voting_system.wsgi:application --bind 0.0.0.0:7860 --workers 2 --timeout 120
+exec gunicorn voting_system.wsgi:application --preload --bind 0.0.0.0:7860 --workers 2 --timeout 120
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'voting_system.settings')
 
 application = get_asgi_application()
+
+# Load URLs and templates now: under gunicorn --preload this happens once
+# in the master and workers fork warm
+from polls.boot import warm_up  # noqa: E402
+
+warm_up()
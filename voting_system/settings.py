@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,7 +24,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-rq7bq1l8#&0_!kkwq5n=mw&^=m40fjp^y@6s=q_dq*11t$!)^z'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# start.sh runs with DJANGO_DEBUG=0 unless told otherwise
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = ['*', '.hf.space', '0.0.0.0']
 
@@ -52,6 +54,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'polls.compression.CompressionMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +62,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'polls.slow_queries.SlowQueryMiddleware',
+    'polls.voter_context.VoterContextMiddleware',
+    'polls.replicas.PinToPrimaryMiddleware',
 ]
 
 ROOT_URLCONF = 'voting_system.urls'
@@ -85,13 +91,81 @@ WSGI_APPLICATION = 'voting_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgres uses PostgreSQL (POSTGRES_* below) instead of the
+# SQLite file. Connections are kept open by each worker thread for
+# DB_CONN_MAX_AGE seconds and checked before reuse; behind a transaction
+# pooler such as PgBouncer set POSTGRES_POOLER=1.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'voting_system'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            # Server-side cursors (.iterator()) don't survive a transaction pooler
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_POOLER', '0') == '1',
+            'OPTIONS': {'connect_timeout': 5},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # A file rather than memory, so the replica tests can copy it
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
     }
+
+# Read replicas (see polls/replicas.py). READ_REPLICAS lists SQLite files
+# that `manage.py refresh_replicas` keeps as copies of a SQLite primary;
+# POSTGRES_REPLICA_HOSTS lists standbys of a PostgreSQL primary. Results,
+# past elections, stats and exports read from them.
+REPLICA_ALIASES = []
+if DB_ENGINE == 'postgres':
+    for n, host in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES[f'replica_{n}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+        REPLICA_ALIASES.append(f'replica_{n}')
+else:
+    for n, path in enumerate(filter(None, os.environ.get('READ_REPLICAS', '').split(',')), 1):
+        DATABASES[f'replica_{n}'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path,
+            'TEST': {'MIRROR': 'default'},
+        }
+        REPLICA_ALIASES.append(f'replica_{n}')
+
+READ_REPLICAS = {
+    'ALIASES': REPLICA_ALIASES,
+    # Reads stay on the primary this long after a client's write
+    'STICKY_SECONDS': int(os.environ.get('REPLICA_STICKY_SECONDS', '15')),
+    'REFRESH_SECONDS': int(os.environ.get('REPLICA_REFRESH_SECONDS', '5')),
+    # A copy not refreshed for this long is skipped
+    'MAX_LAG_SECONDS': int(os.environ.get('REPLICA_MAX_LAG_SECONDS', '60')),
+}
+
+# Per-election ballot storage (see polls/sharding.py). When enabled, each new
+# poll's ballots, vote counters and turnout rollups go to their own SQLite
+# file so elections running at the same time don't share a write lock.
+VOTE_SHARDING = {
+    # Shards are SQLite files, so only alongside a SQLite primary
+    'ENABLED': os.environ.get('VOTE_SHARDING', '0') == '1' and DB_ENGINE == 'sqlite',
+    'DIRECTORY': BASE_DIR / 'vote_shards',
 }
 
+DATABASE_ROUTERS = ['polls.sharding.VoteShardRouter', 'polls.replicas.ReplicaRouter']
+
+# Startup
+# `manage.py boot` (run by start.sh) restores an empty SQLite database from
+# this snapshot, built into the image by `manage.py boot --build-snapshot`
+SEED_SNAPSHOT = Path(os.environ.get('SEED_SNAPSHOT', BASE_DIR / 'seed' / 'seed.sqlite3'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -129,13 +203,126 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-# STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+# collectstatic writes hashed, gzip/brotli-compressed copies (plus WebP
+# versions of images), which WhiteNoise serves with far-future immutable
+# caching. Third-party libraries are vendored with `manage.py vendor_assets`.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'polls.storage.StaticFilesStorage',
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Slow query log
+# Queries issued by the polls views that take longer than THRESHOLD_MS are
+# written to rotating JSONL files, one per process (PATH with the pid added).
+# Summarise them with `manage.py slow_query_report`.
+SLOW_QUERY_LOG = {
+    'ENABLED': os.environ.get('SLOW_QUERY_LOG', '0') == '1',
+    'THRESHOLD_MS': float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100')),
+    'PATH': BASE_DIR / 'logs' / 'slow_queries.jsonl',
+    'MAX_BYTES': 5 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+}
+
+# Readiness probe (/health/ready/, see polls/health.py). Each check gets
+# TIMEOUT seconds and the result is reused for CACHE_SECONDS. Set
+# READINESS_MAX_INGESTION_LAG to fail it when ballots go unreconciled longer
+READINESS = {
+    'TIMEOUT': float(os.environ.get('READINESS_TIMEOUT', '1.0')),
+    'CACHE_SECONDS': float(os.environ.get('READINESS_CACHE_SECONDS', '5')),
+    'MAX_INGESTION_LAG': (
+        float(os.environ['READINESS_MAX_INGESTION_LAG'])
+        if os.environ.get('READINESS_MAX_INGESTION_LAG') else None
+    ),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Time to first request after a container start
+        'polls.boot': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        # Failed background job attempts
+        'polls.jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Background jobs
+# Files written by jobs (background exports) for staff to download
+JOB_OUTPUT_DIR = Path(os.environ.get('JOB_OUTPUT_DIR', BASE_DIR / 'job_output'))
+# Jobs the runner queues by itself, every this many seconds (0 turns one off)
+RECURRING_JOBS = {
+    'purge_sessions': int(os.environ.get('SESSION_PURGE_SECONDS', '3600')),
+}
+
+# Poll deletion
+# A deleted poll disappears at once; its ballots are then purged by a
+# background job in chunks sized so each transaction (and so each hold of
+# the SQLite write lock) takes about MAX_LOCK_MS, with PAUSE_MS between
+# chunks for votes waiting on the lock.
+POLL_DELETION = {
+    'MAX_LOCK_MS': int(os.environ.get('POLL_DELETION_MAX_LOCK_MS', '50')),
+    'PAUSE_MS': int(os.environ.get('POLL_DELETION_PAUSE_MS', '10')),
+}
+
+# Response compression
+# HTML and JSON responses of at least MIN_SIZE bytes are sent brotli or gzip
+# compressed, whichever the client prefers. Static files are precompressed
+# by collectstatic instead.
+RESPONSE_COMPRESSION = {
+    'ENABLED': os.environ.get('RESPONSE_COMPRESSION', '1') == '1',
+    'MIN_SIZE': int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', '1024')),
+    'BROTLI_QUALITY': 5,
+}
+
+# Caches
+# File-based so every gunicorn worker sees the same entries (and the same
+# invalidations) without needing an extra service. Sessions get their own
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'default',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+# Sessions
+# SESSION_MODE picks where session data lives:
+#   db             - django_session table (Django's default)
+#   cache          - the sessions cache only, never touches the database
+#   signed_cookies - stored client side, signed with SECRET_KEY
+#   coalesced      - cached_db that only writes django_session when the login
+#                    state changes or every SESSION_COALESCE_SECONDS
+# Expired rows are removed by the recurring purge_sessions job (see
+# RECURRING_JOBS), or on demand with `manage.py purge_sessions`.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    'coalesced': 'polls.sessions',
+}
+SESSION_MODE = os.environ.get('SESSION_MODE', 'db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_COALESCE_SECONDS = int(os.environ.get('SESSION_COALESCE_SECONDS', '60'))
+
 # Auth settings
 LOGIN_URL = 'polls:login'
 LOGIN_REDIRECT_URL = 'polls:index'